@@ -1,10 +1,23 @@
 # IMPORTS
+import functools
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-import mysql.connector
 from datetime import datetime
 
+import approximate
+import backends
+import figure_cache
+import outcome_model
+import plate_search
+import result_stream
+import vehicle_profiles
+from cube import CUBE_TABLE
+from insights import ADVANCED_SPECS, INSIGHT_SPECS, PANEL_SPECS
+from query_builder import compile_spec, profile_spec
+from rollup import ROLLUP_TABLE, rollup_column
+
 # PAGE CONFIG
 st.set_page_config(page_title="🚓 Police Checkpost Logs Dashboard", layout="wide")
 
@@ -37,24 +50,65 @@ section { padding-top: 80px; }
   <a class="nav-link" href="#search">🔍 Search Explorer</a>
   <a class="nav-link" href="#predict">🤖 Predict Outcome</a>
   <a class="nav-link" href="#about">🧾 About</a>
+  <a class="nav-link" href="#performance">⏱️ Performance</a>
 </div>
 """, unsafe_allow_html=True)
 
 # DATABASE FUNCTIONS
-def get_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",
-        password="mysql@007",   
-        database="Police_checkpost"
-    )
-
-def run_query(query):
-    conn = get_connection()
-    df = pd.read_sql(query, conn)
-    conn.close()
+# One backend (MySQL pool or DuckDB over Parquet, see backends.py) and result
+# cache per server process, shared by every session and kept across reruns.
+# The cache is dropped whenever the underlying data version moves.
+@st.cache_resource
+def get_backend():
+    return backends.get_backend()
+
+# Chart figures shared by every session (see figure_cache.py).
+@st.cache_resource
+def get_figure_cache():
+    return figure_cache.FigureCache()
+
+# Latest trained model artifact (outcome_model.py), loaded once per process.
+# None when no model has been trained yet.
+@st.cache_resource
+def get_model():
+    try:
+        return outcome_model.load_model()
+    except FileNotFoundError:
+        return None
+
+def run_query(query, params=None, name=None):
+    backend = get_backend()
+    df = backend.run_query(query, params, name=name)
+    record_query(executed=not backend.last_was_hit())
     return df
 
+# PANEL QUERY COUNTS
+# Each section records how many queries its latest run issued and how many
+# actually reached the database, so we can check that interacting with one
+# section leaves the others alone.
+def start_panel(name):
+    counts = st.session_state.setdefault("panel_queries", {})
+    entry = counts.setdefault(name, {"runs": 0, "queries": 0, "executed": 0})
+    entry.update(runs=entry["runs"] + 1, queries=0, executed=0)
+    st.session_state.current_panel = name
+
+def record_query(executed):
+    entry = st.session_state.get("panel_queries", {}).get(st.session_state.get("current_panel"))
+    if entry is not None:
+        entry["queries"] += 1
+        entry["executed"] += int(executed)
+
+def panel(name):
+    """Run a section as a Streamlit fragment: its widgets rerun only it."""
+    def decorate(render):
+        @st.fragment
+        @functools.wraps(render)
+        def run():
+            start_panel(name)
+            render()
+        return run
+    return decorate
+
 # OVERVIEW
 st.markdown("<section id='overview'></section>", unsafe_allow_html=True)
 st.title("🚓 Police Checkpost Logs: Police Traffic Stop Analytics Dashboard")
@@ -64,37 +118,192 @@ st.markdown("""
 It connects directly to your **MySQL database** and updates dynamically.
 """)
 
+# FILTER BAR
+# Sidebar filters (country, violation, date range) applied to every panel
+# below: each named query is compiled from its spec in insights.py with the
+# filter values as parameters (see query_builder.py).
+def filter_options(column):
+    df = run_query(
+        f"SELECT DISTINCT {column} FROM {CUBE_TABLE} WHERE {column} IS NOT NULL ORDER BY {column}",
+        name=f"Filter options: {column}",
+    )
+    return df[column].tolist()
+
+def date_bounds():
+    df = run_query(
+        f"SELECT MIN({rollup_column('bucket')}) AS first_day, MAX(bucket) AS last_day "
+        f"FROM {ROLLUP_TABLE} WHERE grain = 'day'",
+        name="Date range bounds",
+    )
+    if df.empty or pd.isna(df["first_day"][0]):
+        return None
+    return pd.Timestamp(df["first_day"][0]).date(), pd.Timestamp(df["last_day"][0]).date()
+
+def render_filter_bar():
+    filters = {}
+    with st.sidebar:
+        st.header("🔎 Filters")
+        filters["country"] = st.multiselect("Country", filter_options("country_name"))
+        filters["violation"] = st.multiselect("Violation", filter_options("violation"))
+        bounds = date_bounds()
+        if bounds is not None:
+            picked = st.date_input("📅 Date range", value=bounds, min_value=bounds[0], max_value=bounds[1])
+            if len(picked) == 2 and tuple(picked) != bounds:
+                filters["date"] = tuple(picked)
+        st.toggle("⚡ Fast approximate mode", key="approximate",
+                  help="Estimate from a stratified sample and sketches, with 95% error bounds.")
+    st.session_state.filters = filters
+    st.session_state.exact_pending = {}
+
+def compiled(specs, name):
+    return compile_spec(specs[name], st.session_state.get("filters"))
+
+# APPROXIMATE MODE
+# With the toggle on, cube-based queries are answered from the stratified
+# sample and the top-plate insights from sketches (see approximate.py), until
+# the exact result is in the cache. Every exact query replaced by an estimate
+# is recorded in exact_pending for "Compute exact results" to run.
+def approximate_mode():
+    return st.session_state.get("approximate", False)
+
+def exact_cached(specs, name):
+    """Whether the exact result for ``name`` is already in the cache."""
+    exact = compiled(specs, name)
+    return get_backend().peek(exact.sql, exact.params) is not None
+
+def chosen_query(specs, name):
+    """The Compiled query whose result is shown for ``name``."""
+    exact = compiled(specs, name)
+    if not approximate_mode() or exact_cached(specs, name):
+        return exact
+    estimate = compile_spec(specs[name], st.session_state.get("filters"), approximate=True)
+    if estimate is None:
+        return exact
+    st.session_state.exact_pending[name] = exact[:2]
+    return estimate
+
+def plate_estimate(specs, name):
+    """(DataFrame, notes) from the plate sketches, or None to run the query."""
+    if not approximate_mode() or approximate.plate_sketch(specs[name]) is None or exact_cached(specs, name):
+        return None
+    if profile_spec(specs[name], st.session_state.get("filters")) is not None:
+        return None  # the exact answer is an index read of vehicle_profiles
+    st.session_state.exact_pending[name] = compiled(specs, name)[:2]
+    return approximate.top_plates(load_sketches(), specs[name], st.session_state.get("filters"))
+
+def load_sketches():
+    sketches = approximate.load_sketches(get_backend())
+    record_query(executed=not get_backend().last_was_hit())
+    return sketches
+
+# The filter bar and the prefetch below run on every full rerun, outside any
+# fragment, so they count under their own entry rather than whichever section
+# ran last.
+start_panel("Page load")
+render_filter_bar()
+
+# PAGE LOAD
+# The KPI and chart queries are independent, so a full run dispatches them
+# together on the backend's worker pool (CHECKPOST_QUERY_WORKERS) and waits
+# only for the slowest. The sections below are then served from the cache.
+# A query that misses CHECKPOST_QUERY_TIMEOUT is reported in its section
+# instead of being run again. Charts already in the figure cache need no query.
+def prefetch_panels():
+    queries = {}
+    for name in PANEL_SPECS:
+        query, figure = panel_figure(name) if name.startswith("Chart:") else (chosen_query(PANEL_SPECS, name), None)
+        if figure is None:
+            queries[name] = query[:2]
+    backend = get_backend()
+    cached = {name for name, (sql, params) in queries.items() if backend.peek(sql, params) is not None}
+    results = backend.run_many(queries)
+    for name in queries:
+        record_query(executed=name not in cached)
+    st.session_state.panel_timeouts = {
+        name: str(result) for name, result in results.items() if isinstance(result, TimeoutError)
+    }
+
+def panel_query(name, query=None):
+    """The PANEL_SPECS result for ``name``, or None if it timed out on page load."""
+    timeout = st.session_state.get("panel_timeouts", {}).get(name)
+    if timeout is not None:
+        st.warning(f"⏱️ {timeout}. Reload the page to try again.")
+        return None
+    query = query or chosen_query(PANEL_SPECS, name)
+    for note in query.notes:
+        st.caption(f"ℹ️ {note}")
+    return run_query(query.sql, query.params, name=name)
+
+# FIGURE CACHE
+# A chart drawn once is reused by every session until the data version moves,
+# skipping both its query and the Plotly build. An exact figure already in
+# the cache is shown even in approximate mode.
+def panel_figure(name):
+    """(Compiled query, its cached figure or None) for PANEL_SPECS ``name``."""
+    figures, version = get_figure_cache(), get_backend().data_version()
+    exact = compiled(PANEL_SPECS, name)
+    figure = figures.get((name,) + exact[:2], version)
+    if figure is not None:
+        return exact, figure
+    query = chosen_query(PANEL_SPECS, name)
+    return query, figures.get((name,) + query[:2], version)
+
+def chart_figure(name, build):
+    """The figure for chart ``name``, from the cache or ``build(df)``."""
+    query, figure = panel_figure(name)
+    if figure is not None:
+        for note in query.notes:
+            st.caption(f"ℹ️ {note}")
+        return figure
+    df = panel_query(name, query)
+    if df is None:
+        return None
+    return get_figure_cache().put((name,) + query[:2], get_backend().data_version(), build(df))
+
+prefetch_panels()
+
 # KPI CARDS
-st.subheader("📈 Key Metrics")
-
-kpi_query = """
-SELECT 
-    COUNT(*) AS total_stops,
-    SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) AS total_arrests,
-    SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS total_searches,
-    SUM(CASE WHEN violation = 'DUI' THEN 1 ELSE 0 END) AS drug_stops
-FROM traffic_stops;
-"""
-df_kpi = run_query(kpi_query)
-
-total_stops = int(df_kpi['total_stops'][0])
-total_arrests = int(df_kpi['total_arrests'][0])
-total_searches = int(df_kpi['total_searches'][0])
-drug_stops = int(df_kpi['drug_stops'][0])
-
-col1, col2, col3, col4 = st.columns(4)
-with col1:
-    st.markdown("<div style='background-color:#e3f2fd;padding:20px;border-radius:12px;text-align:center;'>"
-                f"<h3 style='color:#0d47a1;'>🚔 Total Stops</h3><h2>{total_stops:,}</h2></div>", unsafe_allow_html=True)
-with col2:
-    st.markdown("<div style='background-color:#ffebee;padding:20px;border-radius:12px;text-align:center;'>"
-                f"<h3 style='color:#b71c1c;'>🚨 Arrests</h3><h2>{total_arrests:,}</h2></div>", unsafe_allow_html=True)
-with col3:
-    st.markdown("<div style='background-color:#fff3e0;padding:20px;border-radius:12px;text-align:center;'>"
-                f"<h3 style='color:#e65100;'>🔍 Searches</h3><h2>{total_searches:,}</h2></div>", unsafe_allow_html=True)
-with col4:
-    st.markdown("<div style='background-color:#e8f5e9;padding:20px;border-radius:12px;text-align:center;'>"
-                f"<h3 style='color:#1b5e20;'>💊 DUI </h3><h2>{drug_stops:,}</h2></div>", unsafe_allow_html=True)
+# KPIs and charts read the incrementally maintained summary cube
+# (specs in insights.PANEL_SPECS)
+def render_kpis():
+    start_panel("KPI cards")
+    st.subheader("📈 Key Metrics")
+    df_kpi = panel_query("KPI cards")
+    if df_kpi is None:
+        return
+    df_kpi = df_kpi.fillna(0)  # SUM over no rows when the filters match nothing
+
+    def figure(column):
+        # "≈ 1,234 ± 56" for an estimate
+        value = f"{int(df_kpi[column][0]):,}"
+        if column + "_error" in df_kpi:
+            value = f"≈ {value}<br><small>± {int(df_kpi[column + '_error'][0]):,}</small>"
+        return value
+
+    total_stops = figure('total_stops')
+    total_arrests = figure('total_arrests')
+    total_searches = figure('total_searches')
+    drug_stops = figure('drug_stops')
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.markdown("<div style='background-color:#e3f2fd;padding:20px;border-radius:12px;text-align:center;'>"
+                    f"<h3 style='color:#0d47a1;'>🚔 Total Stops</h3><h2>{total_stops}</h2></div>", unsafe_allow_html=True)
+    with col2:
+        st.markdown("<div style='background-color:#ffebee;padding:20px;border-radius:12px;text-align:center;'>"
+                    f"<h3 style='color:#b71c1c;'>🚨 Arrests</h3><h2>{total_arrests}</h2></div>", unsafe_allow_html=True)
+    with col3:
+        st.markdown("<div style='background-color:#fff3e0;padding:20px;border-radius:12px;text-align:center;'>"
+                    f"<h3 style='color:#e65100;'>🔍 Searches</h3><h2>{total_searches}</h2></div>", unsafe_allow_html=True)
+    with col4:
+        st.markdown("<div style='background-color:#e8f5e9;padding:20px;border-radius:12px;text-align:center;'>"
+                    f"<h3 style='color:#1b5e20;'>💊 DUI </h3><h2>{drug_stops}</h2></div>", unsafe_allow_html=True)
+
+    if approximate_mode():
+        vehicles, error, notes = approximate.distinct_vehicles(load_sketches(), st.session_state.get("filters"))
+        st.caption(f"🚗 ≈ {vehicles:,.0f} distinct vehicles (± {error:,.0f}). " + " ".join(notes))
+
+render_kpis()
 
 st.divider()
 
@@ -102,22 +311,8 @@ st.divider()
 st.markdown("<section id='insights'></section>", unsafe_allow_html=True)
 st.header("📊 Visual Insights")
 
-tab1, tab2, tab3 = st.tabs([
-    "🚓 Stops by Violation",
-    "🚻 Driver Gender Distribution",
-    "⚖️ Stop Outcome Distribution"
-])
-
-# Tab 1: Stops by Violation
-with tab1:
-    vis_query = """
-    SELECT violation AS Violation, COUNT(*) AS Count
-    FROM traffic_stops
-    GROUP BY violation
-    ORDER BY Count DESC;
-    """
-    df_vis = run_query(vis_query)
-
+# Chart 1: Stops by Violation
+def violation_chart(df_vis):
     color_map = {
         "Speeding": "#1f77b4",     
         "Seatbelt": "#ffe70e",    
@@ -131,7 +326,8 @@ with tab1:
         x="Violation",
         y="Count",
         color="Violation",
-        color_discrete_map=color_map
+        color_discrete_map=color_map,
+        error_y="Count_error" if "Count_error" in df_vis else None
     )
 
     fig1.update_layout(
@@ -139,18 +335,10 @@ with tab1:
         yaxis_title="Count",
         showlegend=True
     )
+    return fig1
 
-    st.plotly_chart(fig1, use_container_width=True)
-
-# Tab 2: Gender Distribution
-with tab2:
-    gen_query = """
-        SELECT driver_gender AS Gender, COUNT(*) AS Count
-        FROM traffic_stops
-        GROUP BY driver_gender;
-    """
-    df_gen = run_query(gen_query)
-
+# Chart 2: Gender Distribution
+def gender_chart(df_gen):
     gender_colors = {
         "M": "#1f77b4",     
         "F": "#e377c2"    
@@ -168,18 +356,10 @@ with tab2:
     fig2.update_layout(
         showlegend=True
     )
+    return fig2
 
-    st.plotly_chart(fig2, use_container_width=True)
-
-# Tab 3: Stop Outcome Distribution
-with tab3:
-    out_query = """
-        SELECT stop_outcome AS Outcome, COUNT(*) AS Count
-        FROM traffic_stops
-        GROUP BY stop_outcome;
-    """
-    df_out = run_query(out_query)
-
+# Chart 3: Stop Outcome Distribution
+def outcome_chart(df_out):
     outcome_colors = {
         "Arrest": "#d62728",    
         "Warning": "#ff7f0e",   
@@ -191,7 +371,8 @@ with tab3:
         x="Outcome",
         y="Count",
         color="Outcome",
-        color_discrete_map=outcome_colors
+        color_discrete_map=outcome_colors,
+        error_y="Count_error" if "Count_error" in df_out else None
     )
 
     fig3.update_layout(
@@ -199,192 +380,75 @@ with tab3:
         yaxis_title="Count",
         showlegend=True
     )
+    return fig3
+
+CHARTS = {
+    "🚓 Stops by Violation": ("Chart: stops by violation", violation_chart),
+    "🚻 Driver Gender Distribution": ("Chart: gender distribution", gender_chart),
+    "⚖️ Stop Outcome Distribution": ("Chart: stop outcomes", outcome_chart),
+}
+
+# st.tabs renders every tab on every run; a radio only builds the chart on show.
+@panel("Visual insights")
+def render_charts():
+    chart = st.radio("Chart", list(CHARTS), horizontal=True, label_visibility="collapsed")
+    fig = chart_figure(*CHARTS[chart])
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True)
+
+render_charts()
 
-    st.plotly_chart(fig3, use_container_width=True)
-    
 st.divider()
 
+# RESULT TABLES
+# Results are shown result_stream.PAGE_ROWS rows at a time. The full result
+# is offered as CSV / Parquet, built batch by batch from the backend only
+# when a download button is clicked. Downloads are always exact.
+def download_buttons(name, make_parts, key):
+    slug = "".join(c if c.isalnum() else "_" for c in name.lower()).strip("_")
+    for col, (label, (ext, mime)) in zip(st.columns(len(result_stream.FORMATS)), result_stream.FORMATS.items()):
+        with col:
+            st.download_button(
+                f"⬇️ Download {label}",
+                data=functools.partial(result_stream.export, make_parts, label),
+                file_name=f"{slug}.{ext}",
+                mime=mime,
+                key=f"{key}_{label}",
+                on_click="ignore",
+            )
+
+def show_result(name, specs, key):
+    estimate = plate_estimate(specs, name)
+    if estimate is not None:
+        df, notes = estimate
+    else:
+        query = chosen_query(specs, name)
+        df, notes = run_query(query.sql, query.params, name=name), query.notes
+    for note in notes:
+        st.caption(f"ℹ️ {note}")
+    pages = result_stream.page_count(len(df))
+    page = 0
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page") - 1
+    st.dataframe(result_stream.page_slice(df, page), use_container_width=True)
+    backend = get_backend()
+    exact = compiled(specs, name)
+    download_buttons(name, lambda: backend.stream(exact.sql, exact.params), key)
+
 # INSIGHTS
-st.markdown("<section id='insights'></section>", unsafe_allow_html=True)
 st.header("📊 Insights Dashboard")
 
-option = st.selectbox(
-    "Select a query to run:",
-    [
-        "Top 10 Vehicles in Drug-Related Stops",
-        "Vehicles Most Frequently Searched",
-        "Arrest Rate by Driver Age Group",
-        "Gender Distribution by Country",
-        "Race + Gender Combination with Highest Search Rate",
-        "Traffic Stops by Hour of Day",
-        "Average Stop Duration by Violation",
-        "Are Night Stops More Likely to Lead to Arrests?",
-        "Violations Associated with Highest Search Rate",
-        "Most Common Violations Among Younger Drivers (<25)",
-        "Violations That Rarely Result in Search or Arrest",
-        "Countries with Highest DUI (Drug-Related) Stops",
-        "Arrest Rate by Country and Violation",
-        "Countries with Most Search-Conducted Stops"
-    ]
-)
-
-if st.button("Run Insight Query"):
-     # ---------------- VEHICLE-BASED ----------------
-    if option == "Top 10 Vehicles in Drug-Related Stops":
-        q = """
-            SELECT vehicle_number, COUNT(*) AS total_dui_stops
-            FROM traffic_stops
-            WHERE violation = 'DUI'
-            GROUP BY vehicle_number
-            ORDER BY total_dui_stops DESC
-            LIMIT 10;
-        """
-
-    elif option == "Vehicles Most Frequently Searched":
-        q = """
-            SELECT vehicle_number, COUNT(*) AS search_count
-            FROM traffic_stops
-            WHERE search_conducted = TRUE
-            GROUP BY vehicle_number
-            ORDER BY search_count DESC
-            LIMIT 10;
-        """
-
-    # ---------------- DEMOGRAPHIC-BASED ----------------
-    elif option == "Arrest Rate by Driver Age Group":
-        q = """
-            SELECT 
-                CASE 
-                    WHEN driver_age < 18 THEN 'Under 18'
-                    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-                    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-                    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-                    ELSE '60+' END AS age_group,
-                COUNT(*) AS total_stops,
-                SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) AS total_arrests,
-                ROUND(SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY age_group
-            ORDER BY arrest_rate DESC;
-        """
-
-    elif option == "Gender Distribution by Country":
-        q = """
-            SELECT country_name, driver_gender, COUNT(*) AS total
-            FROM traffic_stops
-            GROUP BY country_name, driver_gender
-            ORDER BY country_name, total DESC;
-        """
-
-    elif option == "Race + Gender Combination with Highest Search Rate":
-        q = """
-            SELECT driver_race, driver_gender,
-                   COUNT(*) AS total_stops,
-                   SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS searches,
-                   ROUND(SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS search_rate
-            FROM traffic_stops
-            GROUP BY driver_race, driver_gender
-            ORDER BY search_rate DESC
-            LIMIT 10;
-        """
-
-    # ---------------- TIME-BASED ----------------
-    elif option == "Traffic Stops by Hour of Day":
-        q = """
-            SELECT HOUR(stop_time) AS hour_of_day, COUNT(*) AS num_stops
-            FROM traffic_stops
-            GROUP BY hour_of_day
-            ORDER BY hour_of_day;
-        """
-
-    elif option == "Average Stop Duration by Violation":
-        q = """
-            SELECT violation, AVG(stop_duration) AS avg_duration
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY avg_duration DESC;
-        """
-
-    elif option == "Are Night Stops More Likely to Lead to Arrests?":
-        q = """
-            SELECT 
-                CASE 
-                    WHEN HOUR(stop_time) BETWEEN 18 AND 23 THEN 'Night'
-                    WHEN HOUR(stop_time) BETWEEN 0 AND 5 THEN 'Late Night'
-                    ELSE 'Daytime'
-                END AS time_period,
-                COUNT(*) AS total_stops,
-                SUM(CASE WHEN stop_outcome='Arrest' THEN 1 ELSE 0 END) AS arrests,
-                ROUND(SUM(CASE WHEN stop_outcome='Arrest' THEN 1 ELSE 0 END)/COUNT(*)*100,2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY time_period
-            ORDER BY arrest_rate DESC;
-        """
-
-    # ---------------- VIOLATION-BASED ----------------
-    elif option == "Violations Associated with Highest Search Rate":
-        q = """
-            SELECT violation,
-                   COUNT(*) AS total_stops,
-                   SUM(CASE WHEN search_conducted=TRUE THEN 1 ELSE 0 END) AS searches,
-                   ROUND(SUM(CASE WHEN search_conducted=TRUE THEN 1 ELSE 0 END)/COUNT(*)*100,2) AS search_rate
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY search_rate DESC;
-        """
-
-    elif option == "Most Common Violations Among Younger Drivers (<25)":
-        q = """
-            SELECT violation, COUNT(*) AS total
-            FROM traffic_stops
-            WHERE driver_age < 25
-            GROUP BY violation
-            ORDER BY total DESC;
-        """
-
-    elif option == "Violations That Rarely Result in Search or Arrest":
-        q = """
-            SELECT violation,
-                   COUNT(*) AS total_stops,
-                   SUM(CASE WHEN search_conducted=TRUE THEN 1 ELSE 0 END) AS searches,
-                   SUM(CASE WHEN stop_outcome='Arrest' THEN 1 ELSE 0 END) AS arrests
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY searches ASC, arrests ASC;
-        """
-
-    # ---------------- LOCATION-BASED ----------------
-    elif option == "Countries with Highest DUI (Drug-Related) Stops":
-        q = """
-            SELECT country_name, COUNT(*) AS dui_stops
-            FROM traffic_stops
-            WHERE violation='DUI'
-            GROUP BY country_name
-            ORDER BY dui_stops DESC;
-        """
-
-    elif option == "Arrest Rate by Country and Violation":
-        q = """
-            SELECT country_name, violation,
-                   COUNT(*) AS total_stops,
-                   SUM(CASE WHEN stop_outcome='Arrest' THEN 1 ELSE 0 END) AS arrests,
-                   ROUND(SUM(CASE WHEN stop_outcome='Arrest' THEN 1 ELSE 0 END)/COUNT(*)*100,2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY country_name, violation
-            ORDER BY arrest_rate DESC;
-        """
-
-    elif option == "Countries with Most Search-Conducted Stops":
-        q = """
-            SELECT country_name, COUNT(*) AS searches
-            FROM traffic_stops
-            WHERE search_conducted=TRUE
-            GROUP BY country_name
-            ORDER BY searches DESC;
-        """
-
-    df = run_query(q)
-    st.dataframe(df, use_container_width=True)
+# Answered from the traffic_stops_cube summary table (see cube.py / insights.py)
+@panel("Insights dashboard")
+def render_insights():
+    option = st.selectbox("Select a query to run:", list(INSIGHT_SPECS))
+
+    if st.button("Run Insight Query"):
+        st.session_state.insight_shown = option
+    if st.session_state.get("insight_shown") == option:
+        show_result(option, INSIGHT_SPECS, key="insight")
+
+render_insights()
 
 st.divider()
 
@@ -392,111 +456,16 @@ st.divider()
 st.markdown("<section id='advanced'></section>", unsafe_allow_html=True)
 st.header("💡 Advanced Insights")
 
-adv_query = st.selectbox(
-    "Select advanced analysis:",
-    [
-        "Yearly Breakdown: Stops & Arrests by Country",
-        "Driver Violation Trends by Age and Race",
-        "Time Period Analysis (Year, Month, Hour)",
-        "Violations with High Search & Arrest Rates",
-        "Driver Demographics by Country",
-        "Top 5 Violations with Highest Arrest Rates"
-    ]
-)
-
-if st.button("Run Advanced Query"):
-    if adv_query == "Yearly Breakdown: Stops & Arrests by Country":
-        q = """
-            SELECT 
-                country_name,
-                YEAR(stop_date) AS year,
-                COUNT(*) AS total_stops,
-                SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) AS total_arrests,
-                ROUND(SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY country_name, year
-            ORDER BY country_name, year;
-        """
-    elif adv_query == "Driver Violation Trends by Age and Race":
-        q = """
-            SELECT v.driver_race,
-                   v.age_group,
-                   v.violation,
-                   COUNT(*) AS total_stops
-            FROM (
-                SELECT 
-                    driver_race,
-                    violation,
-                    CASE 
-                        WHEN driver_age < 18 THEN 'Under 18'
-                        WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-                        WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-                        WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-                        ELSE '60+' 
-                    END AS age_group
-                FROM traffic_stops
-            ) v
-            GROUP BY v.driver_race, v.age_group, v.violation
-            ORDER BY v.driver_race, v.age_group, total_stops DESC;
-        """
-    elif adv_query == "Time Period Analysis (Year, Month, Hour)":
-        q = """
-            SELECT 
-                YEAR(stop_date) AS year,
-                MONTH(stop_date) AS month,
-                HOUR(stop_time) AS hour,
-                COUNT(*) AS total_stops
-            FROM traffic_stops
-            GROUP BY year, month, hour
-            ORDER BY year, month, hour;
-        """
-    elif adv_query == "Violations with High Search & Arrest Rates":
-        q = """
-            SELECT 
-                violation,
-                COUNT(*) AS total_stops,
-                SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) AS searches,
-                SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) AS arrests,
-                ROUND(SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS search_rate,
-                ROUND(SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY arrest_rate DESC;
-        """
-    elif adv_query == "Driver Demographics by Country":
-        q = """
-            SELECT 
-                country_name,
-                driver_gender,
-                driver_race,
-                CASE 
-                    WHEN driver_age < 18 THEN 'Under 18'
-                    WHEN driver_age BETWEEN 18 AND 25 THEN '18-25'
-                    WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
-                    WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
-                    ELSE '60+' END AS age_group,
-                COUNT(*) AS total
-            FROM traffic_stops
-            GROUP BY country_name, driver_gender, driver_race, age_group
-            ORDER BY country_name, total DESC;
-        """
-    elif adv_query == "Top 5 Violations with Highest Arrest Rates":
-        q = """
-            SELECT 
-                violation,
-                COUNT(*) AS total_stops,
-                SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) AS arrests,
-                ROUND(SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END) / COUNT(*) * 100, 2) AS arrest_rate
-            FROM traffic_stops
-            GROUP BY violation
-            ORDER BY arrest_rate DESC
-            LIMIT 5;
-        """
-
-
-
-    df = run_query(q)
-    st.dataframe(df, use_container_width=True)
+@panel("Advanced insights")
+def render_advanced():
+    adv_query = st.selectbox("Select advanced analysis:", list(ADVANCED_SPECS))
+
+    if st.button("Run Advanced Query"):
+        st.session_state.advanced_shown = adv_query
+    if st.session_state.get("advanced_shown") == adv_query:
+        show_result(adv_query, ADVANCED_SPECS, key="advanced")
+
+render_advanced()
 
 st.divider()
 
@@ -506,15 +475,58 @@ st.divider()
 st.markdown("<section id='search'></section>", unsafe_allow_html=True)
 st.header("🔍 Vehicle Search")
 
-vehicle_input = st.text_input("Enter Vehicle Number:")
-if vehicle_input:
-    q = f"SELECT * FROM traffic_stops WHERE vehicle_number LIKE '%{vehicle_input}%';"
-    df_vehicle = run_query(q)
-    if df_vehicle.empty:
-        st.warning("No records found for that vehicle number.")
-    else:
-        st.success(f"Found {len(df_vehicle)} record(s)")
-        st.dataframe(df_vehicle, use_container_width=True)
+# A plate's all-time history from vehicle_profiles (see vehicle_profiles.py),
+# shown whenever the search text is a known plate.
+def show_profile(plate):
+    backend = get_backend()
+    profile, countries = vehicle_profiles.lookup_profile(backend, plate)
+    record_query(executed=not backend.last_was_hit())
+    if profile is None:
+        return
+    st.subheader(f"🚗 {profile['vehicle_number']}")
+    for col, (label, column) in zip(st.columns(4), [
+        ("Stops", "stops"), ("DUI Stops", "dui_stops"), ("Searches", "searches"), ("Arrests", "arrests"),
+    ]):
+        col.metric(label, f"{int(profile[column]):,}")
+    seen = " – ".join(str(pd.Timestamp(profile[c]).date()) for c in ("first_seen", "last_seen") if pd.notna(profile[c]))
+    places = ", ".join(f"{row.country_name} ({int(row.stops):,})" for row in countries.itertuples())
+    st.caption(f"Seen {seen or 'on unknown dates'} in {places}")
+
+@panel("Vehicle search")
+def render_vehicle_search():
+    vehicle_input = st.text_input("Enter Vehicle Number:")
+    match_mode = st.radio("Match", plate_search.MODES, horizontal=True)
+
+    # Keyset pagination: the stack holds the cursor each visited page started at.
+    search_key = (vehicle_input, match_mode)
+    if st.session_state.get("plate_search_key") != search_key:
+        st.session_state.plate_search_key = search_key
+        st.session_state.plate_pages = [0]
+    plate_pages = st.session_state.plate_pages
+
+    if vehicle_input:
+        show_profile(plate_search.normalize_plate(vehicle_input))
+        backend = get_backend()
+        df_vehicle, next_page = plate_search.search_plates(backend, vehicle_input, match_mode, after=plate_pages[-1])
+        record_query(executed=not backend.last_was_hit())
+        if df_vehicle.empty:
+            st.warning("No records found for that vehicle number.")
+        else:
+            first = (len(plate_pages) - 1) * plate_search.PAGE_SIZE + 1
+            st.success(f"Showing record(s) {first:,}–{first + len(df_vehicle) - 1:,}")
+            st.dataframe(df_vehicle, use_container_width=True)
+            prev_col, next_col = st.columns(2)
+            with prev_col:
+                st.button("⬅️ Previous page", disabled=len(plate_pages) == 1, on_click=plate_pages.pop)
+            with next_col:
+                st.button("Next page ➡️", disabled=next_page is None, on_click=plate_pages.append, args=(next_page,))
+            download_buttons(
+                f"vehicle_search_{vehicle_input}",
+                lambda: plate_search.iter_matches(backend, vehicle_input, match_mode),
+                "vehicle_search",
+            )
+
+render_vehicle_search()
 
 st.divider()
 
@@ -523,36 +535,52 @@ st.divider()
 st.markdown("<section id='predict'></section>", unsafe_allow_html=True)
 st.header("🤖 Predict Stop Outcome & Violation")
 
-col1, col2 = st.columns(2)
-with col1:
-    driver_age = st.number_input("Driver Age", min_value=16, max_value=90, value=30)
-    driver_gender = st.selectbox("Driver Gender", ["male", "female"])
-    stop_date = st.date_input("Stop Date", datetime.today().date())
-    stop_time = st.time_input("Stop Time", datetime.now().time())
-    country = st.text_input("Country Name")
-with col2:
-    search_conducted = st.selectbox("Was Search Conducted?", [0, 1])
-    drugs_related = st.selectbox("Was it Drug Related?", [0, 1])
-    stop_duration = st.selectbox("Stop Duration", ["0-15 Min", "16-30 Min", "30+ Min"])
-    vehicle_number = st.text_input("Vehicle Number")
-
-if st.button("Predict Stop Outcome & Violation"):
-    import random
-    violation = random.choice(["Speeding", "Seatbelt", "Expired License", "Signal Jump"])
-    outcome = random.choice(["Warning", "Arrest", "Citation"])
-
-    st.markdown("### 🚓 Prediction Summary")
-    st.markdown(f"""
-    
-    🧾 A {driver_age}-year-old {driver_gender} driver from **{country or 'Unknown'}**  
-    was stopped at **{stop_time.strftime('%H:%M')}** on **{stop_date.strftime('%Y-%m-%d')}**.  
-    {'A search was conducted,' if search_conducted else 'No search was conducted,'}  
-    and the stop {'was drug-related.' if drugs_related else 'was not drug-related.'}  
-    Stop duration: **{stop_duration}**. 
-    **Stop Violation:** {violation}  
-    **Stop Outcome:** {outcome}  
-    Vehicle Number: **{vehicle_number or '****'}**.
-    """)
+@panel("Predict outcome")
+def render_predict():
+    col1, col2 = st.columns(2)
+    with col1:
+        driver_age = st.number_input("Driver Age", min_value=16, max_value=90, value=30)
+        driver_gender = st.selectbox("Driver Gender", ["male", "female"])
+        stop_date = st.date_input("Stop Date", datetime.today().date())
+        stop_time = st.time_input("Stop Time", datetime.now().time())
+        country = st.text_input("Country Name")
+    with col2:
+        search_conducted = st.selectbox("Was Search Conducted?", [0, 1])
+        drugs_related = st.selectbox("Was it Drug Related?", [0, 1])
+        stop_duration = st.selectbox("Stop Duration", ["0-15 Min", "16-30 Min", "30+ Min"])
+        vehicle_number = st.text_input("Vehicle Number")
+
+    if st.button("Predict Stop Outcome & Violation"):
+        model = get_model()
+        if model is None:
+            st.warning("No trained model found. Run `python outcome_model.py train` first.")
+            return
+        prediction = outcome_model.predict_one(
+            model,
+            driver_age=driver_age,
+            driver_gender=driver_gender,
+            country_name=country or None,
+            stop_hour=stop_time.hour,
+            search_conducted=search_conducted,
+            stop_duration=stop_duration,
+        )
+        violation = f"{prediction['predicted_violation']} ({prediction['violation_confidence']:.0%} confidence)"
+        outcome = f"{prediction['predicted_stop_outcome']} ({prediction['stop_outcome_confidence']:.0%} confidence)"
+
+        st.markdown("### 🚓 Prediction Summary")
+        st.markdown(f"""
+        
+        🧾 A {driver_age}-year-old {driver_gender} driver from **{country or 'Unknown'}**  
+        was stopped at **{stop_time.strftime('%H:%M')}** on **{stop_date.strftime('%Y-%m-%d')}**.  
+        {'A search was conducted,' if search_conducted else 'No search was conducted,'}  
+        and the stop {'was drug-related.' if drugs_related else 'was not drug-related.'}  
+        Stop duration: **{stop_duration}**. 
+        **Stop Violation:** {violation}  
+        **Stop Outcome:** {outcome}  
+        Vehicle Number: **{vehicle_number or '****'}**.
+        """)
+
+render_predict()
 
 st.divider()
 
@@ -571,4 +599,97 @@ It provides insight into police traffic stop patterns, violations, and demograph
 - Streamlit (interactive web app)
 
 **Created by:** Yogaprabhu Ramesh Kanna
-""")
\ No newline at end of file
+""")
+
+st.divider()
+
+# PERFORMANCE
+# Rolling timings for every named query since the server started (see
+# query_stats.py). Plans are captured automatically for queries slower than
+# CHECKPOST_SLOW_QUERY_MS.
+st.markdown("<section id='performance'></section>", unsafe_allow_html=True)
+st.header("⏱️ Performance")
+
+@st.fragment
+def render_performance():
+    query_stats = get_backend().query_stats
+    refresh_col, reset_col = st.columns(2)
+    with refresh_col:
+        st.button("Refresh timings")
+    with reset_col:
+        st.button("Reset timings", on_click=query_stats.reset)
+    summary = query_stats.summary()
+    if summary.empty:
+        st.info("No queries recorded yet.")
+    else:
+        st.dataframe(summary, use_container_width=True)
+
+    slow = query_stats.slow_queries()
+    st.subheader(f"🐢 Slow Queries (≥ {query_stats.slow_ms:,.0f} ms)")
+    if not slow:
+        st.write("None captured.")
+    for entry in slow:
+        with st.expander(f"{entry['query']} — {entry['total_ms']:,.1f} ms"):
+            st.code(entry["sql"], language="sql")
+            plan = entry["plan"]
+            if "explain_value" in plan:
+                st.code("\n".join(plan["explain_value"]), language="text")
+            else:
+                st.dataframe(plan, use_container_width=True)
+    if query_stats.log_path:
+        st.caption(f"Logging every query to {query_stats.log_path}")
+
+render_performance()
+
+# DEBUG PANEL
+with st.sidebar.expander("🛠️ Query Cache"):
+    cache_stats = get_backend().stats()
+    st.write(f"Backend: **{cache_stats['backend']}**")
+    st.write(f"Hits: **{cache_stats['hits']:,}**  |  Misses: **{cache_stats['misses']:,}**")
+    st.write(f"Hit rate: **{cache_stats['hit_rate']:.1%}**  |  Cached results: **{cache_stats['cached_results']}**")
+    st.write(f"Data version: **{cache_stats['data_version']}**")
+    figure_stats = get_figure_cache().stats()
+    st.write(f"Figures cached: **{figure_stats['figures']}**  |  Reused: **{figure_stats['hits']:,}**")
+    if st.button("Clear cache (after loading new data)"):
+        get_backend().invalidate()
+        get_figure_cache().clear()
+        st.rerun()
+
+# Queries issued by each section's most recent run ("executed" = cache misses
+# that reached the database). Refreshing reruns only this fragment.
+@st.fragment
+def render_query_counts():
+    with st.expander("🧮 Queries per Section"):
+        st.button("Refresh counts")
+        counts = st.session_state.get("panel_queries", {})
+        st.dataframe(pd.DataFrame.from_dict(counts, orient="index"), use_container_width=True)
+
+with st.sidebar:
+    render_query_counts()
+
+# EXACT REFRESH
+# In approximate mode, the exact queries behind the estimates on screen run on
+# the backend's worker pool while the page stays usable. This fragment polls
+# them and reruns the page once they are all cached, so the estimates are
+# replaced by exact results.
+@st.fragment(run_every=1)
+def render_exact_refresh():
+    for name in st.session_state.pop("exact_failed", []):
+        st.warning(f"Exact query failed: {name}")
+    pending = st.session_state.get("exact_pending", {})
+    if pending and "exact_jobs" not in st.session_state:
+        st.caption(f"≈ {len(pending)} result(s) on screen are estimates.")
+        if st.button("Compute exact results"):
+            st.session_state.exact_jobs = get_backend().submit(pending)
+    jobs = st.session_state.get("exact_jobs")
+    if jobs:
+        done = sum(job.done() for job in jobs.values())
+        st.caption(f"⏳ Computing exact results… {done}/{len(jobs)}")
+        if done == len(jobs):
+            del st.session_state.exact_jobs
+            st.session_state.exact_failed = [name for name, job in jobs.items() if job.exception() is not None]
+            st.rerun()
+
+if approximate_mode():
+    with st.sidebar:
+        render_exact_refresh()
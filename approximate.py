@@ -0,0 +1,299 @@
+# APPROXIMATE MODE
+# Summaries behind the dashboard's opt-in "fast approximate" mode, maintained
+# at ingest alongside the cube (incremental.SUMMARIES):
+#
+#   traffic_stops_sample    a stratified sample: about SAMPLE_ROWS stops per
+#                           (country, violation), each weighted by 1 / its
+#                           stratum's sampling rate
+#   traffic_stops_sketches  per-country sketches of vehicle_number (see
+#                           sketches.py): a HyperLogLog of every plate and
+#                           count-min top-N sketches of the plates in DUI
+#                           and searched stops
+#
+# query_builder.compile_spec(..., approximate=True) answers cube specs from
+# the sample with 95% error bounds; top_plates() and distinct_vehicles()
+# merge the sketches for the selected countries.
+#
+# Stops are picked by a hash of their id, so whether a stop is sampled never
+# changes and new rows are sampled at their stratum's rate. Strata first seen
+# in an append are kept in full until the next rebuild refits the rates.
+import os
+
+import pandas as pd
+
+from cube import DIMENSIONS
+from sketches import CountMinTopN, HyperLogLog, dumps, loads
+
+SAMPLE_TABLE = "traffic_stops_sample"
+STRATA_TABLE = "traffic_stops_sample_strata"
+SKETCH_TABLE = "traffic_stops_sketches"
+SAMPLE_ROWS = int(os.environ.get("CHECKPOST_SAMPLE_ROWS", "5000"))
+SKETCH_BATCH_ROWS = 100_000
+
+# A number in [0, 1000000) per stop; rows below rate * 1000000 are sampled.
+SAMPLE_UNIT = "MOD(id * 2654435761, 1000000)"
+STRATUM = {
+    "stratum_country": "COALESCE(country_name, 'Unknown')",
+    "stratum_violation": "COALESCE(violation, 'Unknown')",
+}
+
+# sample column -> expression over traffic_stops
+SAMPLE_COLUMNS = {
+    **DIMENSIONS,
+    "stop_date": "CAST(stop_date AS DATE)",
+    "arrested": "CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END",
+    "searched": "CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END",
+    "weight": "1 / rate",
+}
+
+# sketch name -> (column, value) selecting the stops it counts plates in;
+# "vehicles" is the HyperLogLog over every stop.
+PLATE_SKETCHES = {
+    "dui_plates": ("violation", "DUI"),
+    "searched_plates": ("search_conducted", True),
+}
+
+STRATA_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    stratum_country VARCHAR(100) NOT NULL,
+    stratum_violation VARCHAR(100) NOT NULL,
+    rate DOUBLE NOT NULL,
+    PRIMARY KEY (stratum_country, stratum_violation)
+)
+""".format(table=STRATA_TABLE)
+
+SAMPLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    country_name VARCHAR(100),
+    violation VARCHAR(100),
+    driver_gender VARCHAR(10),
+    driver_race VARCHAR(50),
+    age_band VARCHAR(8),
+    stop_year SMALLINT,
+    stop_month TINYINT,
+    stop_hour TINYINT,
+    stop_outcome VARCHAR(50),
+    search_conducted BOOLEAN,
+    stop_date DATE,
+    arrested TINYINT NOT NULL,
+    searched TINYINT NOT NULL,
+    weight DOUBLE NOT NULL,
+    KEY idx_sample_stratum (country_name, violation)
+)
+"""
+
+SKETCH_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    sketch VARCHAR(20) NOT NULL,
+    country_name VARCHAR(100) NOT NULL,
+    data LONGBLOB NOT NULL,
+    PRIMARY KEY (sketch, country_name)
+)
+""".format(table=SKETCH_TABLE)
+
+
+def sample_ddl(table=SAMPLE_TABLE):
+    return SAMPLE_DDL.format(table=table)
+
+
+# SAMPLE
+def strata_select_sql(where="", rate=None):
+    """Sampling rate per stratum: enough to keep about SAMPLE_ROWS stops
+    (or a fixed ``rate``)."""
+    rate = "LEAST(1, %d / COUNT(*))" % SAMPLE_ROWS if rate is None else rate
+    return "SELECT %s, %s AS rate FROM traffic_stops%s GROUP BY %s" % (
+        ", ".join("%s AS %s" % (expr, name) for name, expr in STRATUM.items()),
+        rate, " WHERE " + where if where else "", ", ".join(STRATUM.values()),
+    )
+
+
+def sketch_source_sql(where=""):
+    """Plates the sketches are built from (``where`` is ANDed in)."""
+    return (
+        "SELECT country_name, violation, search_conducted, vehicle_number FROM traffic_stops "
+        "WHERE vehicle_number IS NOT NULL%s" % (" AND " + where if where else "")
+    )
+
+
+def sample_select_sql(where="", unit=SAMPLE_UNIT):
+    """Sampled stops joined to their stratum's rate (``where`` is ANDed in)."""
+    match = " AND ".join("s.%s = %s" % (name, expr) for name, expr in STRATUM.items())
+    return "SELECT %s\nFROM traffic_stops JOIN %s s ON %s\nWHERE %s < rate * 1000000%s" % (
+        ", ".join("%s AS %s" % (expr, name) for name, expr in SAMPLE_COLUMNS.items()),
+        STRATA_TABLE, match, unit, " AND " + where if where else "",
+    )
+
+
+def rebuild_strata(conn, last_id):
+    """Refit every stratum's rate to rows with id <= last_id. Returns the stratum count."""
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM %s" % STRATA_TABLE)
+    cursor.execute("INSERT INTO %s (%s, rate)\n%s" % (
+        STRATA_TABLE, ", ".join(STRATUM), strata_select_sql("id <= %s")
+    ), (last_id,))
+    strata = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return strata
+
+
+def apply_strata_delta(cursor, low_id, high_id):
+    """Strata first seen in this range are sampled in full."""
+    cursor.execute("INSERT IGNORE INTO %s (%s, rate)\n%s" % (
+        STRATA_TABLE, ", ".join(STRATUM), strata_select_sql("id > %s AND id <= %s", rate="1")
+    ), (low_id, high_id))
+
+
+def rebuild_sample(conn, last_id):
+    """Redraw the sample from rows with id <= last_id and swap it in atomically.
+
+    Returns the number of sampled stops.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s_new, %s_old" % (SAMPLE_TABLE, SAMPLE_TABLE))
+    cursor.execute(sample_ddl(SAMPLE_TABLE + "_new"))
+    cursor.execute("INSERT INTO %s_new (%s)\n%s" % (
+        SAMPLE_TABLE, ", ".join(SAMPLE_COLUMNS), sample_select_sql("id <= %s")
+    ), (last_id,))
+    rows = cursor.rowcount
+    conn.commit()
+    cursor.execute("RENAME TABLE {t} TO {t}_old, {t}_new TO {t}".format(t=SAMPLE_TABLE))
+    cursor.execute("DROP TABLE %s_old" % SAMPLE_TABLE)
+    cursor.close()
+    return rows
+
+
+def apply_sample_delta(cursor, low_id, high_id):
+    cursor.execute("INSERT INTO %s (%s)\n%s" % (
+        SAMPLE_TABLE, ", ".join(SAMPLE_COLUMNS), sample_select_sql("id > %s AND id <= %s")
+    ), (low_id, high_id))
+
+
+# SKETCHES
+def build_sketches(frames, sketches=None):
+    """Add frames of (country_name, violation, search_conducted,
+    vehicle_number) to {(sketch name, country): sketch}."""
+    sketches = {} if sketches is None else sketches
+    for df in frames:
+        df = df[df["vehicle_number"].notna()]
+        for country, group in df.groupby(df["country_name"].fillna("Unknown"), observed=True):
+            sketches.setdefault(("vehicles", country), HyperLogLog()).add(group["vehicle_number"])
+            for name, (column, value) in PLATE_SKETCHES.items():
+                plates = group["vehicle_number"][group[column] == value]
+                if len(plates):
+                    sketches.setdefault((name, country), CountMinTopN()).add(plates)
+    return sketches
+
+
+def _sketch_frames(cursor, batch_rows=SKETCH_BATCH_ROWS):
+    columns = None
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            break
+        columns = columns or cursor.column_names
+        yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def _write_sketches(cursor, sketches):
+    cursor.executemany(
+        "INSERT INTO %s (sketch, country_name, data) VALUES (%%s, %%s, %%s) "
+        "ON DUPLICATE KEY UPDATE data = VALUES(data)" % SKETCH_TABLE,
+        [(name, country, dumps(sketch)) for (name, country), sketch in sketches.items()],
+    )
+
+
+def rebuild_sketches(conn, last_id):
+    """Re-sketch every plate with id <= last_id. Returns the number of sketches."""
+    reader = conn.cursor()
+    reader.execute(sketch_source_sql("id <= %s"), (last_id,))
+    sketches = build_sketches(_sketch_frames(reader))
+    reader.close()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM %s" % SKETCH_TABLE)
+    _write_sketches(cursor, sketches)
+    conn.commit()
+    cursor.close()
+    return len(sketches)
+
+
+def apply_sketch_delta(cursor, low_id, high_id):
+    """Sketch the new rows and merge them into the stored sketches.
+
+    Only the (sketch, country) rows the new rows touch are locked and read.
+    """
+    cursor.execute(sketch_source_sql("id > %s AND id <= %s"), (low_id, high_id))
+    delta = build_sketches(_sketch_frames(cursor))
+    if not delta:
+        return
+    cursor.execute(
+        "SELECT sketch, country_name, data FROM %s WHERE (sketch, country_name) IN (%s) FOR UPDATE"
+        % (SKETCH_TABLE, ", ".join(["(%s, %s)"] * len(delta))),
+        [value for key in delta for value in key],
+    )
+    stored = {(name, country): loads(data) for name, country, data in cursor.fetchall()}
+    for key, sketch in delta.items():
+        if key in stored:
+            delta[key] = stored[key].merge(sketch)
+    _write_sketches(cursor, delta)
+
+
+# ANSWERS
+def load_sketches(backend):
+    """The sketch table through the backend's result cache."""
+    return backend.run_query(
+        "SELECT sketch, country_name, data FROM %s" % SKETCH_TABLE, name="Approximate: sketches"
+    )
+
+
+def _merged(sketch_frame, name, countries=None):
+    rows = sketch_frame[sketch_frame["sketch"] == name]
+    if countries:
+        rows = rows[rows["country_name"].isin(countries)]
+    merged = None
+    for data in rows["data"]:
+        merged = loads(data) if merged is None else merged.merge(loads(data))
+    return merged
+
+
+def _sketch_notes(filters, applied=("country",)):
+    return tuple(
+        f"The {name} filter does not apply to this estimate."
+        for name, value in (filters or {}).items() if value and name not in applied
+    )
+
+
+def plate_sketch(spec):
+    """The PLATE_SKETCHES name that answers a top-N plates spec, or None."""
+    if spec.source != "stops" or [name for _alias, name in spec.dimensions] != ["vehicle_number"]:
+        return None
+    if [name for _alias, name in spec.measures] != ["stops"] or len(spec.where) != 1:
+        return None
+    for name, condition in PLATE_SKETCHES.items():
+        if tuple(spec.where[0]) == condition:
+            return name
+    return None
+
+
+def top_plates(sketch_frame, spec, filters=None):
+    """(DataFrame, notes) estimating a plate_sketch() spec from the sketches.
+
+    Count-min never under-counts, so each true count lies between
+    ``<count> - <count>_error`` and ``<count>``.
+    """
+    (plate_alias, _plate), = spec.dimensions
+    (count_alias, _count), = spec.measures
+    sketch = _merged(sketch_frame, plate_sketch(spec), (filters or {}).get("country"))
+    top = sketch.top(spec.limit or 10) if sketch is not None else []
+    df = pd.DataFrame(top, columns=[plate_alias, count_alias])
+    df[count_alias + "_error"] = sketch.error() if sketch is not None else 0
+    notes = ("Estimated from count-min sketches; counts may be too high by up to the _error column.",)
+    return df, notes + _sketch_notes(filters)
+
+
+def distinct_vehicles(sketch_frame, filters=None):
+    """(estimate, 95% error, notes) for the number of distinct plates."""
+    sketch = _merged(sketch_frame, "vehicles", (filters or {}).get("country"))
+    if sketch is None:
+        return 0, 0, ()
+    return sketch.estimate(), sketch.error(), _sketch_notes(filters)
@@ -0,0 +1,341 @@
+# QUERY BACKENDS
+# The dashboard's run_query() talks to one of these. All expose the
+# CachedBackend interface from db.py: run_query(), execute(), invalidate(),
+# data_version() and stats().
+#
+#   CHECKPOST_BACKEND=mysql    (default) the MySQL database via QueryLayer
+#   CHECKPOST_BACKEND=duckdb   a hive-partitioned Parquet dataset written by
+#                              clean_pipeline.py --format dataset, queried
+#                              in-process with DuckDB (no database server)
+#   CHECKPOST_BACKEND=remote   query_service.py at CHECKPOST_QUERY_SERVICE,
+#                              which runs either of the above in worker
+#                              processes behind a shared cache
+import datetime
+import http.client
+import json
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+from approximate import (
+    SAMPLE_TABLE, SKETCH_TABLE, STRATA_TABLE, build_sketches, sample_select_sql, sketch_source_sql, strata_select_sql,
+)
+from cube import CUBE_TABLE, cube_select_sql
+from db import (
+    CACHE_TTL, QUERY_TIMEOUT, QUERY_WORKERS, STREAM_BATCH_ROWS, VERSION_QUERY, VERSION_TTL, CachedBackend,
+    QueryLayer, arrow_numbers, whole_numbers,
+)
+from rollup import ROLLUP_TABLE, rollup_build_sql
+from shared_cache import from_ipc
+from sketches import dumps
+from vehicle_profiles import COUNT_COLUMNS, COUNTRY_TABLE, PROFILE_TABLE, country_select_sql, profile_select_sql
+
+BACKEND = os.environ.get("CHECKPOST_BACKEND", "mysql")
+PARQUET_PATH = os.environ.get("CHECKPOST_PARQUET_PATH", "traffic_stops_dataset")
+QUERY_SERVICE = os.environ.get("CHECKPOST_QUERY_SERVICE", "http://127.0.0.1:8766")
+
+# %s placeholders outside string literals
+_PLACEHOLDER = re.compile(r"('(?:[^'\\]|\\.)*')|%s")
+_EXPLAIN = re.compile(r"\s*EXPLAIN\s+(?!ANALY[SZ]E\b)", re.IGNORECASE)
+
+
+def to_qmark(query):
+    """Rewrite MySQL-style %s parameters as DuckDB's ? placeholders."""
+    return _PLACEHOLDER.sub(lambda m: m.group(1) or "?", query)
+
+
+def _sql_string(text):
+    return "'%s'" % text.replace("'", "''")
+
+
+class DuckDBBackend(CachedBackend):
+    """Runs the dashboard SQL against a partitioned Parquet dataset.
+
+    traffic_stops is a view over the dataset, so DuckDB prunes columns,
+    skips partitions (stop_year/stop_month/country_name) and row groups that
+    the WHERE clause rules out, and pushes the remaining filters into the
+    Parquet scan. The summary cube, time rollup, vehicle profiles and
+    approximate-mode sample and sketches are built in memory from the same
+    SQL as the MySQL ones and rebuilt whenever the dataset files change.
+    The dataset has no id column, so the sample hashes each stop's plate,
+    date and time instead.
+
+    ``read_only=True`` (query_service.py) confines file access to the
+    dataset directory and only runs statements DuckDB's parser reports as a
+    single SELECT (or a plain EXPLAIN of one); anything else raises
+    PermissionError.
+    """
+
+    name = "duckdb"
+    dialect = "duckdb"
+
+    def __init__(self, path=PARQUET_PATH, ttl=CACHE_TTL, version_ttl=VERSION_TTL, threads=None,
+                 workers=QUERY_WORKERS, read_only=False):
+        import duckdb
+
+        super().__init__(ttl=ttl, version_ttl=version_ttl, workers=workers)
+        self.path = path
+        self.read_only = read_only
+        self.con = duckdb.connect()
+        if threads:
+            self.con.execute("SET threads = %d" % threads)
+        # MySQL's REGEXP_SUBSTR returns NULL on no match; regexp_extract returns ''.
+        self.con.execute("CREATE MACRO regexp_substr(s, p) AS NULLIF(regexp_extract(s, p), '')")
+        if read_only:
+            # No files outside the dataset (read_csv('/etc/passwd'), ATTACH,
+            # INSTALL), and no SET can turn that back on.
+            self.con.execute("SET allowed_directories = [%s]" % _sql_string(os.path.abspath(path)))
+            self.con.execute("SET enable_external_access = false")
+            self.con.execute("SET lock_configuration = true")
+        self._built_version = None
+        self._build_lock = threading.Lock()
+
+    def fetch_version(self):
+        """Latest modification time across the dataset's Parquet files.
+
+        Raises FileNotFoundError when the directory holds none.
+        """
+        latest = 0.0
+        for root, _dirs, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".parquet"):
+                    latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+        if not latest:
+            raise FileNotFoundError(
+                "No Parquet dataset at %r; build it with: "
+                "python clean_pipeline.py traffic_stops.xlsx --out %s --format dataset" % (self.path, self.path)
+            )
+        return latest
+
+    def _refresh(self):
+        version = self.data_version()
+        if version == self._built_version:
+            return
+        with self._build_lock:
+            if version != self._built_version:
+                self._build(version)
+
+    def _build(self, version):
+        glob = os.path.join(self.path, "**", "*.parquet").replace("'", "''")
+        self.con.execute(
+            "CREATE OR REPLACE VIEW traffic_stops AS "
+            "SELECT * FROM read_parquet('%s', hive_partitioning = true, union_by_name = true)" % glob
+        )
+        self.con.execute("CREATE OR REPLACE TABLE %s AS %s" % (CUBE_TABLE, cube_select_sql()))
+        self.con.execute("CREATE OR REPLACE TABLE %s AS %s" % (ROLLUP_TABLE, rollup_build_sql()))
+        self.con.execute("CREATE OR REPLACE TABLE %s AS %s" % (STRATA_TABLE, strata_select_sql()))
+        self.con.execute("CREATE OR REPLACE TABLE %s AS %s" % (
+            SAMPLE_TABLE, sample_select_sql(unit="hash(vehicle_number, stop_date, stop_time) % 1000000")
+        ))
+        self._build_sketches()
+        self.con.execute("CREATE OR REPLACE TABLE %s AS SELECT * REPLACE (%s) FROM (%s)" % (
+            PROFILE_TABLE, ", ".join("CAST(%s AS INTEGER) AS %s" % (c, c) for c in COUNT_COLUMNS), profile_select_sql()
+        ))
+        self.con.execute("CREATE OR REPLACE TABLE %s AS %s" % (COUNTRY_TABLE, country_select_sql()))
+        self._built_version = version
+
+    def _build_sketches(self):
+        reader = self.con.execute(sketch_source_sql()).fetch_record_batch(STREAM_BATCH_ROWS)
+        sketches = build_sketches(batch.to_pandas() for batch in reader)
+        self.con.execute(
+            "CREATE OR REPLACE TABLE %s (sketch VARCHAR, country_name VARCHAR, data BLOB)" % SKETCH_TABLE
+        )
+        if sketches:
+            self.con.executemany(
+                "INSERT INTO %s VALUES (?, ?, ?)" % SKETCH_TABLE,
+                [(name, country, dumps(sketch)) for (name, country), sketch in sketches.items()],
+            )
+
+    def check_read_only(self, query):
+        """PermissionError unless ``query`` parses as one SELECT or EXPLAIN SELECT.
+
+        COPY ... TO could still write into the dataset directory, so the
+        statement type is checked with DuckDB's own parser.
+        """
+        import duckdb
+
+        statements = self.con.extract_statements(query)
+        if len(statements) != 1:
+            raise PermissionError("one statement per query")
+        kind = statements[0].type
+        if kind == duckdb.StatementType.EXPLAIN:
+            match = _EXPLAIN.match(query)
+            if match is None:  # EXPLAIN ANALYZE runs the statement
+                raise PermissionError("only EXPLAIN of a SELECT is allowed")
+            self.check_read_only(query[match.end():])
+        elif kind != duckdb.StatementType.SELECT:
+            raise PermissionError("only SELECT statements are allowed, not %s" % kind.name)
+
+    def execute(self, query, params=None):
+        if self.read_only:
+            self.check_read_only(to_qmark(query))
+        self._refresh()
+        timer = self._start_timer()
+        # A cursor is an independent connection to the same database, so
+        # concurrent dashboard sessions do not share one handle.
+        cursor = self.con.cursor()
+        timer.lap("connect_ms")
+        try:
+            result = cursor.execute(to_qmark(query), list(params or []))
+            timer.lap("execute_ms")
+            # SUM() of integers is a HUGEINT, which .df() turns into float64.
+            hugeints = [d[0] for d in result.description if str(d[1]) == "HUGEINT"]
+            df = whole_numbers(result.df(), hugeints)
+            timer.lap("fetch_ms")
+            return df
+        finally:
+            cursor.close()
+
+    def stream(self, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        if self.read_only:
+            self.check_read_only(to_qmark(query))
+        self._refresh()
+        cursor = self.con.cursor()
+        try:
+            for batch in cursor.execute(to_qmark(query), list(params or [])).fetch_record_batch(batch_rows):
+                yield arrow_numbers(batch)  # HUGEINT arrives as decimal128(38, 0)
+        finally:
+            cursor.close()
+
+
+# Query parameters travel as JSON; dates are tagged so they come back as dates.
+def encode_params(params):
+    def encode(value):
+        if isinstance(value, datetime.datetime):
+            return {"datetime": value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {"date": value.isoformat()}
+        return value.item() if hasattr(value, "item") else value  # numpy scalars
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: encode(value) for name, value in params.items()}
+    return [encode(value) for value in params]
+
+
+def decode_params(params):
+    def decode(value):
+        if isinstance(value, dict) and len(value) == 1:
+            if "datetime" in value:
+                return datetime.datetime.fromisoformat(value["datetime"])
+            if "date" in value:
+                return datetime.date.fromisoformat(value["date"])
+        return value
+
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: decode(value) for name, value in params.items()}
+    if not isinstance(params, list):
+        raise ValueError("params must be a list or an object")
+    return tuple(decode(value) for value in params)
+
+
+class RemoteBackend(CachedBackend):
+    """Sends queries to query_service.py over HTTP.
+
+    The service runs them in worker processes against its own backend and
+    shares results between every dashboard process through its on-disk
+    cache; this process keeps the usual in-memory cache on top. Results
+    arrive as Arrow IPC streams, over one keep-alive connection per thread.
+    """
+
+    name = "remote"
+
+    def __init__(self, url=QUERY_SERVICE, ttl=CACHE_TTL, version_ttl=VERSION_TTL, workers=QUERY_WORKERS,
+                 timeout=QUERY_TIMEOUT):
+        super().__init__(ttl=ttl, version_ttl=version_ttl, workers=workers)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        # The service gives up after its own QUERY_TIMEOUT; allow for the round trip.
+        self.timeout = timeout + 10 if timeout else None
+        self._conns = threading.local()
+        self._dialect = None
+
+    @property
+    def dialect(self):
+        """The service's engine, asked once: plate search and profile
+        lookups pick their SQL on it."""
+        if self._dialect is None:
+            self._dialect = json.loads(self._request("GET", "/version").read())["dialect"]
+        return self._dialect
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request(self, method, path, body=None, conn=None):
+        """The HTTPResponse for one request; raises on an error status.
+
+        Uses this thread's keep-alive connection unless given ``conn``.
+        """
+        data = None if body is None else json.dumps(body).encode()
+        for attempt in (1, 2):
+            own = conn or getattr(self._conns, "conn", None)
+            if own is None:
+                own = self._conns.conn = self._connect()
+            try:
+                own.request(method, path, data, {"Content-Type": "application/json"})
+                response = own.getresponse()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The service closed an idle keep-alive connection: reconnect
+                # once (queries are read-only, so resending is safe).
+                own.close()
+                if conn is None:
+                    self._conns.conn = None
+                if attempt == 2:
+                    raise
+        if response.status != 200:
+            error = json.loads(response.read() or b"{}").get("error", response.reason)
+            if response.status == 504:
+                raise TimeoutError(error)
+            raise RuntimeError(f"query service: {error}")
+        return response
+
+    def fetch_version(self):
+        try:
+            return json.loads(self._request("GET", "/version").read())["version"]
+        except (OSError, http.client.HTTPException, RuntimeError):
+            return None
+
+    def execute(self, query, params=None):
+        timer = self._start_timer()
+        response = self._request("POST", "/query", {"sql": query, "params": encode_params(params)})
+        timer.lap("execute_ms")
+        df = from_ipc(response.read())
+        timer.lap("fetch_ms")
+        return df
+
+    def stream(self, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        import pyarrow as pa
+
+        # A connection of its own: the batches are read while this thread
+        # may run other queries.
+        conn = self._connect()
+        try:
+            response = self._request(
+                "POST", "/stream", {"sql": query, "params": encode_params(params), "batch_rows": batch_rows}, conn
+            )
+            yield from pa.ipc.open_stream(response)
+        finally:
+            conn.close()
+
+    def invalidate(self, table=None):
+        """Drop cached results here; dropping all of them also empties the service's cache."""
+        super().invalidate(table)
+        if table is None:
+            self._request("POST", "/invalidate", {}).read()
+
+
+def get_backend(name=None, **kwargs):
+    """Construct the configured backend ("mysql", "duckdb" or "remote")."""
+    name = name or BACKEND
+    if name == "mysql":
+        return QueryLayer(version_query=VERSION_QUERY, **kwargs)
+    if name == "duckdb":
+        return DuckDBBackend(**kwargs)
+    if name == "remote":
+        return RemoteBackend(**kwargs)
+    raise ValueError(f"unknown backend {name!r} (expected 'mysql', 'duckdb' or 'remote')")
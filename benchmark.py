@@ -0,0 +1,269 @@
+# BENCHMARK SUITE
+# Times the whole path on synthetic data (synth_data.py): generating the raw
+# export, cleaning it, ingesting it, then every named dashboard query and the
+# vehicle search modes, plus the dashboard's page-load queries run one after
+# another and concurrently. Results go to a JSON file per run so runs can be
+# compared.
+#
+#   python benchmark.py --rows 10k --backend duckdb
+#   python benchmark.py --rows 1m --backend mysql --database checkpost_bench
+#   python benchmark.py --compare benchmarks/old.json benchmarks/new.json
+#
+# The mysql backend drops and reloads traffic_stops in --database, so point
+# it at a scratch database, never the dashboard's own. The duckdb backend
+# needs no server and stands in for MySQL on a laptop.
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import synth_data
+from clean_pipeline import clean_stream, write_csv, write_dataset
+from cleaning import CLEAN_CSV_DTYPES, finish
+
+BENCH_DIR = "benchmarks"
+REPEAT = 5
+REGRESSION_THRESHOLD = 1.2  # --compare flags anything this much slower
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _rate(rows, seconds):
+    return {"rows": rows, "seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds) if seconds else None}
+
+
+# STAGES
+def stage_clean(raw_path, cleaned_path):
+    stats = {}
+    _, seconds = _timed(write_csv, clean_stream(raw_path, stats=stats), cleaned_path)
+    return {**_rate(stats["rows_in"], seconds), "rows_out": stats["rows_out"]}
+
+
+def stage_ingest_mysql(cleaned_path, database):
+    import db
+    from bulk_load import load_csv
+    from incremental import SUMMARIES
+
+    conn = db.get_connection(database=None)
+    cursor = conn.cursor()
+    cursor.execute("CREATE DATABASE IF NOT EXISTS `%s`" % database)
+    cursor.execute("USE `%s`" % database)
+    # Leftover summaries or migrations would change what the timed load
+    # rebuilds and re-applies, so every run starts from the same empty schema.
+    tables = ["traffic_stops", "ingest_state", "schema_migrations"] + [s.table for s in SUMMARIES.values()]
+    cursor.execute("DROP TABLE IF EXISTS " + ", ".join(tables))
+    cursor.close()
+    conn.close()
+    # Everything after this (loader, backend pool) connects to the scratch database.
+    db.DB_CONFIG["database"] = database
+    stats, seconds = _timed(load_csv, cleaned_path, progress=False)
+    return _rate(stats["rows"], seconds)
+
+
+def stage_ingest_duckdb(cleaned_path, dataset_path):
+    import shutil
+
+    if os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+    rows = 0
+
+    def chunks():
+        nonlocal rows
+        for chunk in pd.read_csv(cleaned_path, dtype=CLEAN_CSV_DTYPES, chunksize=synth_data.CHUNK_SIZE):
+            rows += len(chunk)
+            yield finish(chunk)
+
+    _, seconds = _timed(write_dataset, chunks(), dataset_path)
+    return _rate(rows, seconds)
+
+
+def time_query(backend, sql, params=None, repeat=REPEAT):
+    """Uncached timings: one warm-up run, then ``repeat`` measured runs."""
+    df = backend.execute(sql, params)
+    times = []
+    for _ in range(repeat):
+        _, seconds = _timed(backend.execute, sql, params)
+        times.append(seconds * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "max_ms": round(max(times), 3),
+        "rows": len(df),
+    }
+
+
+def stage_queries(backend, repeat=REPEAT):
+    from insights import ADVANCED_QUERIES, INSIGHT_QUERIES, PANEL_QUERIES
+
+    return {
+        name: time_query(backend, sql, repeat=repeat)
+        for name, sql in {**PANEL_QUERIES, **INSIGHT_QUERIES, **ADVANCED_QUERIES}.items()
+    }
+
+
+def stage_page_load(backend, repeat=REPEAT):
+    """The dashboard's page-load queries, one after another vs. through run_many()."""
+    from insights import PANEL_QUERIES
+
+    def sequential():
+        for name, sql in PANEL_QUERIES.items():
+            backend.run_query(sql, name=name)
+
+    results = {}
+    for mode, fn in [("sequential", sequential), ("concurrent", lambda: backend.run_many(PANEL_QUERIES))]:
+        fn()
+        times = [_timed(fn)[1] * 1000 for _ in range(repeat)]
+        results[mode] = {"median_ms": round(statistics.median(times), 3), "queries": len(PANEL_QUERIES)}
+    return results
+
+
+def stage_approximate(backend, repeat=REPEAT):
+    """The named queries the approximate mode answers, from the sample or sketches."""
+    import approximate
+    from insights import ADVANCED_SPECS, INSIGHT_SPECS, PANEL_SPECS
+    from query_builder import compile_spec
+
+    results = {}
+    for name, spec in {**PANEL_SPECS, **INSIGHT_SPECS, **ADVANCED_SPECS}.items():
+        query = compile_spec(spec, approximate=True)
+        if query is not None:
+            results[name] = time_query(backend, query.sql, query.params, repeat=repeat)
+        elif approximate.plate_sketch(spec) is not None:
+            sketches = approximate.load_sketches(backend)
+            times = [_timed(approximate.top_plates, sketches, spec)[1] * 1000 for _ in range(repeat)]
+            results[name] = {"median_ms": round(statistics.median(times), 3)}
+    return results
+
+
+def stage_vehicle_search(backend, repeat=REPEAT):
+    import plate_search
+    import vehicle_profiles
+
+    plate = backend.execute(
+        "SELECT vehicle_number, COUNT(*) AS n FROM traffic_stops GROUP BY vehicle_number ORDER BY n DESC LIMIT 1"
+    ).iat[0, 0].upper()
+    results = {}
+    for mode, text in [("Exact", plate), ("Starts with", plate[:4]), ("Contains", plate[2:6])]:
+        times = []
+        for _ in range(repeat + 1):
+            (df, _next), seconds = _timed(plate_search.search_plates, backend, text, mode)
+            times.append(seconds * 1000)
+        results[mode] = {"text": text, "median_ms": round(statistics.median(times[1:]), 3), "rows": len(df)}
+    results["Profile"] = {"text": plate, **time_query(backend, vehicle_profiles.profile_sql(backend), (plate,), repeat)}
+    return results
+
+
+# RUN
+def run(rows, backend_name="duckdb", workdir=BENCH_DIR, seed=0, repeat=REPEAT, database="checkpost_bench"):
+    """Run every stage and return the result document."""
+    from backends import get_backend
+
+    os.makedirs(workdir, exist_ok=True)
+    raw_path = os.path.join(workdir, f"synthetic_{rows}.csv")
+    cleaned_path = os.path.join(workdir, f"cleaned_{rows}.csv")
+    stages = {}
+
+    if os.path.exists(raw_path):
+        stages["generate"] = {"reused": raw_path}
+    else:
+        stages["generate"] = _rate(rows, synth_data.write_csv(rows, raw_path, seed))
+    print(f"generate: {stages['generate']}")
+    stages["clean"] = stage_clean(raw_path, cleaned_path)
+    print(f"clean: {stages['clean']}")
+
+    if backend_name == "mysql":
+        stages["ingest"] = stage_ingest_mysql(cleaned_path, database)
+        backend = get_backend("mysql", ttl=0)
+    else:
+        dataset_path = os.path.join(workdir, f"dataset_{rows}")
+        stages["ingest"] = stage_ingest_duckdb(cleaned_path, dataset_path)
+        backend = get_backend("duckdb", path=dataset_path, ttl=0)
+        # The in-memory cube is built on first use; time it as its own stage.
+        _, seconds = _timed(backend.execute, "SELECT 1")
+        stages["summary_build"] = {"seconds": round(seconds, 3)}
+    print(f"ingest: {stages['ingest']}")
+
+    stages["queries"] = stage_queries(backend, repeat)
+    stages["page_load"] = stage_page_load(backend, repeat)
+    print(f"page load: {stages['page_load']}")
+    stages["approximate"] = stage_approximate(backend, repeat)
+    stages["vehicle_search"] = stage_vehicle_search(backend, repeat)
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rows": rows,
+        "seed": seed,
+        "backend": backend_name,
+        "repeat": repeat,
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "stages": stages,
+    }
+
+
+# COMPARE
+def flatten_timings(result):
+    """{metric path: milliseconds} for every timed stage and query."""
+    flat = {}
+    for stage, value in result["stages"].items():
+        if "seconds" in value:
+            flat[stage] = value["seconds"] * 1000
+        elif stage in ("queries", "page_load", "approximate", "vehicle_search"):
+            for name, timing in value.items():
+                flat[f"{stage}/{name}"] = timing["median_ms"]
+    return flat
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    """Rows of (metric, old_ms, new_ms, ratio, regressed) for metrics in both runs."""
+    before, after = flatten_timings(old), flatten_timings(new)
+    rows = []
+    for metric in before:
+        if metric in after and before[metric]:
+            ratio = after[metric] / before[metric]
+            rows.append((metric, before[metric], after[metric], ratio, ratio >= threshold))
+    return sorted(rows, key=lambda r: -r[3])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cleaning, ingest and dashboard queries on synthetic data.")
+    parser.add_argument("--rows", default="10k", help="10k, 1m, 50m or a row count")
+    parser.add_argument("--backend", choices=["duckdb", "mysql"], default="duckdb")
+    parser.add_argument("--database", default="checkpost_bench", help="scratch MySQL database (mysql backend)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--workdir", default=BENCH_DIR)
+    parser.add_argument("--out", help="result JSON (default: <workdir>/<timestamp>-<backend>-<rows>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            rows = compare(json.load(f_old), json.load(f_new), args.threshold)
+        for metric, old_ms, new_ms, ratio, regressed in rows:
+            print(f"{'REGRESSION ' if regressed else '           '}{metric:<60} {old_ms:>10.1f} -> {new_ms:>10.1f} ms  ({ratio:.2f}x)")
+        raise SystemExit(1 if any(r[4] for r in rows) else 0)
+
+    rows = synth_data.parse_rows(args.rows)
+    result = run(rows, args.backend, args.workdir, args.seed, args.repeat, args.database)
+    out = args.out or os.path.join(
+        args.workdir, "%s-%s-%s.json" % (datetime.now().strftime("%Y%m%d-%H%M%S"), args.backend, args.rows)
+    )
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    slowest = sorted(result["stages"]["queries"].items(), key=lambda kv: -kv[1]["median_ms"])[:5]
+    for name, timing in slowest:
+        print(f"  {name:<50} {timing['median_ms']:>9.1f} ms")
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
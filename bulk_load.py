@@ -0,0 +1,198 @@
+# BULK LOADER
+# Streams cleaned_traffic_stops.csv into MySQL in batches instead of one
+# INSERT per row.
+#
+#   python bulk_load.py cleaned_traffic_stops.csv --batch-size 20000
+#   python bulk_load.py cleaned_traffic_stops.csv --method infile --indexes rebuild
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from cleaning import CLEAN_CSV_DTYPES, export_frame
+from db import STOP_COLUMNS, TRAFFIC_STOPS_DDL, get_connection
+from migrate import applied_versions, column_collations, column_types, migrate, widen_enums
+
+BATCH_SIZE = 10000
+# Files bigger than this get their secondary indexes dropped and rebuilt
+# once at the end ("--indexes auto").
+REBUILD_INDEX_BYTES = 100 * 1024 * 1024
+
+INSERT_QUERY = "INSERT INTO traffic_stops (%s) VALUES (%s)" % (
+    ", ".join(STOP_COLUMNS), ", ".join(["%s"] * len(STOP_COLUMNS))
+)
+
+
+def iter_chunks(path, batch_size=BATCH_SIZE):
+    """Read the cleaned CSV in fixed-size chunks with the loader's column order."""
+    return pd.read_csv(path, usecols=lambda c: c in STOP_COLUMNS, dtype=CLEAN_CSV_DTYPES, chunksize=batch_size)
+
+
+def prepare_chunk(chunk):
+    """Coerce a chunk into values MySQL accepts (NaN -> NULL, bools -> 0/1).
+
+    Typed frames from clean_pipeline.py (bool flags, Int16 ages, Int32
+    stop_time seconds) pass through without re-parsing.
+    """
+    chunk = export_frame(chunk.reindex(columns=STOP_COLUMNS))
+    if not pd.api.types.is_bool_dtype(chunk["search_conducted"]):
+        chunk["search_conducted"] = chunk["search_conducted"].map(
+            {True: 1, False: 0, "True": 1, "False": 0, 1: 1, 0: 0}
+        )
+    chunk["search_conducted"] = chunk["search_conducted"].astype("Int64")
+    if not pd.api.types.is_integer_dtype(chunk["driver_age"]):
+        chunk["driver_age"] = pd.to_numeric(chunk["driver_age"], errors="coerce").round()
+    chunk["driver_age"] = chunk["driver_age"].astype("Int64")
+    return chunk
+
+
+def chunk_rows(chunk):
+    """Plain Python tuples for executemany, with missing values as None."""
+    return list(chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None))
+
+
+# SECONDARY INDEXES
+def secondary_indexes(cursor, table="traffic_stops"):
+    """Return {index_name: ADD INDEX clause} for every non-primary index."""
+    cursor.execute(
+        """
+        SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME, SUB_PART
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY'
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+        """,
+        (table,),
+    )
+    columns, unique = {}, {}
+    for name, non_unique, column, sub_part in cursor.fetchall():
+        part = "`%s`(%d)" % (column, sub_part) if sub_part else "`%s`" % column
+        columns.setdefault(name, []).append(part)
+        unique[name] = not non_unique
+    return {
+        name: "ADD %sINDEX `%s` (%s)" % ("UNIQUE " if unique[name] else "", name, ", ".join(parts))
+        for name, parts in columns.items()
+    }
+
+
+def drop_indexes(cursor, indexes, table="traffic_stops"):
+    if indexes:
+        cursor.execute("ALTER TABLE %s %s" % (table, ", ".join("DROP INDEX `%s`" % n for n in indexes)))
+
+
+def rebuild_indexes(cursor, indexes, table="traffic_stops"):
+    # One ALTER so InnoDB sorts and builds every index in a single pass.
+    if indexes:
+        cursor.execute("ALTER TABLE %s %s" % (table, ", ".join(indexes.values())))
+
+
+# LOAD METHODS
+def _load_executemany(cursor, chunk):
+    # mysql.connector rewrites executemany on INSERT ... VALUES into one
+    # multi-row INSERT per call.
+    cursor.executemany(INSERT_QUERY, chunk_rows(chunk))
+
+
+def _load_infile(cursor, chunk):
+    fd, tmp = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        chunk.to_csv(tmp, index=False, header=False, na_rep="\\N", quoting=csv.QUOTE_MINIMAL)
+        cursor.execute(
+            "LOAD DATA LOCAL INFILE %%s INTO TABLE traffic_stops "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\n' (%s)" % ", ".join(STOP_COLUMNS),
+            (tmp,),
+        )
+    finally:
+        os.remove(tmp)
+
+
+LOAD_METHODS = {"executemany": _load_executemany, "infile": _load_infile}
+
+
+def load_frames(frames, conn, method="executemany", rebuild=False, progress=True):
+    """Insert an iterable of DataFrame chunks, committing once per chunk.
+
+    Returns a dict with the row count, elapsed seconds and rows per second.
+    """
+    load = LOAD_METHODS[method]
+    cursor = conn.cursor()
+    cursor.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+    indexes = secondary_indexes(cursor) if rebuild else {}
+    drop_indexes(cursor, indexes)
+    types, collations = column_types(cursor), column_collations(cursor)
+
+    rows, start = 0, time.perf_counter()
+    try:
+        for chunk in frames:
+            chunk = prepare_chunk(chunk)
+            widen_enums(cursor, chunk, types, collations)
+            load(cursor, chunk)
+            conn.commit()
+            rows += len(chunk)
+            if progress:
+                elapsed = time.perf_counter() - start
+                print(f"  {rows:,} rows  ({rows / elapsed:,.0f} rows/s)")
+    finally:
+        if indexes:
+            if progress:
+                print(f"Rebuilding {len(indexes)} secondary index(es)...")
+            rebuild_indexes(cursor, indexes)
+        cursor.execute("SET SESSION unique_checks = 1, foreign_key_checks = 1")
+        cursor.close()
+
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed if elapsed else 0.0}
+
+
+def load_csv(path, batch_size=BATCH_SIZE, method="executemany", indexes="auto", progress=True,
+             refresh_summary=True):
+    """Load a cleaned CSV into traffic_stops (creating the table if needed).
+
+    If the database has schema migrations applied, they are re-run on the
+    reloaded table. The summary tables are rebuilt afterwards unless
+    ``refresh_summary`` is False.
+    """
+    rebuild = indexes == "rebuild" or (indexes == "auto" and os.path.getsize(path) > REBUILD_INDEX_BYTES)
+    conn = get_connection(allow_local_infile=(method == "infile"))
+    try:
+        cursor = conn.cursor()
+        cursor.execute(TRAFFIC_STOPS_DDL)
+        cursor.close()
+        stats = load_frames(iter_chunks(path, batch_size), conn, method=method, rebuild=rebuild, progress=progress)
+        cursor = conn.cursor()
+        migrated = applied_versions(cursor)
+        cursor.close()
+        if migrated:
+            stats["migrations"] = migrate(conn, recheck=True, progress=progress)
+        if refresh_summary:
+            from incremental import rebuild_summaries
+
+            stats["summaries"] = rebuild_summaries(conn)
+    finally:
+        conn.close()
+    if progress:
+        print(f"Loaded {stats['rows']:,} rows in {stats['seconds']:.1f}s ({stats['rows_per_sec']:,.0f} rows/s)")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load cleaned traffic stops into MySQL.")
+    parser.add_argument("csv", nargs="?", default="cleaned_traffic_stops.csv")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--method", choices=sorted(LOAD_METHODS), default="executemany")
+    parser.add_argument("--no-summaries", action="store_true", help="skip rebuilding the summary tables")
+    parser.add_argument(
+        "--indexes", choices=["auto", "rebuild", "keep"], default="auto",
+        help="drop secondary indexes during the load and rebuild them after (auto: files over 100 MB)",
+    )
+    args = parser.parse_args(argv)
+    load_csv(args.csv, batch_size=args.batch_size, method=args.method, indexes=args.indexes,
+             refresh_summary=not args.no_summaries)
+
+
+if __name__ == "__main__":
+    main()
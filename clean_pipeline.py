@@ -0,0 +1,275 @@
+# STREAMING CLEANING PIPELINE
+# The steps from 1.Data_cleaning.ipynb (typed transforms in cleaning.py)
+# applied chunk by chunk, so peak memory is one chunk plus a fixed-size
+# dedup filter instead of the whole export.
+#
+#   python clean_pipeline.py traffic_stops.xlsx --out cleaned_traffic_stops.csv
+#   python clean_pipeline.py traffic_stops.xlsx --out cleaned.parquet --format parquet
+#   python clean_pipeline.py traffic_stops.xlsx --out traffic_stops_dataset --format dataset
+#   python clean_pipeline.py traffic_stops.xlsx --format mysql
+#
+# Pass 1 streams the file once to find all-empty columns and the exact
+# driver_age median (from a histogram of ages); pass 2 cleans and emits.
+import argparse
+import math
+import os
+import shutil
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from cleaning import apply_schema, export_frame, fill_missing, finish, iter_csv, scan_csv, to_arrow
+
+CHUNK_SIZE = 50000
+EXPECTED_ROWS = 10_000_000
+FALSE_POSITIVE_RATE = 1e-6
+
+
+# READERS
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield DataFrame chunks (cleaning.RAW_DTYPES schema) from a .csv or .xlsx export."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        for chunk in _read_excel_chunks(path, chunk_size):
+            yield apply_schema(chunk)
+    else:
+        yield from iter_csv(path, chunk_size)
+
+
+def _read_excel_chunks(path, chunk_size):
+    # openpyxl's read-only mode streams rows instead of loading the sheet.
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(h) for h in next(rows)]
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+# PASS 1: PROFILE
+def median_from_counts(counts):
+    """Exact median of the values in a {value: count} histogram."""
+    total = sum(counts.values())
+    if not total:
+        return float("nan")
+    lower, upper = (total - 1) // 2, total // 2
+    seen, low_value = 0, None
+    for value in sorted(counts):
+        seen += counts[value]
+        if low_value is None and seen > lower:
+            low_value = value
+        if seen > upper:
+            return (low_value + value) / 2
+
+
+def profile(path, chunk_size=CHUNK_SIZE):
+    """One streaming pass: non-empty columns, the age median and the row count."""
+    scan = None if path.lower().endswith((".xlsx", ".xlsm")) else scan_csv(path)
+    if scan is not None:
+        return {
+            "columns": [c for c in scan["columns"] if scan["nulls"][c] < scan["rows"]],
+            "age_median": median_from_counts(scan["ages"]),
+            "rows": scan["rows"],
+        }
+    non_empty, ages, rows = set(), Counter(), 0
+    for chunk in read_chunks(path, chunk_size):
+        non_empty.update(chunk.columns[chunk.notna().any()])
+        if "driver_age" in chunk:
+            ages.update(pd.to_numeric(chunk["driver_age"], errors="coerce").dropna().value_counts().to_dict())
+        rows += len(chunk)
+        columns = list(chunk.columns)
+    return {
+        "columns": [c for c in columns if c in non_empty] if rows else [],
+        "age_median": median_from_counts(ages),
+        "rows": rows,
+    }
+
+
+# CROSS-CHUNK DEDUP
+class BloomDeduper:
+    """Remembers row hashes in a fixed-size Bloom filter.
+
+    Memory is fixed up front from the expected row count and false-positive
+    rate (about 29 bits per row at 1e-6), whatever the input size. A false
+    positive drops a unique row, so size ``expected_rows`` generously.
+    """
+
+    def __init__(self, expected_rows=EXPECTED_ROWS, fp_rate=FALSE_POSITIVE_RATE):
+        self.bits = max(64, int(-expected_rows * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / expected_rows * math.log(2)))
+        self.rows = 0  # digests added so far (with repeats)
+        self._array = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, digests):
+        # Kirsch-Mitzenmacher double hashing from the two halves of the digest.
+        h1 = digests & np.uint64(0xFFFFFFFF)
+        h2 = (digests >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.bits)
+
+    def _bits(self, digests):
+        positions = self._positions(np.asarray(digests, dtype=np.uint64))
+        return positions // np.uint64(8), (positions % np.uint64(8)).astype(np.uint8)
+
+    def contains(self, digests):
+        """True where a digest was (probably) added before; marks nothing."""
+        byte, bit = self._bits(digests)
+        return ((self._array[byte] >> bit) & 1).all(axis=1)
+
+    def add(self, digests):
+        byte, bit = self._bits(digests)
+        np.bitwise_or.at(self._array, byte.ravel(), (np.uint8(1) << bit).ravel())
+        self.rows += len(byte)
+
+    def seen_before(self, digests):
+        """Mark digests as seen; True where a digest was (probably) already present."""
+        present = self.contains(digests)
+        self.add(digests)
+        return present
+
+    def false_positive_rate(self):
+        """Chance that a new digest is reported as seen, at the current fill."""
+        return (1 - math.exp(-self.hashes * self.rows / self.bits)) ** self.hashes
+
+    @property
+    def nbytes(self):
+        return self._array.nbytes
+
+
+def row_digests(chunk):
+    # Every chunk has the same declared dtypes, and categoricals hash by
+    # value rather than by code, so equal rows hash equal across chunks.
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+
+
+# PASS 2: CLEAN
+def drop_duplicates(chunk, deduper):
+    """``chunk`` without in-chunk repeats or rows ``deduper`` has seen, and
+    the kept rows' digests, which are not added to ``deduper``."""
+    digests = row_digests(chunk)
+    # One hash pass covers both in-chunk and cross-chunk duplicates.
+    keep = ~pd.Series(digests).duplicated().to_numpy() & ~deduper.contains(digests)
+    return chunk[keep], digests[keep]
+
+
+def clean_chunk(chunk, columns, age_median, deduper):
+    """Apply the notebook's cleaning steps to one chunk."""
+    chunk = fill_missing(chunk[[c for c in columns if c in chunk.columns]], age_median)
+    chunk, digests = drop_duplicates(chunk, deduper)
+    deduper.add(digests)
+    return finish(chunk)
+
+
+def clean_stream(path, chunk_size=CHUNK_SIZE, expected_rows=None, fp_rate=FALSE_POSITIVE_RATE, stats=None):
+    """Yield cleaned chunks; ``stats`` (a dict) is filled with run details.
+
+    stats["expected_false_positives"] is the number of unique rows the
+    dedup filter is expected to have dropped as duplicates.
+    """
+    info = profile(path, chunk_size)
+    deduper = BloomDeduper(expected_rows or max(info["rows"], 1), fp_rate)
+    stats = {} if stats is None else stats
+    stats.update(rows_in=info["rows"], rows_out=0, age_median=info["age_median"], dedup_bytes=deduper.nbytes,
+                 expected_false_positives=0.0)
+    for chunk in read_chunks(path, chunk_size):
+        stats["expected_false_positives"] += deduper.false_positive_rate() * len(chunk)
+        cleaned = clean_chunk(chunk, info["columns"], info["age_median"], deduper)
+        stats["rows_out"] += len(cleaned)
+        if len(cleaned):
+            yield cleaned
+
+
+# SINKS
+def write_csv(chunks, path):
+    if os.path.exists(path):
+        os.remove(path)
+    for i, chunk in enumerate(chunks):
+        export_frame(chunk).to_csv(path, mode="a", header=(i == 0), index=False)
+
+
+def write_parquet(chunks, path):
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = to_arrow(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_dataset(chunks, path):
+    """Hive-partitioned Parquet dataset (stop_year/stop_month/country_name)
+    for the DuckDB backend."""
+    import pyarrow.dataset as ds
+
+    # Clear the whole directory up front: "delete_matching" would drop
+    # partitions written by earlier chunks of this same run.
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    for i, chunk in enumerate(chunks):
+        chunk = chunk.assign(
+            stop_year=chunk["stop_date"].dt.year.astype("Int16"),
+            stop_month=chunk["stop_date"].dt.month.astype("Int8"),
+        )
+        ds.write_dataset(
+            to_arrow(chunk),
+            path,
+            format="parquet",
+            partitioning=["stop_year", "stop_month", "country_name"],
+            partitioning_flavor="hive",
+            basename_template=f"part-{i:05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+
+def write_mysql(chunks):
+    from incremental import append_frames
+
+    return append_frames(chunks, progress=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean a traffic stop export in bounded memory.")
+    parser.add_argument("source", help=".xlsx or .csv export")
+    parser.add_argument("--out", default="cleaned_traffic_stops.csv")
+    parser.add_argument("--format", choices=["csv", "parquet", "dataset", "mysql"], default="csv",
+                        help="dataset: partitioned Parquet directory for CHECKPOST_BACKEND=duckdb")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--expected-rows", type=int, help="sizes the dedup filter (default: row count from pass 1)")
+    parser.add_argument("--fp-rate", type=float, default=FALSE_POSITIVE_RATE)
+    args = parser.parse_args(argv)
+
+    stats = {}
+    chunks = clean_stream(args.source, args.chunk_size, args.expected_rows, args.fp_rate, stats)
+    if args.format == "csv":
+        write_csv(chunks, args.out)
+    elif args.format == "parquet":
+        write_parquet(chunks, args.out)
+    elif args.format == "dataset":
+        write_dataset(chunks, args.out)
+    else:
+        write_mysql(chunks)
+    print(
+        f"Cleaned {stats['rows_in']:,} rows -> {stats['rows_out']:,} "
+        f"(age median {stats['age_median']}, dedup filter {stats['dedup_bytes'] / 2**20:.1f} MiB, "
+        f"{stats['expected_false_positives']:,.2f} unique rows expected lost to false positives)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# CLEANING TRANSFORMS
+# The 1.Data_cleaning.ipynb steps as typed, vectorized functions. Frames
+# carry an explicit dtype schema from the moment they are read:
+#
+#   low-cardinality text   category (int8 codes + one copy of each value)
+#   stop_date              datetime64[s], parsed once per distinct date
+#   stop_time              Int32 seconds since midnight, parsed once per
+#                          distinct time (no per-row datetime.time objects)
+#   driver_age             Int16 (filled with the median)
+#   flags                  bool
+#
+# clean_pipeline.py streams files through these; bulk_load.py accepts the
+# cleaned frames as they are.
+import numpy as np
+import pandas as pd
+
+DATE_FORMAT = "%Y-%m-%d"
+TIME_FORMAT = "%H:%M:%S"
+
+CATEGORY_COLUMNS = [
+    "country_name", "county_name", "driver_gender", "driver_race", "violation_raw",
+    "violation", "search_type", "stop_outcome", "stop_duration",
+]
+FLAG_COLUMNS = ["search_conducted", "is_arrested", "drugs_related_stop"]
+
+# How a raw export is read. Dates, times and True/False flags arrive as
+# categories so each distinct value is parsed once.
+RAW_DTYPES = {
+    **{c: "category" for c in CATEGORY_COLUMNS + FLAG_COLUMNS},
+    "stop_date": "category",
+    "stop_time": "category",
+    "driver_age_raw": "float32",
+    "driver_age": "float32",
+    "vehicle_number": "string",
+}
+
+# The cleaned frame handed to the sinks and the loader.
+CLEAN_DTYPES = {
+    **{c: "category" for c in CATEGORY_COLUMNS},
+    **{c: "bool" for c in FLAG_COLUMNS},
+    "stop_date": "datetime64[s]",
+    "stop_time": "Int32",
+    "driver_age": "Int16",
+    "vehicle_number": "string",
+}
+
+# Reading a cleaned CSV back (bulk_load.iter_chunks): text stays compact,
+# dates and times stay as text for MySQL to parse.
+CLEAN_CSV_DTYPES = {**{c: "category" for c in CATEGORY_COLUMNS}, "vehicle_number": "string"}
+
+FILL_VALUES = {
+    "violation": "Unknown",
+    "search_type": "Unknown",
+    "search_conducted": False,
+    "is_arrested": False,
+    "drugs_related_stop": False,
+}
+DROP_COLUMNS = ["driver_age_raw", "violation_raw", "is_arrested", "drugs_related_stop"]
+
+_TIME_STRINGS = None
+
+
+# SCHEMA
+def apply_schema(df, dtypes=RAW_DTYPES):
+    """Cast the columns ``dtypes`` knows about (for frames not read with dtype=)."""
+    return df.astype({c: t for c, t in dtypes.items() if c in df and df[c].dtype != t})
+
+
+def iter_csv(path, chunk_size):
+    """Yield RAW_DTYPES frames of ``chunk_size`` rows from a CSV export.
+
+    Uses pyarrow's streaming reader when it is installed (it dictionary-
+    encodes text while parsing); otherwise pandas' C parser.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        yield from pd.read_csv(path, dtype=RAW_DTYPES, chunksize=chunk_size)
+        return
+
+    text = pa.dictionary(pa.int32(), pa.string())
+    arrow_types = {c: text if t == "category" else pa.string() if t == "string" else pa.from_numpy_dtype(t)
+                   for c, t in RAW_DTYPES.items()}
+    reader = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types=arrow_types, strings_can_be_null=True,
+    ))
+    pending, rows = [], 0
+    for batch in reader:
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield apply_schema(table.slice(0, chunk_size).to_pandas())
+            rest = table.slice(chunk_size)
+            pending, rows = rest.to_batches(), rest.num_rows
+    if rows:
+        yield apply_schema(pa.Table.from_batches(pending, schema=reader.schema).to_pandas())
+
+
+def scan_csv(path):
+    """Column null counts, a driver_age histogram and the row count of a CSV,
+    without building DataFrames. Returns None when pyarrow is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return None
+
+    reader = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={"driver_age": pa.float64()}, strings_can_be_null=True,
+    ))
+    columns = reader.schema.names
+    nulls, ages, rows = dict.fromkeys(columns, 0), {}, 0
+    for batch in reader:
+        rows += batch.num_rows
+        for name, column in zip(columns, batch.columns):
+            nulls[name] += column.null_count
+        if "driver_age" in columns:
+            counts = pc.value_counts(batch.column("driver_age").drop_null())
+            for value, count in zip(counts.field("values").to_pylist(), counts.field("counts").to_pylist()):
+                if value == value:
+                    ages[value] = ages.get(value, 0) + count
+    return {"columns": columns, "nulls": nulls, "ages": ages, "rows": rows}
+
+
+# PARSING
+def _by_category(series, convert, dtype):
+    """Apply ``convert`` to each distinct value once and broadcast it back by code."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    values = pd.array(convert(series.cat.categories), dtype=dtype)
+    return pd.Series(values.take(series.cat.codes.to_numpy(), allow_fill=True), index=series.index)
+
+
+def parse_dates(series):
+    """Dates ('2020-01-01' text or Excel datetimes) -> datetime64[s]."""
+    def convert(values):
+        if not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values.astype(str), format=DATE_FORMAT, errors="coerce")
+        return values.astype("datetime64[s]")
+
+    return _by_category(series, convert, "datetime64[s]")
+
+
+def _hms_seconds(values):
+    # 'HH:MM:SS' as fixed-width UTF-32: digits are read straight from the
+    # code point matrix instead of going through strptime for each value.
+    text = pd.Index(values.astype(str))
+    lengths = text.str.len().to_numpy()
+    raw = np.asarray(text, dtype="U8")
+    b = raw.view(np.uint32).reshape(len(raw), 8).astype(np.int64) - ord("0")
+    digits = b[:, [0, 1, 3, 4, 6, 7]]
+    valid = (lengths == 8) & (b[:, 2] == ord(":") - ord("0")) & (b[:, 5] == ord(":") - ord("0"))
+    valid &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+    h, m, sec = digits[:, 0] * 10 + digits[:, 1], digits[:, 2] * 10 + digits[:, 3], digits[:, 4] * 10 + digits[:, 5]
+    valid &= (h < 24) & (m < 60) & (sec < 60)
+    seconds = pd.array(h * 3600 + m * 60 + sec, dtype="Int32")
+    seconds[~valid] = pd.NA
+    return seconds
+
+
+def parse_times(series):
+    """Times ('13:05:00' text or Excel time objects) -> Int32 seconds since midnight."""
+    return _by_category(series, _hms_seconds, "Int32")
+
+
+def parse_flags(series):
+    """True/False flags (text, 0/1 or bools) -> nullable boolean."""
+    lookup = {"true": True, "false": False, "1": True, "0": False}
+    return _by_category(series, lambda values: [lookup.get(str(v).lower()) for v in values], "boolean")
+
+
+def time_strings():
+    """'HH:MM:SS' for every second of the day, indexed by seconds since midnight."""
+    global _TIME_STRINGS
+    if _TIME_STRINGS is None:
+        s = np.arange(86400)
+        _TIME_STRINGS = np.asarray(["%02d:%02d:%02d" % hms for hms in zip(s // 3600, s // 60 % 60, s % 60)],
+                                   dtype=object)
+    return _TIME_STRINGS
+
+
+def format_times(seconds):
+    """Int32 seconds since midnight -> 'HH:MM:SS' text (missing stays missing)."""
+    seconds = pd.Series(seconds)
+    out = np.full(len(seconds), None, dtype=object)
+    known = seconds.notna().to_numpy()
+    out[known] = time_strings()[seconds[known].to_numpy(dtype=np.int64)]
+    return pd.Series(out, index=seconds.index)
+
+
+# TRANSFORMS
+def fill_missing(df, age_median):
+    """The notebook's fillna steps, keeping each column's dtype."""
+    df = df.copy()
+    for column in FLAG_COLUMNS:
+        if column in df and df[column].dtype != "boolean":
+            df[column] = parse_flags(df[column])
+    if "driver_age" in df:
+        df["driver_age"] = df["driver_age"].fillna(age_median)
+    for column, value in FILL_VALUES.items():
+        if column not in df:
+            continue
+        if isinstance(df[column].dtype, pd.CategoricalDtype) and value not in df[column].cat.categories:
+            df[column] = df[column].cat.add_categories([value])
+        df[column] = df[column].fillna(value)
+    return df
+
+
+def finish(df):
+    """Parse dates/times, drop the raw-only columns and settle the clean dtypes."""
+    if "stop_time" in df:
+        df["stop_time"] = parse_times(df["stop_time"])
+    if "stop_date" in df:
+        df["stop_date"] = parse_dates(df["stop_date"])
+    if "driver_age" in df:
+        df["driver_age"] = df["driver_age"].round().astype("Int16")
+    df = df.drop(columns=[c for c in DROP_COLUMNS if c in df])
+    return apply_schema(df, CLEAN_DTYPES)
+
+
+def export_frame(df):
+    """A cleaned frame with stop_time as 'HH:MM:SS' text, for CSV and MySQL."""
+    if "stop_time" in df and pd.api.types.is_integer_dtype(df["stop_time"]):
+        df = df.assign(stop_time=format_times(df["stop_time"]))
+    return df
+
+
+def to_arrow(df):
+    """A cleaned frame as an Arrow table, with stop_time as time32[s]."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if "stop_time" in df:
+        i = table.schema.get_field_index("stop_time")
+        table = table.set_column(i, "stop_time", table.column(i).cast(pa.time32("s")))
+    return table
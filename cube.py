@@ -0,0 +1,142 @@
+# SUMMARY CUBE
+# One GROUP BY pass over traffic_stops produces traffic_stops_cube: stop,
+# arrest and search counts (plus duration sums) for every combination of the
+# dimensions the dashboard slices by. The Insights panels roll this table up
+# instead of rescanning traffic_stops.
+#
+#   python cube.py            # rebuild the summaries from traffic_stops
+#
+# New rows appended after a build are folded in incrementally by
+# incremental.py (apply_cube_delta) instead of rebuilding.
+
+CUBE_TABLE = "traffic_stops_cube"
+
+# The dashboard shows '18-25'; 18-24 and 25 are kept apart in the cube so
+# "younger than 25" can still be answered from it.
+AGE_BAND_SQL = """CASE
+        WHEN driver_age < 18 THEN 'Under 18'
+        WHEN driver_age BETWEEN 18 AND 24 THEN '18-24'
+        WHEN driver_age = 25 THEN '25'
+        WHEN driver_age BETWEEN 26 AND 40 THEN '26-40'
+        WHEN driver_age BETWEEN 41 AND 60 THEN '41-60'
+        ELSE '60+' END"""
+
+# Rolls age_band back up to the dashboard's age groups.
+AGE_GROUP_SQL = "CASE WHEN age_band IN ('18-24', '25') THEN '18-25' ELSE age_band END"
+
+# cube column -> expression over traffic_stops
+DIMENSIONS = {
+    "country_name": "country_name",
+    "violation": "violation",
+    "driver_gender": "driver_gender",
+    "driver_race": "driver_race",
+    "age_band": AGE_BAND_SQL,
+    "stop_year": "YEAR(stop_date)",
+    "stop_month": "MONTH(stop_date)",
+    "stop_hour": "HOUR(stop_time)",
+    "stop_outcome": "stop_outcome",
+    "search_conducted": "search_conducted",
+}
+
+# stop_duration holds buckets such as '16-30 Min'; like the original
+# AVG(stop_duration) we average the leading number of each bucket.
+MEASURES = {
+    "stops": "COUNT(*)",
+    "arrests": "SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END)",
+    "searches": "SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END)",
+    "duration_sum": "SUM(CAST(REGEXP_SUBSTR(stop_duration, '^[0-9]+') AS DECIMAL(10, 0)))",
+    "duration_count": "COUNT(REGEXP_SUBSTR(stop_duration, '^[0-9]+'))",
+}
+
+_CUBE_COLUMNS = ", ".join(list(DIMENSIONS) + list(MEASURES))
+
+CUBE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    country_name VARCHAR(100),
+    violation VARCHAR(100),
+    driver_gender VARCHAR(10),
+    driver_race VARCHAR(50),
+    age_band VARCHAR(8),
+    stop_year SMALLINT,
+    stop_month TINYINT,
+    stop_hour TINYINT,
+    stop_outcome VARCHAR(50),
+    search_conducted BOOLEAN,
+    stops INT NOT NULL,
+    arrests INT NOT NULL,
+    searches INT NOT NULL,
+    duration_sum BIGINT NOT NULL,
+    duration_count INT NOT NULL,
+    KEY idx_cube_cell ({dims}),
+    KEY idx_cube_violation (violation),
+    KEY idx_cube_country_year (country_name, stop_year)
+)
+"""
+
+
+def cube_ddl(table=CUBE_TABLE):
+    return CUBE_DDL.format(table=table, dims=", ".join(DIMENSIONS))
+
+
+def cube_select_sql(where=""):
+    """The single-pass aggregation over traffic_stops that feeds the cube."""
+    select = ",\n    ".join(
+        ["%s AS %s" % (expr, name) for name, expr in DIMENSIONS.items()]
+        + ["COALESCE(%s, 0) AS %s" % (expr, name) for name, expr in MEASURES.items()]
+    )
+    # Group by the expressions, not the aliases: a source with real
+    # stop_year/stop_hour columns would otherwise bind the alias to those.
+    return "SELECT\n    %s\nFROM traffic_stops\n%sGROUP BY %s" % (
+        select, where + "\n" if where else "", ", ".join(DIMENSIONS.values())
+    )
+
+
+def rebuild_cube(conn, last_id):
+    """Rebuild the cube from rows with id <= last_id and swap it in atomically.
+
+    Readers keep seeing the previous cube until the RENAME, so the dashboard
+    never hits an empty or half-built table. Returns the number of cube rows.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s_new, %s_old" % (CUBE_TABLE, CUBE_TABLE))
+    cursor.execute(cube_ddl(CUBE_TABLE + "_new"))
+    cursor.execute("INSERT INTO %s_new (%s)\n%s" % (
+        CUBE_TABLE, _CUBE_COLUMNS, cube_select_sql("WHERE id <= %s")
+    ), (last_id,))
+    cells = cursor.rowcount
+    conn.commit()
+    cursor.execute("RENAME TABLE {t} TO {t}_old, {t}_new TO {t}".format(t=CUBE_TABLE))
+    cursor.execute("DROP TABLE %s_old" % CUBE_TABLE)
+    cursor.close()
+    return cells
+
+
+def apply_cube_delta(cursor, low_id, high_id):
+    """Fold rows with low_id < id <= high_id into the cube.
+
+    The new rows are aggregated into a temporary delta cube, matching cells
+    are incremented and unseen cells are inserted, so the cost depends on
+    the number of new rows rather than the table size. Runs inside the
+    caller's transaction.
+    """
+    match = " AND ".join("c.{0} <=> d.{0}".format(dim) for dim in DIMENSIONS)
+    cursor.execute("DROP TEMPORARY TABLE IF EXISTS cube_delta")
+    cursor.execute(
+        "CREATE TEMPORARY TABLE cube_delta AS\n" + cube_select_sql("WHERE id > %s AND id <= %s"),
+        (low_id, high_id),
+    )
+    cursor.execute("UPDATE %s c JOIN cube_delta d ON %s SET %s" % (
+        CUBE_TABLE, match, ", ".join("c.{0} = c.{0} + d.{0}".format(m) for m in MEASURES)
+    ))
+    cursor.execute("INSERT INTO %s (%s) SELECT %s FROM cube_delta d LEFT JOIN %s c ON %s WHERE c.stops IS NULL" % (
+        CUBE_TABLE, _CUBE_COLUMNS, ", ".join("d." + col for col in _CUBE_COLUMNS.split(", ")), CUBE_TABLE, match
+    ))
+    cursor.execute("DROP TEMPORARY TABLE cube_delta")
+
+
+if __name__ == "__main__":
+    # Rebuilding goes through incremental.py so every summary table stays in
+    # step with the shared watermark.
+    from incremental import rebuild_summaries
+
+    print(f"{CUBE_TABLE} rebuilt with {rebuild_summaries()['cube']:,} cells")
@@ -0,0 +1,535 @@
+# DATABASE LAYER
+# Shared MySQL access for the dashboard and the helper scripts: one
+# process-wide connection pool plus a TTL result cache keyed on the
+# normalized SQL text and its parameters. Other engines plug in through
+# CachedBackend (see backends.py). Every query is timed (see query_stats.py).
+# Independent queries can be dispatched together with run_many() or started
+# in the background with submit(); large results can be read as Arrow record
+# batches with stream().
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from decimal import Decimal
+
+import pandas as pd
+import mysql.connector
+from mysql.connector import pooling
+
+from query_stats import QueryStats, Timer
+
+DB_CONFIG = {
+    "host": os.environ.get("CHECKPOST_DB_HOST", "localhost"),
+    "user": os.environ.get("CHECKPOST_DB_USER", "root"),
+    "password": os.environ.get("CHECKPOST_DB_PASSWORD", "mysql@007"),
+    "database": os.environ.get("CHECKPOST_DB_NAME", "Police_checkpost"),
+}
+POOL_SIZE = int(os.environ.get("CHECKPOST_POOL_SIZE", "8"))
+CACHE_TTL = float(os.environ.get("CHECKPOST_CACHE_TTL", "300"))
+VERSION_TTL = float(os.environ.get("CHECKPOST_VERSION_TTL", "2"))
+# Worker threads for run_many() and the seconds it waits for each query
+# (0 = no limit). MySQL also stops run_query() SELECTs on the server after
+# that long; direct execute() calls (training, exports) run unlimited.
+QUERY_WORKERS = int(os.environ.get("CHECKPOST_QUERY_WORKERS", "4"))
+QUERY_TIMEOUT = float(os.environ.get("CHECKPOST_QUERY_TIMEOUT", "30"))
+STREAM_BATCH_ROWS = int(os.environ.get("CHECKPOST_STREAM_BATCH_ROWS", "10000"))
+# Server-side prepared SELECTs kept per pooled connection (0 = don't prepare).
+PREPARED_STATEMENTS = int(os.environ.get("CHECKPOST_PREPARED_STATEMENTS", "64"))
+
+# TRAFFIC STOPS SCHEMA
+STOP_COLUMNS = [
+    "stop_date", "stop_time", "country_name", "driver_gender", "driver_age",
+    "driver_race", "violation", "search_conducted", "search_type",
+    "stop_outcome", "stop_duration", "vehicle_number",
+]
+
+TRAFFIC_STOPS_DDL = """
+CREATE TABLE IF NOT EXISTS traffic_stops (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    stop_date DATE,
+    stop_time TIME,
+    country_name VARCHAR(100),
+    driver_gender VARCHAR(10),
+    driver_age INT,
+    driver_race VARCHAR(50),
+    violation VARCHAR(100),
+    search_conducted BOOLEAN,
+    search_type VARCHAR(100),
+    stop_outcome VARCHAR(50),
+    stop_duration VARCHAR(20),
+    vehicle_number VARCHAR(20)
+)
+"""
+
+# Watermark of the highest traffic_stops.id already folded into the summary
+# tables, and a generation (a UUID) replaced on every full rebuild. Together
+# they are the data version the dashboard caches key on: a reload that ends
+# at the same MAX(id) still gets a new generation.
+INGEST_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS ingest_state (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id INT NOT NULL,
+    generation CHAR(36) NOT NULL DEFAULT '',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+)
+"""
+WATERMARK_QUERY = "SELECT last_id FROM ingest_state WHERE name = 'traffic_stops'"
+VERSION_QUERY = "SELECT CONCAT(generation, ':', last_id) FROM ingest_state WHERE name = 'traffic_stops'"
+
+_WHITESPACE = re.compile(r"('(?:[^'\\]|\\.)*')|\s+")
+
+
+def get_connection(**overrides):
+    """Open a standalone connection (for notebooks and one-off scripts)."""
+    return mysql.connector.connect(**{**DB_CONFIG, **overrides})
+
+
+def ensure_ingest_state(cursor):
+    """Create ingest_state, adding the generation column to an older one."""
+    cursor.execute(INGEST_STATE_DDL)
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ingest_state' AND COLUMN_NAME = 'generation'"
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE ingest_state ADD COLUMN generation CHAR(36) NOT NULL DEFAULT '' AFTER last_id")
+
+
+def read_watermark(cursor, lock=False):
+    """Highest id folded into the summary tables (0 before the first build)."""
+    cursor.execute(WATERMARK_QUERY + (" FOR UPDATE" if lock else ""))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def write_watermark(cursor, last_id, rebuild=False):
+    """Store the watermark; ``rebuild`` (a full rebuild or reload) also
+    starts a new generation."""
+    cursor.execute(
+        "INSERT INTO ingest_state (name, last_id, generation) VALUES ('traffic_stops', %s, UUID()) "
+        "ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)" + (", generation = VALUES(generation)" if rebuild else ""),
+        (last_id,),
+    )
+
+
+def normalize_sql(query):
+    """Collapse whitespace outside string literals and drop the trailing ';'."""
+    sql = _WHITESPACE.sub(lambda m: m.group(1) or " ", query).strip()
+    return sql.rstrip(";").rstrip()
+
+
+def params_key(params):
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    return tuple(params)
+
+
+def _numeric_decimals(df):
+    """MySQL returns SUM()/ROUND() as Decimal; turn those columns into ints/floats.
+
+    Decimals without a fractional part (SUM() counts) become int64 when the
+    column has no NULLs, the rest float64, as arrow_numbers() does.
+    """
+    for col in df.columns:
+        if df[col].dtype == object:
+            first = df[col].first_valid_index()
+            if first is not None and isinstance(df[col][first], Decimal):
+                integral = all(v.as_tuple().exponent >= 0 for v in df[col].dropna())
+                df[col] = pd.to_numeric(df[col])
+                if integral:
+                    whole_numbers(df, [col])
+    return df
+
+
+def whole_numbers(df, columns):
+    """Cast ``columns`` (integer counts that arrived as floats) to int64
+    where they have no missing values."""
+    for col in columns:
+        if not df[col].isna().any():
+            df[col] = df[col].astype("int64")
+    return df
+
+
+def arrow_numbers(batch):
+    """A RecordBatch with decimal columns as int64 (scale 0) or float64."""
+    import pyarrow as pa
+
+    if not any(pa.types.is_decimal(field.type) for field in batch.schema):
+        return batch
+    return pa.RecordBatch.from_arrays(
+        [_arrow_column(column) if pa.types.is_decimal(column.type) else column for column in batch.columns],
+        names=batch.schema.names,
+    )
+
+
+class CachedBackend:
+    """TTL result cache shared by every query backend.
+
+    Subclasses implement ``execute(query, params)`` returning a DataFrame and
+    may implement ``fetch_version()``; the cache is dropped whenever the
+    value it returns changes (checked at most every ``version_ttl`` seconds).
+    ``execute`` marks its connect/execute/fetch phases on ``_start_timer()``.
+    ``dialect`` is the SQL engine the queries finally run on ("mysql" or
+    "duckdb"); callers choose between engine-specific SQL on it, not ``name``.
+    """
+
+    name = None
+    dialect = None
+
+    def __init__(self, ttl=CACHE_TTL, version_ttl=VERSION_TTL, workers=QUERY_WORKERS):
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.version_ttl = version_ttl
+        self._version = None
+        self._version_checked = float("-inf")
+        self._local = threading.local()
+        self.query_stats = QueryStats()
+        self.workers = workers
+        self._executor = None
+
+    def execute(self, query, params=None):
+        raise NotImplementedError
+
+    def _execute_for_query(self, query, params):
+        # run_query()'s uncached path; backends may add per-query limits here.
+        return self.execute(query, params)
+
+    def stream(self, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        """Yield the result as pyarrow RecordBatches of at most ``batch_rows``
+        rows, bypassing the cache; only one batch is held at a time."""
+        raise NotImplementedError
+
+    def explain(self, query, params=None):
+        """The engine's plan for ``query`` as a DataFrame."""
+        return self.execute("EXPLAIN " + normalize_sql(query), params)
+
+    def _start_timer(self):
+        timer = self._local.timer = Timer()
+        return timer
+
+    def fetch_version(self):
+        return None
+
+    def data_version(self):
+        """Current data version, clearing the cache when it has moved on."""
+        now = time.monotonic()
+        if now - self._version_checked < self.version_ttl:
+            return self._version
+        version = self.fetch_version()
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+            self._version_checked = now
+        return version
+
+    def run_query(self, query, params=None, ttl=None, name=None):
+        """Return the query result as a DataFrame, served from cache when fresh.
+
+        ``name`` labels the query in the timing stats (default: its SQL).
+        """
+        start = time.perf_counter()
+        ttl = self.ttl if ttl is None else ttl
+        self.data_version()
+        key = (normalize_sql(query), params_key(params))
+        name = name or key[0][:80]
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            hit = entry is not None and entry[0] > now
+            self._local.last_hit = hit
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            df = entry[1].copy()
+            self.query_stats.record(name, self.name, True, (time.perf_counter() - start) * 1000, rows=len(df))
+            return df
+
+        self._local.timer = None
+        df = self._execute_for_query(query, params)
+        if ttl > 0:
+            with self._lock:
+                self._cache[key] = (now + ttl, df)
+        total_ms = (time.perf_counter() - start) * 1000
+        timer = self._local.timer
+        self.query_stats.record(
+            name, self.name, False, total_ms, timer.phases if timer else None,
+            rows=len(df), nbytes=int(df.memory_usage(deep=True).sum()),
+        )
+        if self.query_stats.is_slow(total_ms) and self.query_stats.needs_plan(key[0]):
+            self._capture_plan(name, query, params, total_ms)
+        return df.copy()
+
+    def submit(self, queries):
+        """Start queries on the worker pool through run_query() without waiting.
+
+        ``queries`` maps a name to SQL or to (SQL, params). Returns {name:
+        Future}; each result also lands in the cache.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-query")
+        futures = {}
+        for name, query in queries.items():
+            query, params = query if isinstance(query, tuple) else (query, None)
+            futures[name] = self._executor.submit(self.run_query, query, params, name=name)
+        return futures
+
+    def run_many(self, queries, timeout=QUERY_TIMEOUT):
+        """Run independent queries concurrently through run_query().
+
+        ``queries`` maps a name to SQL or to (SQL, params). Returns {name:
+        DataFrame}, with the exception instead for a query that failed or
+        took longer than ``timeout`` seconds from dispatch (TimeoutError).
+        A timed-out query keeps running and still fills the cache.
+        """
+        futures = self.submit(queries)
+        deadline = time.monotonic() + timeout if timeout else None
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            except FutureTimeout:
+                results[name] = TimeoutError(f"{name} did not finish within {timeout:g}s")
+            except Exception as exc:
+                results[name] = exc
+        return results
+
+    def peek(self, query, params=None):
+        """The cached result for a query, or None; never runs it."""
+        self.data_version()
+        with self._lock:
+            entry = self._cache.get((normalize_sql(query), params_key(params)))
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1].copy()
+
+    def _capture_plan(self, name, query, params, total_ms):
+        try:
+            plan = self.explain(query, params)
+        except Exception as exc:  # a plan is diagnostics only; never fail the query over it
+            plan = pd.DataFrame({"error": [str(exc)]})
+        self.query_stats.record_plan(name, normalize_sql(query), total_ms, plan)
+
+    def last_was_hit(self):
+        """Whether this thread's most recent run_query() was served from cache."""
+        return getattr(self._local, "last_hit", False)
+
+    def invalidate(self, table=None):
+        """Drop cached results, either all of them or those reading ``table``."""
+        with self._lock:
+            if table is None:
+                self._cache.clear()
+                return
+            pattern = re.compile(r"\b%s\b" % re.escape(table), re.IGNORECASE)
+            for key in [k for k in self._cache if pattern.search(k[0])]:
+                del self._cache[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "cached_results": len(self._cache),
+                "data_version": self._version,
+            }
+
+
+class QueryLayer(CachedBackend):
+    """Pooled, cached MySQL query execution shared by every dashboard session.
+
+    SELECTs run as server-side prepared statements, kept per pooled
+    connection (up to ``prepared_statements``, least recently used dropped
+    first), so a repeated query is parsed and planned once per connection and
+    afterwards only sends its parameters.
+
+    ``read_only=True`` puts every pooled session in READ ONLY transaction
+    mode (re-applied after a session reset), so the server refuses writes to
+    tables whatever the SQL looks like.
+    """
+
+    name = "mysql"
+    dialect = "mysql"
+
+    def __init__(self, config=None, pool_size=POOL_SIZE, ttl=CACHE_TTL, version_query=None,
+                 version_ttl=VERSION_TTL, workers=QUERY_WORKERS, query_timeout=QUERY_TIMEOUT,
+                 prepared_statements=PREPARED_STATEMENTS, read_only=False):
+        super().__init__(ttl=ttl, version_ttl=version_ttl, workers=workers)
+        config = dict(config or DB_CONFIG)
+        if read_only:
+            config["init_command"] = "SET SESSION TRANSACTION READ ONLY"
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="checkpost",
+            pool_size=pool_size,
+            # Resetting the session on return would deallocate the statements.
+            pool_reset_session=not prepared_statements,
+            **config,
+        )
+        # MySQLConnectionPool raises instead of waiting when it is empty,
+        # so callers queue on a semaphore sized to the pool.
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.version_query = version_query
+        self.query_timeout = query_timeout
+        self.prepared_statements = prepared_statements
+        self._statements = {}  # connection_id -> OrderedDict(sql -> prepared cursor)
+
+    def connection(self):
+        """Borrow a pooled connection; closing it returns it to the pool."""
+        self._slots.acquire()
+        try:
+            conn = self.pool.get_connection()
+        except Exception:
+            self._slots.release()
+            raise
+        return _PooledConnection(conn, self._slots)
+
+    def fetch_version(self):
+        if self.version_query is None:
+            return None
+        try:
+            df = self.execute(self.version_query)
+        except mysql.connector.Error:
+            return None
+        return None if df.empty else df.iat[0, 0]
+
+    def _execute_for_query(self, query, params):
+        return self.execute(query, params, timeout=self.query_timeout)
+
+    def execute(self, query, params=None, timeout=None):
+        """Run a query on a pooled connection, bypassing the cache.
+
+        ``timeout`` (seconds) stops a SELECT on the server after that long;
+        run_query() passes ``query_timeout``, batch callers get no limit.
+        """
+        timer = self._start_timer()
+        if timeout and query.lstrip()[:6].upper() == "SELECT":
+            # Server-side limit, so an abandoned query frees its pool slot.
+            query = "SELECT /*+ MAX_EXECUTION_TIME(%d) */%s" % (timeout * 1000, query.lstrip()[6:])
+        prepare = self.prepared_statements and query.lstrip()[:6].upper() == "SELECT"
+        conn = self.connection()
+        timer.lap("connect_ms")
+        try:
+            if prepare:
+                cursor, query = self._prepared_cursor(conn, query)
+            else:
+                cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                timer.lap("execute_ms")
+                rows = cursor.fetchall()
+                columns = cursor.column_names
+            except mysql.connector.Error:
+                if prepare:
+                    self._forget_statement(conn, query)
+                raise
+            if not prepare:
+                cursor.close()
+        finally:
+            conn.close()
+        df = _numeric_decimals(pd.DataFrame.from_records(rows, columns=columns))
+        timer.lap("fetch_ms")
+        return df
+
+    def _prepared_cursor(self, conn, sql):
+        """(cursor, sql) for a statement prepared on ``conn``. The cursor only
+        skips re-preparing when given the very same string object, so the
+        cached one is returned for execute()."""
+        # Each connection is used by one thread at a time, so its statement
+        # cache needs no lock.
+        statements = self._statements.setdefault(conn.connection_id, OrderedDict())
+        entry = statements.pop(sql, None)
+        if entry is None:
+            if len(statements) >= self.prepared_statements:
+                statements.popitem(last=False)[1][0].close()
+            entry = (conn.cursor(prepared=True), sql)
+        statements[sql] = entry
+        return entry
+
+    def _forget_statement(self, conn, sql):
+        cursor, _sql = self._statements.get(conn.connection_id, {}).pop(sql, (None, None))
+        if cursor is not None:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+
+    def stream(self, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        """Yield the result as Arrow record batches of ``batch_rows`` rows.
+
+        mysql-connector only returns rows as tuples, so each batch is
+        transposed into columns here; a columnar reader such as connectorx
+        would materialize the whole result instead.
+        """
+        import pyarrow as pa
+
+        conn = self.connection()
+        try:
+            # Unbuffered cursor: rows stay on the server until fetchmany()
+            # asks for the next batch.
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            names = list(cursor.column_names)
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield pa.RecordBatch.from_arrays([_arrow_column(c) for c in zip(*rows)], names=names)
+            cursor.close()
+        finally:
+            if conn.unread_result:  # the caller stopped early
+                conn.consume_results()
+            conn.close()
+
+
+def _arrow_column(values):
+    import pyarrow as pa
+
+    array = values if isinstance(values, pa.Array) else pa.array(values)
+    if pa.types.is_duration(array.type):
+        # MySQL TIME arrives as timedelta; store it as a time of day.
+        array = array.cast(pa.int64()).cast(pa.time64(array.type.unit))
+    elif pa.types.is_decimal(array.type):
+        # Same as _numeric_decimals: SUM() counts -> int, rates -> float.
+        array = array.cast(pa.int64() if array.type.scale == 0 else pa.float64())
+    elif pa.types.is_null(array.type):
+        array = array.cast(pa.string())
+    return array
+
+
+class _PooledConnection:
+    """Wraps a pooled connection so closing it also frees its pool slot."""
+
+    def __init__(self, conn, slots):
+        self._conn = conn
+        self._slots = slots
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self._conn.close()
+            finally:
+                self._slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
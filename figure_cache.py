@@ -0,0 +1,85 @@
+# FIGURE CACHE
+# Plotly figures for the dashboard charts, built once per server process and
+# shared by every session. An entry is keyed on the chart and the exact query
+# behind it (SQL + parameters), so each filter bar state and approximate mode
+# get their own figure, and is tagged with the data version it was drawn
+# from: the whole cache empties when the version moves, and is otherwise
+# trimmed to the most recently used FIGURE_CACHE_ENTRIES. Entries also expire
+# after CHECKPOST_FIGURE_MAX_AGE seconds, in case the data changed without
+# moving the version; without a data version (no ingest_state table) they
+# expire after CHECKPOST_CACHE_TTL like the result cache.
+#
+#   CHECKPOST_FIGURE_CACHE=128      figures kept (0 = don't cache)
+#   CHECKPOST_FIGURE_MAX_AGE=3600   seconds a versioned figure is kept at most
+#
+# Cached figures are shared between sessions and must not be modified.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import CACHE_TTL
+
+FIGURE_CACHE_ENTRIES = int(os.environ.get("CHECKPOST_FIGURE_CACHE", "128"))
+FIGURE_MAX_AGE = float(os.environ.get("CHECKPOST_FIGURE_MAX_AGE", "3600"))
+
+
+class FigureCache:
+    """LRU of built figures, dropped whenever the data version changes."""
+
+    def __init__(self, entries=FIGURE_CACHE_ENTRIES, ttl=CACHE_TTL, max_age=FIGURE_MAX_AGE):
+        self.entries = entries
+        self.ttl = ttl
+        self.max_age = max_age
+        self._figures = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._figures.clear()
+            self._version = version
+
+    def get(self, key, version):
+        """The figure stored for ``key`` at ``version``, or None."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._figures.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._figures[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._figures.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, figure):
+        """Store ``figure`` for ``key`` (built from data at ``version``) and return it."""
+        if self.entries <= 0:
+            return figure
+        with self._lock:
+            self._check_version(version)
+            lifetime = self.ttl if version is None else self.max_age
+            self._figures[key] = (time.monotonic() + lifetime, figure)
+            self._figures.move_to_end(key)
+            while len(self._figures) > self.entries:
+                self._figures.popitem(last=False)
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "figures": len(self._figures),
+            }
@@ -0,0 +1,170 @@
+# INCREMENTAL INGEST
+# Append-only loading keyed on the traffic_stops.id watermark: new rows are
+# inserted and only those rows are folded into the summary tables, instead of
+# the DROP TABLE + full reload + full rebuild cycle.
+#
+#   python incremental.py new_stops.csv
+#   python incremental.py --rebuild       # after a full reload
+#
+# The dashboard notices the moved watermark within CHECKPOST_VERSION_TTL
+# seconds and drops its cached results. Run one appender at a time: rows are
+# folded up to MAX(id), so a concurrent writer could commit a lower id late.
+#
+# A rebuild swaps the summaries in one at a time, so it parks the watermark
+# at REBUILDING first: if it stops partway, the next apply_deltas rebuilds
+# everything instead of adding rows some summaries already hold.
+import argparse
+import time
+from collections import namedtuple
+
+from approximate import (
+    SAMPLE_TABLE, SKETCH_DDL, SKETCH_TABLE, STRATA_DDL, STRATA_TABLE, apply_sample_delta, apply_sketch_delta, apply_strata_delta, rebuild_sample,
+    rebuild_sketches, rebuild_strata, sample_ddl,
+)
+from bulk_load import BATCH_SIZE, iter_chunks, load_frames
+from cube import CUBE_TABLE, apply_cube_delta, cube_ddl, rebuild_cube
+from db import TRAFFIC_STOPS_DDL, ensure_ingest_state, get_connection, read_watermark, write_watermark
+from plate_search import (
+    TRIGRAM_COUNT_DDL, TRIGRAM_DDL, apply_trigram_count_delta, apply_trigram_delta, rebuild_trigram_counts,
+    rebuild_trigrams,
+)
+from rollup import ROLLUP_TABLE, apply_rollup_delta, rebuild_rollup, rollup_ddl
+from vehicle_profiles import (
+    COUNTRY_TABLE, PROFILE_TABLE, apply_country_delta, apply_profile_delta, country_ddl, profile_ddl, rebuild_countries, rebuild_profiles,
+)
+
+# A summary structure derived from traffic_stops, stored in ``table``
+# (created by ``ddl``). rebuild(conn, last_id)
+# recomputes it from rows with id <= last_id; apply_delta(cursor, low_id,
+# high_id) folds in rows low_id < id <= high_id inside the transaction that
+# advances the shared watermark.
+Summary = namedtuple("Summary", "table ddl rebuild apply_delta")
+
+REBUILDING = -1  # watermark while rebuild_summaries is running
+
+SUMMARIES = {
+    "cube": Summary(CUBE_TABLE, cube_ddl(), rebuild_cube, apply_cube_delta),
+    "vehicle_trigrams": Summary("vehicle_trigrams", TRIGRAM_DDL, rebuild_trigrams, apply_trigram_delta),
+    # Recounted from vehicle_trigrams, so it comes after it.
+    "vehicle_trigram_counts": Summary(
+        "vehicle_trigram_counts", TRIGRAM_COUNT_DDL, rebuild_trigram_counts, apply_trigram_count_delta
+    ),
+    "time_rollup": Summary(ROLLUP_TABLE, rollup_ddl(), rebuild_rollup, apply_rollup_delta),
+    # The strata come first: the sample reads their rates.
+    "sample_strata": Summary(STRATA_TABLE, STRATA_DDL, rebuild_strata, apply_strata_delta),
+    "sample": Summary(SAMPLE_TABLE, sample_ddl(), rebuild_sample, apply_sample_delta),
+    "sketches": Summary(SKETCH_TABLE, SKETCH_DDL, rebuild_sketches, apply_sketch_delta),
+    "vehicle_profiles": Summary(PROFILE_TABLE, profile_ddl(), rebuild_profiles, apply_profile_delta),
+    "vehicle_countries": Summary(COUNTRY_TABLE, country_ddl(), rebuild_countries, apply_country_delta),
+}
+
+
+def ensure_tables(conn):
+    """Create the base, state and summary tables (DDL commits, so do it up front)."""
+    cursor = conn.cursor()
+    ensure_ingest_state(cursor)
+    for ddl in [TRAFFIC_STOPS_DDL] + [s.ddl for s in SUMMARIES.values()]:
+        cursor.execute(ddl)
+    cursor.close()
+
+
+def rebuild_summaries(conn=None):
+    """Recompute every summary from scratch and reset the watermark to match.
+
+    Used after a full reload, and by apply_deltas after an interrupted
+    rebuild; returns {summary name: rebuild result}.
+    """
+    own_conn = conn is None
+    conn = conn or get_connection()
+    try:
+        ensure_tables(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM traffic_stops")
+        last_id = cursor.fetchone()[0]
+        write_watermark(cursor, REBUILDING, rebuild=True)
+        conn.commit()
+        results = {name: summary.rebuild(conn, last_id) for name, summary in SUMMARIES.items()}
+        write_watermark(cursor, last_id, rebuild=True)
+        conn.commit()
+        cursor.close()
+    finally:
+        if own_conn:
+            conn.close()
+    return results
+
+
+def apply_deltas(conn):
+    """Fold every row above the watermark into the summary tables.
+
+    Returns (low_id, high_id) for the range that was applied. After an
+    interrupted rebuild_summaries every summary is rebuilt instead, and the
+    range is (0, the rebuilt watermark).
+    """
+    cursor = conn.cursor()
+    try:
+        low_id = read_watermark(cursor, lock=True)
+        if low_id == REBUILDING:
+            conn.rollback()
+        else:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM traffic_stops")
+            high_id = cursor.fetchone()[0]
+            if high_id > low_id:
+                for summary in SUMMARIES.values():
+                    summary.apply_delta(cursor, low_id, high_id)
+                write_watermark(cursor, high_id)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    if low_id == REBUILDING:
+        rebuild_summaries(conn)
+        cursor = conn.cursor()
+        low_id, high_id = 0, read_watermark(cursor)
+        cursor.close()
+    return low_id, high_id
+
+
+def append_frames(frames, conn=None, progress=False):
+    """Insert new stop rows and apply their deltas; returns load stats."""
+    own_conn = conn is None
+    conn = conn or get_connection()
+    try:
+        ensure_tables(conn)
+        stats = load_frames(frames, conn, progress=progress)
+        start = time.perf_counter()
+        stats["low_id"], stats["high_id"] = apply_deltas(conn)
+        stats["delta_seconds"] = time.perf_counter() - start
+    finally:
+        if own_conn:
+            conn.close()
+    return stats
+
+
+def append_csv(path, batch_size=BATCH_SIZE, progress=True):
+    stats = append_frames(iter_chunks(path, batch_size), progress=progress)
+    if progress:
+        print(
+            f"Appended {stats['rows']:,} rows (ids {stats['low_id'] + 1:,}-{stats['high_id']:,}); "
+            f"aggregates updated in {stats['delta_seconds']:.2f}s"
+        )
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Append new traffic stops and update aggregates incrementally.")
+    parser.add_argument("csv", nargs="?")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--rebuild", action="store_true", help="recompute every summary table from scratch")
+    args = parser.parse_args(argv)
+    if args.rebuild:
+        print(f"Rebuilt summaries: {rebuild_summaries()}")
+    if args.csv:
+        append_csv(args.csv, batch_size=args.batch_size)
+    elif not args.rebuild:
+        parser.error("give a CSV to append or --rebuild")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+# INGEST SERVICE
+# A long-running service that takes stop records as they happen instead of
+# monthly bulk drops:
+#
+#   python ingest_service.py --port 8765 --drop-dir incoming/
+#
+#   POST /stops    JSON record, list of records or {"records": [...]} with
+#                  the raw export's columns (stop_date, stop_time, ...)
+#   GET  /status   throughput, queue depth, batch and summary lag figures
+#   drop dir       .csv / .xlsx / .json files are picked up, queued, then
+#                  moved to done/ (or failed/)
+#
+# Records are cleaned with the notebook's rules (clean_pipeline.clean_chunk:
+# fill missing values with the traffic_stops age median, drop duplicates
+# of recently stored rows, parse dates and times) and inserted in micro-batches:
+# a batch closes at CHECKPOST_INGEST_BATCH_ROWS rows or
+# CHECKPOST_INGEST_BATCH_SECONDS after its first record arrived, whichever
+# is first. The summary tables catch up from the watermark every
+# CHECKPOST_INGEST_SUMMARY_SECONDS (incremental.apply_deltas).
+#
+# Backpressure: at most CHECKPOST_INGEST_QUEUE_ROWS rows wait in memory.
+# Beyond that, POST /stops answers 503 with Retry-After and the file-drop
+# watcher waits before reading more. Queued rows are lost if the process
+# dies, and a dropped file counts as done once its rows are queued.
+#
+# Lost connections and lock timeouts are retried with the same batch. A
+# batch the database rejects for its data (e.g. a plate longer than
+# VARCHAR(20) in strict mode) is split in halves until the failing rows are
+# isolated; those, and batches the cleaning step fails on, are appended to
+# CHECKPOST_INGEST_DEAD_LETTER as JSON lines with the error, and counted in
+# /status as rows_dead_lettered.
+#
+# Duplicates are caught by two Bloom filters of CHECKPOST_INGEST_DEDUP_ROWS
+# rows each; when the newer one fills, the older is dropped. Memory and the
+# false-positive rate stay bounded however long the service runs, at the
+# cost of missing a repeat sent more than that many stored rows later. A
+# row's digest is recorded only once the row is committed, so a batch that
+# fails and is retried is not mistaken for its own duplicate. /status
+# reports the current false-positive rate and the expected number of unique
+# rows dropped by it so far.
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mysql.connector
+import pandas as pd
+
+from bulk_load import load_frames
+from clean_pipeline import FALSE_POSITIVE_RATE, BloomDeduper, drop_duplicates, median_from_counts, read_chunks
+from cleaning import RAW_DTYPES, apply_schema, fill_missing, finish
+from db import get_connection
+from incremental import apply_deltas, ensure_tables
+
+HOST = os.environ.get("CHECKPOST_INGEST_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CHECKPOST_INGEST_PORT", "8765"))
+BATCH_ROWS = int(os.environ.get("CHECKPOST_INGEST_BATCH_ROWS", "5000"))
+BATCH_SECONDS = float(os.environ.get("CHECKPOST_INGEST_BATCH_SECONDS", "1"))
+QUEUE_ROWS = int(os.environ.get("CHECKPOST_INGEST_QUEUE_ROWS", "50000"))
+SUMMARY_SECONDS = float(os.environ.get("CHECKPOST_INGEST_SUMMARY_SECONDS", "10"))
+DEAD_LETTER = os.environ.get("CHECKPOST_INGEST_DEAD_LETTER", "ingest_dead_letter.jsonl")
+DEDUP_ROWS = int(os.environ.get("CHECKPOST_INGEST_DEDUP_ROWS", "5000000"))
+POLL_SECONDS = 1.0
+RETRY_SECONDS = 2.0
+THROUGHPUT_WINDOW = 60.0
+DROP_SUFFIXES = (".csv", ".xlsx", ".xlsm", ".json")
+# MySQL errors about the server or the connection rather than the rows:
+# too many connections, shutdown, lock wait timeout, deadlock, and the
+# client's can't connect / gone away / lost connection codes.
+TRANSIENT_ERRNOS = {1040, 1053, 1205, 1213, 2002, 2003, 2006, 2013, 2055}
+
+
+# QUEUE
+class RowQueue:
+    """FIFO of DataFrames bounded by total rows, not by item count."""
+
+    def __init__(self, capacity=QUEUE_ROWS):
+        self.capacity = capacity
+        self.rows = 0
+        self._items = deque()  # (enqueued at, frame)
+        self._cond = threading.Condition()
+
+    def put(self, frame, timeout=None):
+        """Queue ``frame``; False if there was no room within ``timeout``
+        seconds (None waits indefinitely). A frame larger than the whole
+        queue is let in once the queue is empty."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self.rows and self.rows + len(frame) > self.capacity:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self._items.append((time.monotonic(), frame))
+            self.rows += len(frame)
+            self._cond.notify_all()
+            return True
+
+    def get_batch(self, max_rows, max_wait, idle_timeout=POLL_SECONDS):
+        """Frames for one micro-batch: up to ``max_rows`` rows, returned at
+        most ``max_wait`` seconds after the oldest of them was queued.
+        Returns [] if nothing arrives within ``idle_timeout``."""
+        with self._cond:
+            if not self._items and not self._cond.wait_for(lambda: self._items, idle_timeout):
+                return []
+            close_at = self._items[0][0] + max_wait
+            while self.rows < max_rows and time.monotonic() < close_at:
+                self._cond.wait(close_at - time.monotonic())
+            batch, rows = [], 0
+            while self._items and (not batch or rows + len(self._items[0][1]) <= max_rows):
+                _queued, frame = self._items.popleft()
+                batch.append(frame)
+                rows += len(frame)
+            self.rows -= rows
+            self._cond.notify_all()
+            return batch
+
+    def oldest_age(self):
+        with self._cond:
+            return time.monotonic() - self._items[0][0] if self._items else 0.0
+
+
+# DEDUP
+class RotatingDeduper:
+    """Two BloomDeduper generations of ``window_rows`` rows each.
+
+    Digests are checked against both and added to the newer; once it holds
+    ``window_rows``, the older is dropped and a fresh one started. Repeats
+    within the last ``window_rows`` stored rows are always caught, and the
+    false-positive rate never exceeds about twice ``fp_rate``.
+    """
+
+    def __init__(self, window_rows=DEDUP_ROWS, fp_rate=FALSE_POSITIVE_RATE):
+        self.window_rows = window_rows
+        self.fp_rate = fp_rate
+        self.current = BloomDeduper(window_rows, fp_rate)
+        self.previous = None
+        self.rotations = 0
+
+    def contains(self, digests):
+        present = self.current.contains(digests)
+        if self.previous is not None:
+            present |= self.previous.contains(digests)
+        return present
+
+    def add(self, digests):
+        while len(digests):
+            room = self.window_rows - self.current.rows
+            if room <= 0:
+                self.previous, self.current = self.current, BloomDeduper(self.window_rows, self.fp_rate)
+                self.rotations += 1
+                continue
+            self.current.add(digests[:room])
+            digests = digests[room:]
+
+    def false_positive_rate(self):
+        previous = self.previous.false_positive_rate() if self.previous is not None else 0.0
+        return 1 - (1 - self.current.false_positive_rate()) * (1 - previous)
+
+    @property
+    def nbytes(self):
+        return self.current.nbytes + (self.previous.nbytes if self.previous is not None else 0)
+
+
+# SERVICE
+def parse_records(payload):
+    """A JSON body (record, list of records or {"records": [...]}) as a raw frame."""
+    records = payload.get("records", payload) if isinstance(payload, dict) else payload
+    if isinstance(records, dict):
+        records = [records]
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise ValueError("expected a stop record, a list of records or {\"records\": [...]}")
+    unknown = sorted({key for record in records for key in record} - set(RAW_DTYPES))
+    if unknown:
+        raise ValueError("unknown fields: " + ", ".join(unknown))
+    return apply_schema(pd.DataFrame.from_records(records))
+
+
+def read_drop_file(path):
+    """Raw frames from a dropped .csv / .xlsx / .json file."""
+    if path.lower().endswith(".json"):
+        with open(path) as f:
+            yield parse_records(json.load(f))
+    else:
+        yield from read_chunks(path, BATCH_ROWS)
+
+
+def is_transient(exc):
+    """Whether retrying the same rows later can succeed."""
+    if isinstance(exc, (OSError, mysql.connector.InterfaceError)):
+        return True
+    return getattr(exc, "errno", None) in TRANSIENT_ERRNOS
+
+
+def stored_age_median(conn):
+    """driver_age median of traffic_stops (NaN while it is empty)."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT driver_age, COUNT(*) FROM traffic_stops WHERE driver_age IS NOT NULL GROUP BY driver_age")
+    counts = dict(cursor.fetchall())
+    cursor.close()
+    return median_from_counts(counts)
+
+
+class IngestService:
+    """Queue, micro-batch writer and status counters behind the HTTP and
+    file-drop front ends."""
+
+    def __init__(self, batch_rows=BATCH_ROWS, batch_seconds=BATCH_SECONDS, queue_rows=QUEUE_ROWS,
+                 summary_seconds=SUMMARY_SECONDS, connect=get_connection, dead_letter=DEAD_LETTER,
+                 dedup_rows=DEDUP_ROWS):
+        self.batch_rows = batch_rows
+        self.batch_seconds = batch_seconds
+        self.summary_seconds = summary_seconds
+        self.queue = RowQueue(queue_rows)
+        self.connect = connect
+        self.dead_letter = dead_letter
+        self.deduper = RotatingDeduper(dedup_rows)
+        self._digests = None  # digests of the batch being inserted, by row label
+        self.age_median = float("nan")
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._inserted = deque()  # (time, rows) within THROUGHPUT_WINDOW
+        self.counters = {
+            "rows_received": 0, "rows_rejected": 0, "rows_inserted": 0, "duplicates_dropped": 0,
+            "batches": 0, "files_done": 0, "files_failed": 0, "rows_awaiting_summary": 0, "rows_dead_lettered": 0,
+            "expected_false_positives": 0.0,
+        }
+        self.last_batch = {}
+        self.last_summary = {}
+        self.last_error = None
+        self.started = time.time()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    # Front ends
+    def offer(self, frame, timeout=0.0):
+        """Queue raw records; False (and counted as rejected) when the queue is full."""
+        if not self.queue.put(frame, timeout):
+            self._count(rows_rejected=len(frame))
+            return False
+        self._count(rows_received=len(frame))
+        return True
+
+    def watch(self, drop_dir):
+        """Queue every file that appears in ``drop_dir``, oldest first."""
+        for sub in ("done", "failed"):
+            os.makedirs(os.path.join(drop_dir, sub), exist_ok=True)
+        while not self.stopping.is_set():
+            names = sorted(
+                (n for n in os.listdir(drop_dir) if n.lower().endswith(DROP_SUFFIXES)),
+                key=lambda n: os.stat(os.path.join(drop_dir, n)).st_mtime,
+            )
+            for name in names:
+                path = os.path.join(drop_dir, name)
+                try:
+                    for frame in read_drop_file(path):
+                        self.offer(frame, timeout=None)  # blocks while the queue is full
+                except Exception as exc:
+                    self.last_error = f"{name}: {exc}"
+                    self._count(files_failed=1)
+                    shutil.move(path, os.path.join(drop_dir, "failed", name))
+                else:
+                    self._count(files_done=1)
+                    shutil.move(path, os.path.join(drop_dir, "done", name))
+            self.stopping.wait(POLL_SECONDS)
+
+    # Writer
+    def run_writer(self):
+        """Insert micro-batches until stopped, then drain the queue."""
+        # pending: the current batch's frames not yet committed (see _insert)
+        conn, pending, last_summary = None, [], time.monotonic()
+        while True:
+            try:
+                if conn is None:
+                    conn = self.connect()
+                    ensure_tables(conn)
+                    self.age_median = stored_age_median(conn)
+                if not pending:
+                    batch = self.queue.get_batch(self.batch_rows, self.batch_seconds)
+                    if not batch and self.stopping.is_set():
+                        break
+                    if batch:
+                        raw = pd.concat(batch, ignore_index=True)
+                        try:
+                            pending = [self._clean(raw)]
+                        except Exception as exc:  # nothing a retry would fix
+                            self._reject(raw, exc)
+                if pending:
+                    self._insert(conn, pending)
+                if self.counters["rows_awaiting_summary"] and (
+                    time.monotonic() - last_summary >= self.summary_seconds or self.stopping.is_set()
+                ):
+                    self._summarize(conn)
+                    last_summary = time.monotonic()
+            except Exception as exc:
+                # Connection and lock errors (see _insert): keep the pending
+                # rows and retry on a fresh connection; meanwhile the queue
+                # fills and pushes back on the senders.
+                self.last_error = f"{type(exc).__name__}: {exc}"
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                self.stopping.wait(RETRY_SECONDS)
+        if conn is not None:
+            conn.close()
+
+    def _clean(self, raw):
+        """The notebook's cleaning steps; duplicates of recently stored rows are dropped.
+
+        The kept rows' digests wait in ``_digests`` until _insert commits them.
+        """
+        # One column set and order for every batch, so duplicate digests match
+        # across batches whatever fields each sender filled in.
+        raw = apply_schema(raw.reindex(columns=list(RAW_DTYPES)))
+        age_median = self.age_median
+        if age_median != age_median:  # empty table: use the batch's own
+            age_median = pd.to_numeric(raw["driver_age"], errors="coerce").median()
+        false_positives = self.deduper.false_positive_rate() * len(raw)
+        chunk, digests = drop_duplicates(fill_missing(raw, age_median), self.deduper)
+        cleaned = finish(chunk)
+        self._digests = pd.Series(digests, index=chunk.index)
+        self._count(duplicates_dropped=len(raw) - len(cleaned), expected_false_positives=false_positives)
+        return cleaned
+
+    def _insert(self, conn, pending):
+        """Insert the frames in ``pending`` (a stack), removing each once committed.
+
+        A frame the database rejects for its data is split in halves; a
+        single rejected row goes to the dead-letter file. Transient errors
+        propagate with the uncommitted frames still in ``pending``, so a
+        retry never inserts a row twice.
+        """
+        start, rows = time.perf_counter(), 0
+        while pending:
+            frame = pending[-1]
+            try:
+                if len(frame):
+                    load_frames([frame], conn, progress=False)
+            except Exception as exc:
+                if is_transient(exc):
+                    raise
+                conn.rollback()
+                pending.pop()
+                if len(frame) == 1:
+                    self._reject(frame, exc)
+                else:
+                    half = len(frame) // 2
+                    pending += [frame.iloc[half:], frame.iloc[:half]]  # first half on top: id order kept
+                continue
+            pending.pop()
+            self.deduper.add(self._digests.loc[frame.index].to_numpy())
+            rows += len(frame)
+            with self._lock:
+                self._inserted.append((time.monotonic(), len(frame)))
+            self._count(rows_inserted=len(frame), rows_awaiting_summary=len(frame))
+        self._count(batches=1)
+        self.last_batch = {"rows": rows, "ms": round((time.perf_counter() - start) * 1000, 1), "at": time.time()}
+
+    def _reject(self, frame, exc):
+        """Append ``frame``'s rows to the dead-letter file with the error."""
+        error = f"{type(exc).__name__}: {exc}"
+        self.last_error = error
+        at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        records = frame.astype(object).where(frame.notna(), None).to_dict("records")
+        with open(self.dead_letter, "a") as f:
+            for record in records:
+                f.write(json.dumps({"at": at, "error": error, "record": record}, default=str) + "\n")
+        self._count(rows_dead_lettered=len(records))
+
+    def _summarize(self, conn):
+        start = time.perf_counter()
+        low_id, high_id = apply_deltas(conn)
+        with self._lock:
+            self.counters["rows_awaiting_summary"] = 0
+        self.last_summary = {
+            "ids": [low_id, high_id], "ms": round((time.perf_counter() - start) * 1000, 1), "at": time.time(),
+        }
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._inserted and now - self._inserted[0][0] > THROUGHPUT_WINDOW:
+                self._inserted.popleft()
+            window_rows = sum(rows for _t, rows in self._inserted)
+            counters = dict(self.counters)
+        counters["expected_false_positives"] = round(counters["expected_false_positives"], 3)
+        return {
+            **counters,
+            "rows_per_sec": round(window_rows / min(THROUGHPUT_WINDOW, max(time.time() - self.started, 1e-9)), 1),
+            "queue_rows": self.queue.rows,
+            "queue_capacity": self.queue.capacity,
+            "oldest_queued_seconds": round(self.queue.oldest_age(), 3),
+            "last_batch": self.last_batch,
+            "last_summary": self.last_summary,
+            "last_error": self.last_error,
+            "dead_letter": self.dead_letter,
+            "dedup": {
+                "window_rows": self.deduper.window_rows,
+                "rotations": self.deduper.rotations,
+                "false_positive_rate": self.deduper.false_positive_rate(),
+                "bytes": self.deduper.nbytes,
+            },
+            "uptime_seconds": round(time.time() - self.started, 1),
+        }
+
+
+# HTTP
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body, headers=None):
+            data = json.dumps(body, default=str).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/status":
+                self._reply(200, service.status())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/stops":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                frame = parse_records(json.loads(self.rfile.read(length) or b"null"))
+            except ValueError as exc:  # includes JSONDecodeError
+                self._reply(400, {"error": str(exc)})
+                return
+            if service.offer(frame):
+                self._reply(202, {"accepted": len(frame), "queue_rows": service.queue.rows})
+            else:
+                self._reply(503, {"error": "ingest queue is full", "queue_rows": service.queue.rows},
+                            {"Retry-After": str(max(1, round(service.batch_seconds)))})
+
+        def log_message(self, format, *args):  # keep the console for status lines
+            pass
+
+    return Handler
+
+
+def serve(host=HOST, port=PORT, drop_dir=None, service=None, progress=True):
+    """Run the service until interrupted (Ctrl+C drains the queue first)."""
+    service = service or IngestService()
+    threads = [threading.Thread(target=service.run_writer, name="ingest-writer")]
+    if drop_dir:
+        threads.append(threading.Thread(target=service.watch, args=(drop_dir,), name="ingest-drop", daemon=True))
+    for thread in threads:
+        thread.start()
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, name="ingest-http", daemon=True).start()
+    if progress:
+        print(f"Ingesting on http://{host}:{port}/stops" + (f" and from {drop_dir}/" if drop_dir else ""))
+    try:
+        while True:
+            time.sleep(10)
+            if progress:
+                s = service.status()
+                print(f"  {s['rows_inserted']:,} rows inserted  ({s['rows_per_sec']:,.0f} rows/s, "
+                      f"queue {s['queue_rows']:,}/{s['queue_capacity']:,})")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.stopping.set()
+        threads[0].join()
+    return service.status()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accept stop records over HTTP or a drop directory.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--drop-dir", help="directory watched for .csv/.xlsx/.json files")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--batch-seconds", type=float, default=BATCH_SECONDS)
+    parser.add_argument("--queue-rows", type=int, default=QUEUE_ROWS)
+    parser.add_argument("--dead-letter", default=DEAD_LETTER, help="JSON-lines file for rows that cannot be stored")
+    parser.add_argument("--dedup-rows", type=int, default=DEDUP_ROWS,
+                        help="rows per Bloom filter generation (two are kept)")
+    args = parser.parse_args(argv)
+    service = IngestService(args.batch_rows, args.batch_seconds, args.queue_rows, dead_letter=args.dead_letter,
+                            dedup_rows=args.dedup_rows)
+    print(f"Stopped: {serve(args.host, args.port, args.drop_dir, service)}")
+
+
+if __name__ == "__main__":
+    main()
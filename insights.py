@@ -0,0 +1,130 @@
+# CANNED INSIGHT QUERIES
+# Named queries behind the dashboard's KPI cards, charts and the "Insights
+# Dashboard" / "Advanced Insights" selectboxes, declared as query_builder
+# specs. Everything that only slices by cube dimensions is a roll-up of
+# traffic_stops_cube (see cube.py); the time-based ones read the time rollup
+# (see rollup.py); the per-vehicle queries still need the raw table because
+# vehicle_number is not a cube dimension.
+#
+# *_SPECS are what the dashboard compiles under its filter bar; *_QUERIES
+# are the same queries compiled without filters.
+from query_builder import compile_spec, spec
+
+# KPI cards and charts shown on every page load.
+PANEL_SPECS = {
+    "KPI cards": spec("cube", measures={
+        "total_stops": "stops", "total_arrests": "arrests", "total_searches": "searches", "drug_stops": "dui_stops",
+    }),
+    "Chart: stops by violation": spec(
+        "cube", {"Violation": "violation"}, {"Count": "stops"}, order_by=["Count DESC"]
+    ),
+    "Chart: gender distribution": spec("cube", {"Gender": "driver_gender"}, {"Count": "stops"}),
+    "Chart: stop outcomes": spec("cube", {"Outcome": "stop_outcome"}, {"Count": "stops"}),
+}
+
+INSIGHT_SPECS = {
+    # ---------------- VEHICLE-BASED ----------------
+    "Top 10 Vehicles in Drug-Related Stops": spec(
+        "stops", {"vehicle_number": "vehicle_number"}, {"total_dui_stops": "stops"},
+        where={"violation": "DUI"}, order_by=["total_dui_stops DESC"], limit=10,
+    ),
+    "Vehicles Most Frequently Searched": spec(
+        "stops", {"vehicle_number": "vehicle_number"}, {"search_count": "stops"},
+        where={"search_conducted": True}, order_by=["search_count DESC"], limit=10,
+    ),
+    # ---------------- DEMOGRAPHIC-BASED ----------------
+    "Arrest Rate by Driver Age Group": spec(
+        "cube", {"age_group": "age_group"},
+        {"total_stops": "stops", "total_arrests": "arrests", "arrest_rate": "arrest_rate"},
+        order_by=["arrest_rate DESC"],
+    ),
+    "Gender Distribution by Country": spec(
+        "cube", {"country_name": "country_name", "driver_gender": "driver_gender"}, {"total": "stops"},
+        order_by=["country_name", "total DESC"],
+    ),
+    "Race + Gender Combination with Highest Search Rate": spec(
+        "cube", {"driver_race": "driver_race", "driver_gender": "driver_gender"},
+        {"total_stops": "stops", "searches": "searches", "search_rate": "search_rate"},
+        order_by=["search_rate DESC"], limit=10,
+    ),
+    # ---------------- TIME-BASED ----------------
+    "Traffic Stops by Hour of Day": spec(
+        "rollup", {"hour_of_day": "hour_of_day"}, {"num_stops": "stops"}, order_by=["hour_of_day"]
+    ),
+    "Average Stop Duration by Violation": spec(
+        "cube", {"violation": "violation"}, {"avg_duration": "avg_duration"}, order_by=["avg_duration DESC"]
+    ),
+    "Are Night Stops More Likely to Lead to Arrests?": spec(
+        "rollup", {"time_period": "time_period"},
+        {"total_stops": "stops", "arrests": "arrests", "arrest_rate": "arrest_rate"},
+        order_by=["arrest_rate DESC"],
+    ),
+    # ---------------- VIOLATION-BASED ----------------
+    "Violations Associated with Highest Search Rate": spec(
+        "cube", {"violation": "violation"},
+        {"total_stops": "stops", "searches": "searches", "search_rate": "search_rate"},
+        order_by=["search_rate DESC"],
+    ),
+    "Most Common Violations Among Younger Drivers (<25)": spec(
+        "cube", {"violation": "violation"}, {"total": "stops"},
+        where={"age_band": ("Under 18", "18-24")}, order_by=["total DESC"],
+    ),
+    "Violations That Rarely Result in Search or Arrest": spec(
+        "cube", {"violation": "violation"},
+        {"total_stops": "stops", "searches": "searches", "arrests": "arrests"},
+        order_by=["searches ASC", "arrests ASC"],
+    ),
+    # ---------------- LOCATION-BASED ----------------
+    "Countries with Highest DUI (Drug-Related) Stops": spec(
+        "cube", {"country_name": "country_name"}, {"dui_stops": "stops"},
+        where={"violation": "DUI"}, order_by=["dui_stops DESC"],
+    ),
+    "Arrest Rate by Country and Violation": spec(
+        "cube", {"country_name": "country_name", "violation": "violation"},
+        {"total_stops": "stops", "arrests": "arrests", "arrest_rate": "arrest_rate"},
+        order_by=["arrest_rate DESC"],
+    ),
+    "Countries with Most Search-Conducted Stops": spec(
+        "cube", {"country_name": "country_name"}, {"searches": "stops"},
+        where={"search_conducted": True}, order_by=["searches DESC"],
+    ),
+}
+
+ADVANCED_SPECS = {
+    "Yearly Breakdown: Stops & Arrests by Country": spec(
+        "rollup", {"country_name": "country_name", "year": "year"},
+        {"total_stops": "stops", "total_arrests": "arrests", "arrest_rate": "arrest_rate"},
+        order_by=["country_name", "year"],
+    ),
+    "Driver Violation Trends by Age and Race": spec(
+        "cube", {"driver_race": "driver_race", "age_group": "age_group", "violation": "violation"},
+        {"total_stops": "stops"},
+        order_by=["driver_race", "age_group", "total_stops DESC"],
+    ),
+    "Time Period Analysis (Year, Month, Hour)": spec(
+        "rollup", {"year": "year", "month": "month", "hour": "hour_of_day"}, {"total_stops": "stops"},
+        order_by=["year", "month", "hour"],
+    ),
+    "Violations with High Search & Arrest Rates": spec(
+        "cube", {"violation": "violation"},
+        {"total_stops": "stops", "searches": "searches", "arrests": "arrests",
+         "search_rate": "search_rate", "arrest_rate": "arrest_rate"},
+        order_by=["arrest_rate DESC"],
+    ),
+    "Driver Demographics by Country": spec(
+        "cube",
+        {"country_name": "country_name", "driver_gender": "driver_gender", "driver_race": "driver_race",
+         "age_group": "age_group"},
+        {"total": "stops"},
+        order_by=["country_name", "total DESC"],
+    ),
+    "Top 5 Violations with Highest Arrest Rates": spec(
+        "cube", {"violation": "violation"},
+        {"total_stops": "stops", "arrests": "arrests", "arrest_rate": "arrest_rate"},
+        order_by=["arrest_rate DESC"], limit=5,
+    ),
+}
+
+PANEL_QUERIES = {name: compile_spec(s).sql for name, s in PANEL_SPECS.items()}
+INSIGHT_QUERIES = {name: compile_spec(s).sql for name, s in INSIGHT_SPECS.items()}
+ADVANCED_QUERIES = {name: compile_spec(s).sql for name, s in ADVANCED_SPECS.items()}
@@ -0,0 +1,185 @@
+# LOAD TEST
+# Simulated analysts loading dashboard pages at the same time, to see how
+# page latency holds up as concurrent sessions grow:
+#
+#   python query_service.py --backend duckdb --workers 8
+#   python load_test.py --backend remote --sessions 1,10,50,100,150
+#   python load_test.py --backend duckdb --sessions 1,10,50,100,150   # one dashboard process, for comparison
+#
+# A session loads pages back to back for --seconds. A page is the KPI and
+# chart queries plus one random insight, compiled under one of --states
+# filter bar states (drawn once per run, so sessions overlap the way
+# analysts do) and run through run_query(); --render also builds the chart
+# figures. Sessions are spread over --processes client processes, each with
+# one backend shared by its sessions like a Streamlit server, so the
+# default (one process, a direct backend) is the dashboard as it runs today.
+#
+# Prints pages/s and p50/p95/p99 page latency per level; --out writes JSON.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import backends
+from cube import CUBE_TABLE
+from db import CACHE_TTL
+from insights import ADVANCED_SPECS, INSIGHT_SPECS, PANEL_SPECS
+from query_builder import compile_spec
+from rollup import ROLLUP_TABLE, rollup_column
+
+SESSIONS = (1, 10, 50, 100)
+SECONDS = 20.0
+STATES = 50
+PERCENTILES = (50, 95, 99)
+
+
+# SESSIONS
+def filter_states(backend, count, seed=0):
+    """``count`` filter bar states; the first is the unfiltered page."""
+    rng = random.Random(seed)
+    values = {
+        column: backend.run_query(
+            f"SELECT DISTINCT {column} FROM {CUBE_TABLE} WHERE {column} IS NOT NULL ORDER BY {column}"
+        )[column].tolist()
+        for column in ("country_name", "violation")
+    }
+    bounds = backend.run_query(f"SELECT MIN({rollup_column('bucket')}) AS first_day, MAX(bucket) AS last_day "
+                               f"FROM {ROLLUP_TABLE} WHERE grain = 'day'")
+    first, last = (pd.Timestamp(bounds[c][0]).date() for c in ("first_day", "last_day"))
+    states = [{}]
+    while len(states) < count:
+        state = {
+            "country": rng.sample(values["country_name"], rng.randint(0, min(2, len(values["country_name"])))),
+            "violation": rng.sample(values["violation"], rng.randint(0, 1)),
+        }
+        if rng.random() < 0.5:
+            start = first + timedelta(days=rng.randrange(max((last - first).days, 1)))
+            state["date"] = (start, min(last, start + timedelta(days=rng.randint(30, 730))))
+        states.append(state)
+    return states
+
+
+def page_view(backend, state, rng, render=False):
+    """Run one page's queries; returns the number of queries."""
+    import plotly.express as px
+
+    insight = rng.choice(list(INSIGHT_SPECS.values()) + list(ADVANCED_SPECS.values()))
+    specs = list(PANEL_SPECS.items()) + [("Insight", insight)]
+    for name, spec in specs:
+        query = compile_spec(spec, state)
+        df = backend.run_query(query.sql, query.params, name=name)
+        if render and name.startswith("Chart:") and len(df.columns) >= 2:
+            px.bar(df, x=df.columns[0], y=df.columns[1]).to_json()
+    return len(specs)
+
+
+def _client(backend_name, sessions, seconds, states, seed, render, ttl, barrier, results):
+    """One client process: ``sessions`` threads sharing one backend."""
+    backend = backends.get_backend(backend_name, ttl=ttl)
+    page_view(backend, states[0], random.Random(seed))  # warm-up (DuckDB builds its summaries)
+    latencies, errors, lock = [], [], threading.Lock()
+
+    def session(index):
+        rng = random.Random(seed * 100_003 + index)
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                page_view(backend, rng.choice(states), rng, render)
+            except Exception as exc:
+                with lock:
+                    errors.append(f"{type(exc).__name__}: {exc}")
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(sessions)]
+    barrier.wait()  # every client warmed up: start together
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, errors[:5], len(errors)))
+
+
+# RUN
+def run_level(backend_name, sessions, processes, seconds, states, seed=0, render=False, ttl=CACHE_TTL):
+    """Page latency stats for ``sessions`` concurrent sessions."""
+    processes = max(1, min(processes, sessions))
+    ctx = multiprocessing.get_context("spawn")
+    barrier, results = ctx.Barrier(processes), ctx.Queue()
+    clients = [
+        ctx.Process(target=_client, args=(
+            backend_name, sessions // processes + (i < sessions % processes), seconds, states, seed + i, render,
+            ttl, barrier, results,
+        ))
+        for i in range(processes)
+    ]
+    for client in clients:
+        client.start()
+    latencies, samples, errors = [], [], 0
+    for _ in clients:
+        client_latencies, client_samples, client_errors = results.get(timeout=seconds + 600)
+        latencies += client_latencies
+        samples += client_samples
+        errors += client_errors
+    for client in clients:
+        client.join()
+    latencies = np.asarray(latencies)
+    return {
+        "sessions": sessions,
+        "processes": processes,
+        "pages": len(latencies),
+        "pages_per_sec": round(len(latencies) / seconds, 2),
+        **{f"p{p}_ms": round(float(np.percentile(latencies, p)), 1) if len(latencies) else None
+           for p in PERCENTILES},
+        "errors": errors,
+        "error_samples": samples,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure dashboard page latency under concurrent sessions.")
+    parser.add_argument("--backend", choices=["mysql", "duckdb", "remote"], default=backends.BACKEND)
+    parser.add_argument("--sessions", default=",".join(map(str, SESSIONS)), help="comma-separated levels")
+    parser.add_argument("--processes", type=int, default=1, help="client processes (dashboard servers)")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="duration of each level")
+    parser.add_argument("--states", type=int, default=STATES, help="distinct filter bar states")
+    parser.add_argument("--render", action="store_true", help="also build the chart figures")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                        help="client-side result cache TTL (0 sends every query to the backend)")
+    parser.add_argument("--invalidate", action="store_true",
+                        help="empty the service's shared cache before each level (remote)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    backend = backends.get_backend(args.backend)
+    states = filter_states(backend, args.states, args.seed)
+    print(f"{'sessions':>8} {'pages':>7} {'pages/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    levels = []
+    for sessions in (int(s) for s in args.sessions.split(",")):
+        if args.invalidate:
+            backend.invalidate()
+        level = run_level(args.backend, sessions, args.processes, args.seconds, states, args.seed, args.render,
+                          args.cache_ttl)
+        levels.append(level)
+        print(f"{sessions:>8} {level['pages']:>7} {level['pages_per_sec']:>8} {level['p50_ms']!s:>9} "
+              f"{level['p95_ms']!s:>9} {level['p99_ms']!s:>9} {level['errors']:>7}")
+        for sample in level["error_samples"]:
+            print(f"         {sample}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "cpus": os.cpu_count(), "levels": levels}, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# SCHEMA MIGRATIONS
+# Versioned changes to traffic_stops, applied in order and recorded in
+# schema_migrations:
+#
+#   1  compact_types       low-cardinality VARCHARs -> ENUM, driver_age -> SMALLINT
+#   2  generated_columns   (no longer adds anything, see 5)
+#   3  covering_indexes    composite indexes for the queries that still read traffic_stops
+#   4  drop_unused_indexes the hour / outcome and age / outcome indexes step 3
+#                          used to add: those breakdowns read the cube and
+#                          rollup now, so the indexes only slowed inserts
+#   5  drop_generated_columns  stop_hour / age_bucket, which step 2 used to
+#                          add: hour and age breakdowns read the cube and
+#                          rollup, which compute their own
+#
+#   python migrate.py                  # apply pending migrations
+#   python migrate.py --status
+#   python migrate.py --benchmark      # time every dashboard query before and after
+#
+# Every step checks the live schema first, so re-running after the notebook
+# drops and reloads traffic_stops (bulk_load.py does this) is safe.
+import argparse
+import json
+import statistics
+import time
+import unicodedata
+
+from cube import cube_select_sql
+from db import get_connection
+
+MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    name VARCHAR(50) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# Columns stored as ENUMs; the value list is taken from the data and widened
+# by the loaders (widen_enums) when a new value arrives.
+ENUM_COLUMNS = [
+    "country_name", "driver_gender", "driver_race", "violation",
+    "search_type", "stop_outcome", "stop_duration",
+]
+
+# Virtual columns step 2 used to add; no query reads them.
+UNUSED_COLUMNS = ["stop_hour", "age_bucket"]
+
+# Index-only plans for the per-vehicle insight queries (the top DUI and
+# searched plates) when the filter bar keeps them off vehicle_profiles.
+COVERING_INDEXES = {
+    "idx_violation_vehicle": "violation, vehicle_number",
+    "idx_search_vehicle": "search_conducted, vehicle_number",
+}
+UNUSED_INDEXES = ["idx_hour_outcome", "idx_age_bucket_outcome"]
+
+
+# SCHEMA INSPECTION
+def column_types(cursor, table="traffic_stops"):
+    """{column: COLUMN_TYPE} for the live table, e.g. "enum('F','M')"."""
+    cursor.execute(
+        "SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
+    )
+    return {name: str(kind) for name, kind in cursor.fetchall()}
+
+
+def column_collations(cursor, table="traffic_stops"):
+    """{column: COLLATION_NAME} for the live table's text and ENUM columns."""
+    cursor.execute(
+        "SELECT COLUMN_NAME, COLLATION_NAME FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLLATION_NAME IS NOT NULL",
+        (table,),
+    )
+    return {name: str(collation) for name, collation in cursor.fetchall()}
+
+
+def index_names(cursor, table="traffic_stops"):
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def enum_values(column_type):
+    """The value list of an "enum('a','b')" COLUMN_TYPE ([] for non-ENUMs)."""
+    if not column_type.startswith("enum("):
+        return []
+    body = column_type[len("enum("):-1]
+    return [v.replace("''", "'") for v in body[1:-1].split("','")] if body else []
+
+
+def _enum_sql(values):
+    return "ENUM(%s)" % ", ".join("'%s'" % v.replace("\\", "\\\\").replace("'", "''") for v in values)
+
+
+# MIGRATIONS
+def compact_types(cursor):
+    types = column_types(cursor)
+    changes = []
+    for column in ENUM_COLUMNS:
+        if column not in types or types[column].startswith("enum("):
+            continue
+        cursor.execute("SELECT DISTINCT %s FROM traffic_stops WHERE %s IS NOT NULL" % (column, column))
+        values = sorted(row[0] for row in cursor.fetchall())
+        if values:  # an empty table keeps VARCHAR until there is data to take values from
+            changes.append("MODIFY %s %s NULL" % (column, _enum_sql(values)))
+    if types.get("driver_age", "").startswith("int"):
+        changes.append("MODIFY driver_age SMALLINT")
+    if changes:
+        # One ALTER, so InnoDB copies the table once.
+        cursor.execute("ALTER TABLE traffic_stops " + ", ".join(changes))
+
+
+def generated_columns(cursor):
+    # Kept so version 2 still has a step; what it added is dropped by step 5.
+    pass
+
+
+def covering_indexes(cursor):
+    existing = index_names(cursor)
+    changes = ["ADD INDEX %s (%s)" % (n, cols) for n, cols in COVERING_INDEXES.items() if n not in existing]
+    if changes:
+        cursor.execute("ALTER TABLE traffic_stops " + ", ".join(changes))
+
+
+def drop_unused_indexes(cursor):
+    existing = index_names(cursor)
+    changes = ["DROP INDEX %s" % name for name in UNUSED_INDEXES if name in existing]
+    if changes:
+        cursor.execute("ALTER TABLE traffic_stops " + ", ".join(changes))
+
+
+def drop_generated_columns(cursor):
+    types = column_types(cursor)
+    changes = ["DROP COLUMN %s" % column for column in UNUSED_COLUMNS if column in types]
+    if changes:
+        cursor.execute("ALTER TABLE traffic_stops " + ", ".join(changes))
+
+
+MIGRATIONS = [
+    (1, "compact_types", compact_types),
+    (2, "generated_columns", generated_columns),
+    (3, "covering_indexes", covering_indexes),
+    (4, "drop_unused_indexes", drop_unused_indexes),
+    (5, "drop_generated_columns", drop_generated_columns),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(MIGRATIONS_DDL)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn, recheck=False, progress=True):
+    """Apply pending migrations; with ``recheck`` re-run every step (each is
+    idempotent) to bring a re-created traffic_stops back up to date.
+
+    Returns the versions that were run.
+    """
+    cursor = conn.cursor()
+    done = set() if recheck else applied_versions(cursor)
+    ran = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        start = time.perf_counter()
+        step(cursor)  # ALTER TABLE commits implicitly
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE applied_at = CURRENT_TIMESTAMP",
+            (version, name),
+        )
+        conn.commit()
+        ran.append(version)
+        if progress:
+            print(f"  {version} {name} ({time.perf_counter() - start:.1f}s)")
+    cursor.close()
+    return ran
+
+
+def _enum_key(value, collation="utf8mb4_0900_ai_ci"):
+    # How ``collation`` tells ENUM members apart. Trailing spaces never count
+    # (MySQL strips them from members); case counts under _cs and binary
+    # collations, accents under those and _as_ ones. The legacy _general_ci
+    # and _unicode_ci collations ignore both, like _ai_ci.
+    text = value.rstrip(" ")
+    if collation == "binary" or collation.endswith(("_bin", "_cs")):
+        return text
+    if "_as_" not in collation:
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return text.casefold()
+
+
+def widen_enums(cursor, chunk, types=None, collations=None):
+    """Append values in ``chunk`` that an ENUM column does not list yet.
+
+    Values are stripped first, and a value the column's collation treats as
+    an existing member (under the default one, 'india' and 'India ') is
+    rewritten in ``chunk`` to that member rather than added: MySQL rejects
+    an ENUM with both ("duplicated value"). Appending to the end of an ENUM
+    is an in-place metadata change. ``types`` and ``collations`` are
+    column_types() and column_collations() dicts the caller keeps between
+    chunks; ``types`` is updated.
+    """
+    types = column_types(cursor) if types is None else types
+    collations = column_collations(cursor) if collations is None else collations
+    changes = []
+    for column in ENUM_COLUMNS:
+        known = enum_values(types.get(column, ""))
+        if not known or column not in chunk:
+            continue
+        collation = collations.get(column, "utf8mb4_0900_ai_ci")
+        members = {_enum_key(v, collation): v for v in known}
+        new, mapping = [], {}
+        for value in sorted(set(chunk[column].dropna().astype(str)), key=lambda v: (v.strip(), v)):
+            key = _enum_key(value.strip(), collation)
+            if key not in members:
+                members[key] = value.strip()
+                new.append(value.strip())
+            if members[key] != value:
+                mapping[value] = members[key]
+        if mapping:
+            chunk[column] = chunk[column].astype(object).replace(mapping)
+        if new:
+            types[column] = "enum(%s)" % ",".join("'%s'" % v.replace("'", "''") for v in known + new)
+            # COLLATE keeps the column's own collation; MODIFY would reset it
+            # to the table default.
+            changes.append("MODIFY %s %s COLLATE %s NULL" % (column, _enum_sql(known + new), collation))
+    if changes:
+        cursor.execute("ALTER TABLE traffic_stops " + ", ".join(changes))
+
+
+# BENCHMARK
+def benchmark_queries(cursor):
+    """{name: (sql, params)} for every query the dashboard and loaders run on MySQL."""
+    from insights import ADVANCED_QUERIES, INSIGHT_QUERIES, PANEL_QUERIES
+    from plate_search import build_search, rarest_trigrams, trigram_counts_sql, trigrams
+
+    queries = {name: (sql, None) for name, sql in {**PANEL_QUERIES, **INSIGHT_QUERIES, **ADVANCED_QUERIES}.items()}
+    queries["Summary cube rebuild"] = (cube_select_sql(), None)
+    cursor.execute("SELECT vehicle_number FROM traffic_stops WHERE vehicle_number IS NOT NULL LIMIT 1")
+    row = cursor.fetchone()
+    if row:
+        plate = row[0].upper()
+        for mode, text in [("Exact", plate), ("Starts with", plate[:4])]:
+            queries[f"Vehicle search ({mode})"] = build_search(text, mode, 0, 25)
+        # Driven by the rarest trigram, as search_plates() does.
+        cursor.execute(*trigram_counts_sql(trigrams(plate[2:6])))
+        grams = rarest_trigrams(plate[2:6], dict(cursor.fetchall()))
+        queries["Vehicle search (Contains)"] = build_search(plate[2:6], "Contains", 0, 25, grams=grams)
+    return queries
+
+
+def benchmark(conn, repeat=5):
+    """Median milliseconds per query over ``repeat`` runs (after one warm-up)."""
+    cursor = conn.cursor()
+    results = {}
+    for name, (sql, params) in benchmark_queries(cursor).items():
+        times = []
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            cursor.execute(sql, params)
+            cursor.fetchall()
+            times.append((time.perf_counter() - start) * 1000)
+        results[name] = round(statistics.median(times[1:]), 2)
+    cursor.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations to traffic_stops.")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--recheck", action="store_true", help="re-run every (idempotent) step")
+    parser.add_argument("--benchmark", action="store_true", help="time the dashboard queries before and after")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default="migration_benchmark.json")
+    args = parser.parse_args(argv)
+
+    conn = get_connection()
+    try:
+        if args.status:
+            cursor = conn.cursor()
+            done = applied_versions(cursor)
+            cursor.close()
+            for version, name, _step in MIGRATIONS:
+                print(f"  {version} {name}: {'applied' if version in done else 'pending'}")
+            return
+        before = benchmark(conn, args.repeat) if args.benchmark else None
+        print("Applying migrations...")
+        ran = migrate(conn, recheck=args.recheck)
+        print(f"Applied {ran or 'nothing (up to date)'}")
+        if args.benchmark:
+            after = benchmark(conn, args.repeat)
+            report = {
+                name: {"before_ms": before[name], "after_ms": after.get(name),
+                       "speedup": round(before[name] / after[name], 2) if after.get(name) else None}
+                for name in before
+            }
+            for name, r in sorted(report.items(), key=lambda kv: -(kv[1]["speedup"] or 0)):
+                print(f"  {name:<50} {r['before_ms']:>9.1f} ms -> {r['after_ms']:>9.1f} ms  ({r['speedup']}x)")
+            with open(args.out, "w") as f:
+                json.dump({"repeat": args.repeat, "migrations": ran, "queries": report}, f, indent=2)
+            print(f"Wrote {args.out}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
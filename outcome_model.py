@@ -0,0 +1,272 @@
+# STOP OUTCOME & VIOLATION MODEL
+# Two multinomial logistic regressions (stop_outcome, violation) over the
+# stop features the predict form collects. Artifacts are versioned under
+# CHECKPOST_MODEL_DIR and loaded once per process.
+#
+#   python outcome_model.py train                      # from traffic_stops
+#   python outcome_model.py train --csv cleaned_traffic_stops.csv
+#   python outcome_model.py score stops.csv --out scored.csv
+import argparse
+import functools
+import glob
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+MODEL_DIR = os.environ.get("CHECKPOST_MODEL_DIR", "models")
+MODEL_NAME = "stop_model"
+
+CATEGORICAL = ["driver_gender", "country_name", "stop_hour", "stop_duration"]
+NUMERIC = ["driver_age", "search_conducted"]
+FEATURES = CATEGORICAL + NUMERIC
+TARGETS = ["stop_outcome", "violation"]
+
+TRAINING_QUERY = """
+SELECT driver_age, driver_gender, country_name, HOUR(stop_time) AS stop_hour,
+       search_conducted, stop_duration, stop_outcome, violation
+FROM traffic_stops
+"""
+
+
+# FEATURES
+def prepare_features(df):
+    """Coerce raw stop columns into the model's feature frame (vectorized)."""
+    out = pd.DataFrame(index=df.index)
+    if "stop_hour" in df:
+        hour = pd.to_numeric(df["stop_hour"], errors="coerce")
+    else:
+        hour = pd.to_datetime(df["stop_time"].astype(str), format="%H:%M:%S", errors="coerce").dt.hour
+    out["stop_hour"] = hour.fillna(-1).astype(int).astype(str)
+    gender = df["driver_gender"].astype(str).str.strip().str[:1].str.upper()
+    out["driver_gender"] = gender.where(gender.isin(["M", "F"]), "Unknown")
+    out["country_name"] = df["country_name"].fillna("Unknown").astype(str)
+    out["stop_duration"] = df["stop_duration"].fillna("Unknown").astype(str)
+    out["driver_age"] = pd.to_numeric(df["driver_age"], errors="coerce")
+    out["search_conducted"] = df["search_conducted"].map(
+        {True: 1, False: 0, "True": 1, "False": 0, 1: 1, 0: 0}
+    ).fillna(0).astype(float)
+    return out[FEATURES]
+
+
+def _pipeline():
+    return Pipeline([
+        ("features", ColumnTransformer([
+            ("categorical", OneHotEncoder(handle_unknown="ignore"), CATEGORICAL),
+            ("numeric", Pipeline([("impute", SimpleImputer(strategy="median")), ("scale", StandardScaler())]), NUMERIC),
+        ])),
+        ("classifier", LogisticRegression(max_iter=500)),
+    ])
+
+
+# TRAINING
+def load_training_frame(csv=None, limit=None):
+    if csv:
+        return pd.read_csv(csv, nrows=limit)
+    from backends import get_backend
+
+    query = TRAINING_QUERY + (" LIMIT %d" % limit if limit else "")
+    return get_backend().execute(query)
+
+
+def train(df, model_dir=MODEL_DIR):
+    """Fit both classifiers, save a new artifact version and return its metadata."""
+    df = df.dropna(subset=TARGETS)
+    X = prepare_features(df)
+    models, metrics = {}, {}
+    for target in TARGETS:
+        y = df[target].astype(str)
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        model = _pipeline().fit(X_train, y_train)
+        metrics[target] = {"holdout_accuracy": round(float(model.score(X_test, y_test)), 4)}
+        models[target] = model.fit(X, y)
+
+    os.makedirs(model_dir, exist_ok=True)
+    version = latest_version(model_dir) + 1
+    path = os.path.join(model_dir, f"{MODEL_NAME}-v{version}.joblib")
+    meta = {
+        "version": version,
+        "trained_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rows": len(df),
+        "features": FEATURES,
+        "classes": {t: list(models[t].classes_) for t in TARGETS},
+        "metrics": metrics,
+    }
+    joblib.dump({"models": models, "meta": meta}, path)
+    with open(path.replace(".joblib", ".json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+# COMPILED SCORER
+class LinearScorer:
+    """A fitted pipeline flattened into lookup tables and one weight matrix.
+
+    One-hot columns become dictionary lookups into the coefficient matrix and
+    the imputer/scaler are folded into the numeric weights, so scoring skips
+    sklearn's per-call validation. Probabilities match predict_proba.
+    """
+
+    def __init__(self, pipeline):
+        features = pipeline.named_steps["features"]
+        classifier = pipeline.named_steps["classifier"]
+        encoder = features.named_transformers_["categorical"]
+        numeric = features.named_transformers_["numeric"]
+
+        coef, intercept = classifier.coef_, classifier.intercept_
+        if coef.shape[0] == 1:
+            # Binary LR is a sigmoid: the same as a softmax over logits [0, z].
+            coef = np.vstack([np.zeros_like(coef), coef])
+            intercept = np.concatenate([[0.0], intercept])
+        self.classes = classifier.classes_
+
+        self.lookups, offset = [], 0
+        for categories in encoder.categories_:
+            self.lookups.append({value: offset + i for i, value in enumerate(categories)})
+            offset += len(categories)
+        self.indexes = [pd.Index(list(lookup)) for lookup in self.lookups]
+        self.offsets = [min(lookup.values()) for lookup in self.lookups]
+        self.coef = np.ascontiguousarray(coef[:, :offset])
+
+        mean, scale = numeric.named_steps["scale"].mean_, numeric.named_steps["scale"].scale_
+        self.fill = numeric.named_steps["impute"].statistics_
+        self.numeric_coef = coef[:, offset:] / scale
+        self.intercept = intercept - self.numeric_coef @ mean
+
+    def score_frame(self, X):
+        """Class probabilities for a prepared feature frame."""
+        logits = np.tile(self.intercept, (len(X), 1))
+        for feature, index, offset in zip(CATEGORICAL, self.indexes, self.offsets):
+            cols = index.get_indexer(X[feature])
+            known = cols >= 0
+            logits[known] += self.coef[:, cols[known] + offset].T
+        numbers = X[NUMERIC].to_numpy(dtype=float)
+        numbers = np.where(np.isnan(numbers), self.fill, numbers)
+        logits += numbers @ self.numeric_coef.T
+        return _softmax(logits)
+
+    def score_row(self, row):
+        """Class probabilities for one prepared feature dict."""
+        logits = self.intercept.copy()
+        for feature, lookup in zip(CATEGORICAL, self.lookups):
+            col = lookup.get(row[feature])
+            if col is not None:
+                logits += self.coef[:, col]
+        numbers = np.array([row[f] for f in NUMERIC], dtype=float)
+        numbers = np.where(np.isnan(numbers), self.fill, numbers)
+        logits += self.numeric_coef @ numbers
+        return _softmax(logits)
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _prepare_one(stop):
+    """prepare_features() for a single dict, without building a DataFrame."""
+    hour = stop.get("stop_hour")
+    if hour is None and stop.get("stop_time") is not None:
+        hour = pd.to_datetime(str(stop["stop_time"]), format="%H:%M:%S", errors="coerce").hour
+    gender = str(stop.get("driver_gender")).strip()[:1].upper()
+    age = pd.to_numeric(stop.get("driver_age"), errors="coerce")
+    return {
+        "stop_hour": str(int(hour)) if hour is not None and hour == hour else "-1",
+        "driver_gender": gender if gender in ("M", "F") else "Unknown",
+        "country_name": str(stop.get("country_name") or "Unknown"),
+        "stop_duration": str(stop.get("stop_duration") or "Unknown"),
+        "driver_age": float("nan") if age is None else float(age),
+        "search_conducted": float({True: 1, False: 0, "True": 1, "False": 0, 1: 1, 0: 0}.get(stop.get("search_conducted"), 0)),
+    }
+
+
+# LOADING
+def latest_version(model_dir=MODEL_DIR):
+    versions = [
+        int(m.group(1))
+        for p in glob.glob(os.path.join(model_dir, f"{MODEL_NAME}-v*.joblib"))
+        if (m := re.search(r"-v(\d+)\.joblib$", p))
+    ]
+    return max(versions, default=0)
+
+
+@functools.lru_cache(maxsize=4)
+def load_model(version=None, model_dir=MODEL_DIR):
+    """Load an artifact (latest by default); cached for the life of the process."""
+    version = version or latest_version(model_dir)
+    if not version:
+        raise FileNotFoundError(f"no {MODEL_NAME} artifacts in {model_dir!r}; run `python outcome_model.py train`")
+    artifact = joblib.load(os.path.join(model_dir, f"{MODEL_NAME}-v{version}.joblib"))
+    artifact["scorers"] = {target: LinearScorer(model) for target, model in artifact["models"].items()}
+    return artifact
+
+
+# INFERENCE
+def predict_frame(df, artifact=None):
+    """Score many stops in one vectorized call.
+
+    Returns a frame with predicted_<target> and <target>_confidence columns,
+    aligned with ``df``'s index.
+    """
+    artifact = artifact or load_model()
+    X = prepare_features(df)
+    out = pd.DataFrame(index=df.index)
+    for target, scorer in artifact["scorers"].items():
+        proba = scorer.score_frame(X)
+        best = proba.argmax(axis=1)
+        out[f"predicted_{target}"] = scorer.classes[best]
+        out[f"{target}_confidence"] = proba[np.arange(len(best)), best]
+    return out
+
+
+def predict_one(artifact=None, **stop):
+    """Score a single stop given as keyword features; returns a plain dict."""
+    artifact = artifact or load_model()
+    row = _prepare_one(stop)
+    result = {}
+    for target, scorer in artifact["scorers"].items():
+        proba = scorer.score_row(row)
+        best = int(proba.argmax())
+        result[f"predicted_{target}"] = scorer.classes[best]
+        result[f"{target}_confidence"] = float(proba[best])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or apply the stop outcome/violation model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_cmd = sub.add_parser("train")
+    train_cmd.add_argument("--csv", help="train from a cleaned CSV instead of traffic_stops")
+    train_cmd.add_argument("--limit", type=int)
+    score_cmd = sub.add_parser("score")
+    score_cmd.add_argument("csv")
+    score_cmd.add_argument("--out", default="scored_stops.csv")
+    score_cmd.add_argument("--version", type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        meta = train(load_training_frame(args.csv, args.limit))
+        print(json.dumps(meta, indent=2))
+    else:
+        df = pd.read_csv(args.csv)
+        start = time.perf_counter()
+        scored = pd.concat([df, predict_frame(df, load_model(args.version))], axis=1)
+        elapsed = time.perf_counter() - start
+        scored.to_csv(args.out, index=False)
+        print(f"Scored {len(df):,} stops in {elapsed:.2f}s ({len(df) / elapsed:,.0f} rows/s) -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
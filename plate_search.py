@@ -0,0 +1,253 @@
+# VEHICLE PLATE SEARCH
+# Parameterized, paginated plate lookups for the "Vehicle Search" panel.
+#
+#   Exact        vehicle_number = %s          (idx_vehicle_number)
+#   Starts with  vehicle_number LIKE 'AB12%'  (idx_vehicle_number range scan)
+#   Contains     trigram index: vehicle_trigrams holds every 3-character
+#                substring of every plate, so a substring lookup intersects
+#                a few short posting lists instead of scanning traffic_stops.
+#                vehicle_trigram_counts holds each posting list's length, and
+#                the lookup is driven by the rarest of the plate's trigrams
+#                (a state-code prefix like "KL6" matches a few percent of
+#                all stops; a trigram from the serial part far fewer)
+#
+# Pages are keyed on traffic_stops.id (WHERE id > last seen id), so deep
+# pages cost the same as the first. vehicle_trigrams is kept in step with
+# new rows by incremental.py.
+from result_stream import iter_keyset
+
+MODES = ("Contains", "Starts with", "Exact")
+PAGE_SIZE = 25
+EXPORT_PAGE_SIZE = 5000  # rows per round trip when downloading every match
+# Trigrams intersected per lookup; the LIKE re-check keeps results exact, so
+# a handful of well-spread trigrams is as selective as all of them.
+MAX_TRIGRAMS = 4
+MAX_PLATE_LENGTH = 20
+
+RESULT_COLUMNS = [
+    "id", "stop_date", "stop_time", "country_name", "driver_gender", "driver_age",
+    "driver_race", "violation", "search_conducted", "stop_outcome", "stop_duration", "vehicle_number",
+]
+
+TRIGRAM_DDL = """
+CREATE TABLE IF NOT EXISTS vehicle_trigrams (
+    trigram CHAR(3) NOT NULL,
+    stop_id INT NOT NULL,
+    PRIMARY KEY (trigram, stop_id)
+)
+"""
+
+TRIGRAM_COUNT_DDL = """
+CREATE TABLE IF NOT EXISTS vehicle_trigram_counts (
+    trigram CHAR(3) NOT NULL PRIMARY KEY,
+    stops INT NOT NULL
+)
+"""
+
+# Every 3-character window of the upper-cased plate, one row per stop.
+_POSITIONS = " UNION ALL ".join("SELECT %d AS pos" % n for n in range(1, MAX_PLATE_LENGTH - 1))
+_WINDOWS = f"""
+FROM traffic_stops t
+JOIN ({_POSITIONS}) p ON p.pos <= CHAR_LENGTH(t.vehicle_number) - 2
+WHERE t.id > %s AND t.id <= %s
+"""
+TRIGRAM_INSERT = f"""
+INSERT IGNORE INTO vehicle_trigrams (trigram, stop_id)
+SELECT UPPER(SUBSTRING(t.vehicle_number, p.pos, 3)), t.id{_WINDOWS}"""
+# Counted from the new stops rather than vehicle_trigrams, which has no
+# index on stop_id; DISTINCT matches INSERT IGNORE for repeated trigrams.
+TRIGRAM_COUNT_DELTA = f"""
+INSERT INTO vehicle_trigram_counts (trigram, stops)
+SELECT UPPER(SUBSTRING(t.vehicle_number, p.pos, 3)) AS gram, COUNT(DISTINCT t.id){_WINDOWS}GROUP BY gram
+ON DUPLICATE KEY UPDATE stops = stops + VALUES(stops)
+"""
+
+
+# INDEX MAINTENANCE
+def ensure_vehicle_index(cursor):
+    """B-tree index on vehicle_number for the exact and prefix paths."""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'traffic_stops' AND INDEX_NAME = 'idx_vehicle_number'"
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE traffic_stops ADD INDEX idx_vehicle_number (vehicle_number)")
+
+
+def rebuild_trigrams(conn, last_id):
+    """Re-index every plate with id <= last_id. Returns the trigram row count."""
+    cursor = conn.cursor()
+    ensure_vehicle_index(cursor)
+    cursor.execute("TRUNCATE TABLE vehicle_trigrams")
+    cursor.execute(TRIGRAM_INSERT, (0, last_id))
+    rows = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+def apply_trigram_delta(cursor, low_id, high_id):
+    cursor.execute(TRIGRAM_INSERT, (low_id, high_id))
+
+
+def rebuild_trigram_counts(conn, last_id):
+    """Recount every posting list (vehicle_trigrams must be rebuilt first)."""
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE TABLE vehicle_trigram_counts")
+    cursor.execute(
+        "INSERT INTO vehicle_trigram_counts (trigram, stops) "
+        "SELECT trigram, COUNT(*) FROM vehicle_trigrams GROUP BY trigram"
+    )
+    rows = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return rows
+
+
+def apply_trigram_count_delta(cursor, low_id, high_id):
+    cursor.execute(TRIGRAM_COUNT_DELTA, (low_id, high_id))
+
+
+# QUERY BUILDING
+def normalize_plate(text):
+    return text.strip().upper()
+
+
+def _like_escape(text, escape="\\"):
+    return text.replace(escape, escape * 2).replace("%", escape + "%").replace("_", escape + "_")
+
+
+def trigrams(plate):
+    return list(dict.fromkeys(plate[i:i + 3] for i in range(len(plate) - 2)))
+
+
+def _spread_trigrams(plate):
+    grams = trigrams(plate)
+    if len(grams) <= MAX_TRIGRAMS:
+        return grams
+    step = (len(grams) - 1) / (MAX_TRIGRAMS - 1)
+    return [grams[round(i * step)] for i in range(MAX_TRIGRAMS)]
+
+
+def trigram_counts_sql(grams):
+    """(sql, params) reading the posting list length of each of ``grams``."""
+    return (
+        "SELECT trigram, stops FROM vehicle_trigram_counts WHERE trigram IN (%s)" % ", ".join(["%s"] * len(grams)),
+        tuple(grams),
+    )
+
+
+def rarest_trigrams(plate, counts):
+    """The plate's MAX_TRIGRAMS rarest trigrams, rarest first.
+
+    ``counts`` maps trigram -> posting list length; a trigram missing from
+    it has no stops, so leading with it ends the lookup at once.
+    """
+    return sorted(trigrams(plate), key=lambda gram: counts.get(gram, 0))[:MAX_TRIGRAMS]
+
+
+def build_search(plate, mode, after, page_size, use_trigrams=True, grams=None):
+    """Return (sql, params) for one page of matches in id order.
+
+    ``grams`` are the trigrams to intersect for "Contains", rarest first
+    (see rarest_trigrams); without them a spread of the plate's trigrams is
+    used in plate order.
+    """
+    columns = ", ".join("t." + c for c in RESULT_COLUMNS)
+    limit = page_size + 1  # one extra row tells us whether a next page exists
+    if mode == "Exact":
+        return (
+            f"SELECT {columns} FROM traffic_stops t "
+            "WHERE t.vehicle_number = %s AND t.id > %s ORDER BY t.id LIMIT %s",
+            (plate, after, limit),
+        )
+    if mode == "Starts with":
+        return (
+            f"SELECT {columns} FROM traffic_stops t "
+            "WHERE t.vehicle_number LIKE %s AND t.id > %s ORDER BY t.id LIMIT %s",
+            (_like_escape(plate) + "%", after, limit),
+        )
+
+    pattern = "%" + _like_escape(plate) + "%"
+    if not use_trigrams:
+        grams = []
+    elif grams is None:
+        grams = _spread_trigrams(plate)
+    if not grams:
+        # Under three characters there is nothing to intersect; the LIMIT
+        # still stops the scan at the first page of matches.
+        return (
+            f"SELECT {columns} FROM traffic_stops t "
+            "WHERE t.vehicle_number LIKE %s AND t.id > %s ORDER BY t.id LIMIT %s",
+            (pattern, after, limit),
+        )
+    joins = " ".join(
+        f"JOIN vehicle_trigrams g{i} ON g{i}.trigram = %s AND g{i}.stop_id = g0.stop_id"
+        for i in range(1, len(grams))
+    )
+    return (
+        # STRAIGHT_JOIN keeps g0, the rarest trigram, as the driving table:
+        # an ordered range scan of the shortest posting list that stops as
+        # soon as the page is full, probing the others by primary key.
+        f"SELECT STRAIGHT_JOIN {columns} FROM vehicle_trigrams g0 {joins} "
+        "JOIN traffic_stops t ON t.id = g0.stop_id "
+        "WHERE g0.trigram = %s AND g0.stop_id > %s AND t.vehicle_number LIKE %s "
+        "ORDER BY g0.stop_id LIMIT %s",
+        (*grams[1:], grams[0], after, pattern, limit),
+    )
+
+
+def _run(backend, sql, params, mode, cached):
+    if cached:
+        return backend.run_query(sql, params, name=f"Vehicle search ({mode})")
+    return backend.execute(sql, params)
+
+
+def search_plates(backend, text, mode="Contains", after=0, page_size=PAGE_SIZE, cached=True):
+    """One page of stops whose plate matches ``text``.
+
+    Returns (DataFrame, next_after); next_after is None on the last page and
+    is passed back as ``after`` to fetch the following page. On backends
+    without stop ids (DuckDB over Parquet) ``after`` is a row offset.
+    ``cached=False`` bypasses the result cache (for one-off exports).
+    """
+    plate = normalize_plate(text)
+    if backend.dialect != "mysql":
+        return _search_offset(backend, plate, mode, after, page_size, cached)
+    grams = None
+    if mode == "Contains" and len(plate) >= 3:
+        counts = backend.run_query(*trigram_counts_sql(trigrams(plate)), name="Vehicle search (trigram counts)")
+        grams = rarest_trigrams(plate, dict(zip(counts["trigram"], counts["stops"])))
+    sql, params = build_search(plate, mode, after, page_size, grams=grams)
+    df = _run(backend, sql, params, mode, cached)
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        return df, int(df["id"].iloc[-1])
+    return df, None
+
+
+def iter_matches(backend, text, mode="Contains", page_size=EXPORT_PAGE_SIZE):
+    """Every match for ``text`` as DataFrame pages of ``page_size`` rows."""
+    return iter_keyset(lambda after: search_plates(backend, text, mode, after, page_size, cached=False))
+
+
+def _search_offset(backend, plate, mode, offset, page_size, cached=True):
+    columns = ", ".join(c for c in RESULT_COLUMNS if c != "id")
+    # DuckDB compares case-sensitively, unlike MySQL's default collation.
+    if mode == "Exact":
+        where, value = "UPPER(vehicle_number) = %s", plate
+    elif mode == "Starts with":
+        where, value = "UPPER(vehicle_number) LIKE %s ESCAPE '!'", _like_escape(plate, "!") + "%"
+    else:
+        where, value = "UPPER(vehicle_number) LIKE %s ESCAPE '!'", "%" + _like_escape(plate, "!") + "%"
+    df = _run(
+        backend,
+        f"SELECT {columns} FROM traffic_stops WHERE {where} "
+        "ORDER BY stop_date, stop_time, vehicle_number LIMIT %s OFFSET %s",
+        (value, page_size + 1, offset),
+        mode,
+        cached,
+    )
+    if len(df) > page_size:
+        return df.iloc[:page_size], offset + page_size
+    return df, None
@@ -0,0 +1,285 @@
+# QUERY BUILDER
+# Named insights are declared as specs (source, dimensions, measures, fixed
+# conditions, ordering) and compiled to SQL here, so the age-group and
+# rate expressions are written once. The dashboard's filter bar (country,
+# violation, date range) is compiled into every query as parameters.
+#
+#   spec("cube", {"violation": "violation"}, {"total": "stops"}, order_by=["total DESC"])
+#
+# Sources:
+#   cube    traffic_stops_cube (see cube.py); dates filter by whole month
+#   rollup  traffic_stops_rollup through rollup.range_source()
+#   stops   the raw traffic_stops table
+#   sample  traffic_stops_sample (see approximate.py); weighted estimates of
+#           the cube measures, each with a <name>_error column holding its
+#           95% error bound. compile_spec(..., approximate=True) moves cube
+#           specs here.
+#   profiles  vehicle_profiles (see vehicle_profiles.py), one row per plate;
+#           compile_spec moves unfiltered top-N plate specs here
+#
+# The SQL text for each (spec, filter shape) is compiled once and cached, so
+# repeated runs send the same statement with new parameters (see the
+# prepared statement cache in db.QueryLayer).
+import functools
+from collections import namedtuple
+
+from approximate import SAMPLE_TABLE
+from cube import AGE_GROUP_SQL, CUBE_TABLE
+from rollup import range_source, rollup_column
+from vehicle_profiles import PROFILE_TABLE, profile_count
+
+Spec = namedtuple("Spec", "source dimensions measures where order_by limit")
+Compiled = namedtuple("Compiled", "sql params notes")
+
+TIME_PERIOD_SQL = """CASE
+        WHEN stop_hour BETWEEN 18 AND 23 THEN 'Night'
+        WHEN stop_hour BETWEEN 0 AND 5 THEN 'Late Night'
+        ELSE 'Daytime' END"""
+
+
+def _rate(part):
+    return "ROUND(SUM(%s) / SUM(stops) * 100, 2)" % part
+
+
+# Sample estimates are Horvitz-Thompson sums of weight (1 / sampling rate)
+# over 0/1 indicators. The error bounds are 1.96 standard errors: Bernoulli
+# sampling variance for counts, linearized ratio variance for rates.
+_INDICATORS = {
+    "stops": "1",
+    "arrests": "arrested",
+    "searches": "searched",
+    "dui_stops": "CASE WHEN violation = 'DUI' THEN 1 ELSE 0 END",
+}
+
+
+def _sample_rate(y):
+    return "ROUND(SUM(weight * %s) / SUM(weight) * 100, 2)" % y
+
+
+def _count_error(y):
+    return "ROUND(1.96 * SQRT(SUM(weight * (weight - 1) * %s)))" % y
+
+
+def _rate_error(y):
+    # Var(R) ~ sum(w (w - 1) (y - R)^2) / N^2, expanded using y^2 = y
+    r = "SUM(weight * %s) / SUM(weight)" % y
+    variance = "SUM(weight * (weight - 1) * {y}) * (1 - 2 * {r}) + {r} * {r} * SUM(weight * (weight - 1))".format(y=y, r=r)
+    return "ROUND(196 * SQRT(GREATEST(%s, 0)) / SUM(weight), 2)" % variance
+
+
+# source -> {dimension name: expression}
+DIMENSIONS = {
+    "cube": {
+        "country_name": "country_name",
+        "violation": "violation",
+        "driver_gender": "driver_gender",
+        "driver_race": "driver_race",
+        "age_band": "age_band",
+        "age_group": AGE_GROUP_SQL,
+        "year": "stop_year",
+        "month": "stop_month",
+        "hour_of_day": "stop_hour",
+        "time_period": TIME_PERIOD_SQL,
+        "stop_outcome": "stop_outcome",
+        "search_conducted": "search_conducted",
+    },
+    "rollup": {
+        "country_name": rollup_column("country_name"),
+        "year": "YEAR(%s)" % rollup_column("bucket"),
+        "month": "MONTH(%s)" % rollup_column("bucket"),
+        "hour_of_day": rollup_column("stop_hour"),
+        "time_period": TIME_PERIOD_SQL,
+    },
+    "stops": {
+        "country_name": "country_name",
+        "violation": "violation",
+        "vehicle_number": "vehicle_number",
+        "search_conducted": "search_conducted",
+    },
+}
+DIMENSIONS["sample"] = DIMENSIONS["cube"]
+DIMENSIONS["profiles"] = {"vehicle_number": "vehicle_number"}
+
+# source -> {measure name: aggregate expression}
+_COUNTS = {
+    "stops": "SUM(stops)",
+    "arrests": "SUM(arrests)",
+    "searches": "SUM(searches)",
+    "arrest_rate": _rate("arrests"),
+    "search_rate": _rate("searches"),
+}
+MEASURES = {
+    "cube": {
+        **_COUNTS,
+        "dui_stops": "SUM(CASE WHEN violation = 'DUI' THEN stops ELSE 0 END)",
+        "avg_duration": "SUM(duration_sum) / SUM(duration_count)",
+    },
+    "rollup": _COUNTS,
+    "stops": {"stops": "COUNT(*)"},
+    "sample": {
+        **{name: "ROUND(SUM(weight * %s))" % y for name, y in _INDICATORS.items()},
+        "arrest_rate": _sample_rate("arrested"),
+        "search_rate": _sample_rate("searched"),
+    },
+    "profiles": {name: name for name in ("stops", "dui_stops", "searches", "arrests")},
+}
+# sample measure -> its 95% error bound
+ERRORS = {
+    **{name: _count_error(y) for name, y in _INDICATORS.items()},
+    "arrest_rate": _rate_error("arrested"),
+    "search_rate": _rate_error("searched"),
+}
+# Sources whose specs the sample can stand in for.
+APPROXIMATE_SOURCES = ("cube",)
+
+# filter -> {source: column}; "date" is compiled per source in _compile_sql.
+FILTERS = {
+    "country": {"cube": "country_name", "rollup": "country_name", "stops": "country_name", "sample": "country_name"},
+    "violation": {"cube": "violation", "stops": "violation", "sample": "violation"},
+    "date": {"cube": None, "rollup": None, "stops": None, "sample": None},
+}
+
+
+def spec(source, dimensions=None, measures=None, where=None, order_by=(), limit=None):
+    """Build a Spec from dicts ({output column: dimension / measure name})."""
+    return Spec(
+        source,
+        tuple((dimensions or {}).items()),
+        tuple((measures or {}).items()),
+        tuple((where or {}).items()),
+        tuple(order_by),
+        limit,
+    )
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def _condition(column, value):
+    if isinstance(value, (tuple, list)):
+        return "%s IN (%s)" % (column, ", ".join(_literal(v) for v in value))
+    return "%s = %s" % (column, _literal(value))
+
+
+def _shape(filters):
+    """The part of ``filters`` that changes the SQL text (names and list lengths)."""
+    shape = []
+    for name in FILTERS:
+        value = (filters or {}).get(name)
+        if value:
+            shape.append((name, len(value) if name != "date" else 2))
+    return tuple(shape)
+
+
+# COMPILER
+@functools.lru_cache(maxsize=256)
+def _compile_sql(spec, shape):
+    dims, measures = DIMENSIONS[spec.source], MEASURES[spec.source]
+    select = ["%s AS %s" % (dims[name], alias) for alias, name in spec.dimensions]
+    select += ["%s AS %s" % (measures[name], alias) for alias, name in spec.measures]
+    where = [_condition(dims[column], value) for column, value in spec.where]
+    notes = []
+    if spec.source == "sample":
+        select += ["%s AS %s_error" % (ERRORS[name], alias) for alias, name in spec.measures]
+        notes.append("Estimated from a stratified sample; each _error column is a 95% error bound.")
+    from_sql = {
+        "cube": CUBE_TABLE, "stops": "traffic_stops", "sample": SAMPLE_TABLE, "profiles": PROFILE_TABLE,
+    }.get(spec.source)
+    # Profiles are already one row per plate: no GROUP BY, so ORDER BY <count>
+    # DESC LIMIT n reads the top of the count's index.
+    grouped = spec.source != "profiles"
+    if not grouped:
+        where += ["%s > 0" % measures[name] for _alias, name in spec.measures]
+    for name, size in shape:
+        column = FILTERS[name].get(spec.source, False)
+        if column is False:
+            notes.append(f"The {name} filter does not apply to this panel.")
+        elif name == "date":
+            if spec.source == "rollup":
+                from_sql = "{rollup}"
+            elif spec.source == "cube":
+                where.append("stop_year * 100 + stop_month BETWEEN %s AND %s")
+                notes.append("Dates are applied by whole month for this panel.")
+            else:
+                where.append("stop_date BETWEEN %s AND %s")
+        else:
+            where.append("%s IN (%s)" % (column, ", ".join(["%s"] * size)))
+    if from_sql is None:  # rollup without a date range: the whole month grain
+        from_sql = "{rollup}"
+    sql = "SELECT %s\nFROM %s" % (",\n       ".join(select), from_sql)
+    if where:
+        sql += "\nWHERE " + " AND ".join(where)
+    if spec.dimensions and grouped:
+        sql += "\nGROUP BY " + ", ".join(str(i) for i in range(1, len(spec.dimensions) + 1))
+    if spec.order_by:
+        sql += "\nORDER BY " + ", ".join(spec.order_by)
+    if spec.limit:
+        sql += "\nLIMIT %d" % spec.limit
+    return sql, tuple(notes)
+
+
+def approximate_spec(spec):
+    """``spec`` answered from the sample, or None when the sample cannot answer it."""
+    if spec.source not in APPROXIMATE_SOURCES:
+        return None
+    names = [name for _alias, name in spec.dimensions] + [column for column, _value in spec.where]
+    if any(name not in DIMENSIONS["sample"] for name in names):
+        return None
+    if any(name not in MEASURES["sample"] for _alias, name in spec.measures):
+        return None
+    return spec._replace(source="sample")
+
+
+def profile_spec(spec, filters=None):
+    """``spec`` answered from vehicle_profiles, or None when it cannot be.
+
+    Profiles hold all-time totals, so only specs without active filters
+    qualify (see vehicle_profiles.profile_count).
+    """
+    count = None if _shape(filters) else profile_count(spec)
+    if count is None:
+        return None
+    (alias, _name), = spec.measures
+    return spec._replace(source="profiles", measures=((alias, count),), where=())
+
+
+def compile_spec(spec, filters=None, approximate=False):
+    """Compiled(sql, params, notes) for ``spec`` under the filter bar values.
+
+    ``filters`` holds "country" and "violation" lists and a "date"
+    (start, end) pair; empty entries are ignored. ``notes`` explains filters
+    that a source cannot apply (or applies coarsely). ``params`` is None when
+    nothing is bound. With ``approximate``, returns the sample estimate
+    instead, or None when there is none (see approximate_spec). Top-N plate
+    specs are read from vehicle_profiles whenever no filter is active.
+    """
+    if approximate:
+        spec = approximate_spec(spec)
+        if spec is None:
+            return None
+    spec = profile_spec(spec, filters) or spec
+    filters = filters or {}
+    shape = _shape(filters)
+    sql, notes = _compile_sql(spec, shape)
+    params = []
+    for name, _size in shape:
+        if FILTERS[name].get(spec.source, False) is False:
+            continue
+        if name == "date":
+            start, end = filters["date"]
+            if spec.source == "cube":
+                params += [start.year * 100 + start.month, end.year * 100 + end.month]
+            elif spec.source in ("stops", "sample"):
+                params += [start, end]
+        else:
+            params += list(filters[name])
+    if spec.source == "rollup":
+        source, source_params = range_source(*(filters.get("date") or (None, None)))
+        sql = sql.replace("{rollup}", source)
+        params = list(source_params or ()) + params
+    return Compiled(sql, tuple(params) or None, notes)
@@ -0,0 +1,419 @@
+# QUERY SERVICE
+# Runs the dashboard's queries in a pool of worker processes, so running
+# queries and building their DataFrames for many concurrent sessions is not
+# serialized on one Streamlit process's GIL:
+#
+#   python query_service.py --backend duckdb --workers 8
+#   CHECKPOST_BACKEND=remote streamlit run 3.streamlit.py --server.port 8501
+#   CHECKPOST_BACKEND=remote streamlit run 3.streamlit.py --server.port 8502
+#
+#   POST /query       {"sql": ..., "params": [...]}; the result as an Arrow IPC
+#                     stream, X-Cache: hit, miss or shared
+#   POST /stream      {"sql": ..., "params": [...], "batch_rows": n}; the
+#                     result in Arrow batches as they are produced (chunked
+#                     transfer), never cached
+#   POST /invalidate  empty the shared cache
+#   GET  /version     {"version": the data version, "dialect": "mysql" or "duckdb"}
+#   GET  /status      request counts, latency percentiles, cache stats
+#
+# Every worker opens its own backend (--backend / CHECKPOST_SERVICE_BACKEND)
+# and fills the shared on-disk cache (shared_cache.py), which this process
+# answers repeat queries from without waiting for a worker. Identical queries
+# that arrive while one is running wait for it instead of running again.
+#
+# The service has no authentication, so keep it on a private interface. It
+# only reads: requests must start with SELECT / WITH / EXPLAIN, and the
+# workers' connections enforce it whatever the SQL says.
+#   MySQL   sessions run in READ ONLY transaction mode, and the service
+#           refuses to start on an account holding the FILE privilege
+#           (SELECT ... INTO OUTFILE, LOAD_FILE()). Give it a SELECT-only
+#           account through CHECKPOST_SERVICE_DB_USER / _PASSWORD:
+#             CREATE USER 'checkpost_ro'@'localhost' IDENTIFIED BY '...';
+#             GRANT SELECT ON Police_checkpost.* TO 'checkpost_ro'@'localhost';
+#   DuckDB  file access is limited to the dataset directory and only
+#           statements DuckDB parses as a single SELECT are run
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import backends
+from db import DB_CONFIG, QUERY_TIMEOUT, STREAM_BATCH_ROWS, normalize_sql, params_key
+from shared_cache import CACHE_DIR, DiskCache, to_ipc
+
+HOST = os.environ.get("CHECKPOST_SERVICE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CHECKPOST_SERVICE_PORT", "8766"))
+SERVICE_BACKEND = os.environ.get("CHECKPOST_SERVICE_BACKEND", "mysql")
+SERVICE_WORKERS = int(os.environ.get("CHECKPOST_SERVICE_WORKERS", str(os.cpu_count() or 4)))
+SERVICE_DB_CONFIG = {
+    **DB_CONFIG,
+    "user": os.environ.get("CHECKPOST_SERVICE_DB_USER", DB_CONFIG["user"]),
+    "password": os.environ.get("CHECKPOST_SERVICE_DB_PASSWORD", DB_CONFIG["password"]),
+}
+LATENCY_WINDOW = 5000  # most recent /query latencies kept for /status
+STREAM_CHUNK_BYTES = 1024 * 1024
+STREAM_POLL_SECONDS = 0.05
+READ_ONLY = ("SELECT", "WITH", "EXPLAIN")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_GRANT = re.compile(r"GRANT (.+?) ON (\S+) TO ", re.IGNORECASE)
+
+
+# READ-ONLY BACKENDS
+def open_backend(name):
+    """The service's backend ("mysql" or "duckdb"), opened read-only."""
+    if name == "mysql":
+        return backends.get_backend(name, config=SERVICE_DB_CONFIG, read_only=True)
+    return backends.get_backend(name, read_only=True)
+
+
+def check_account(backend):
+    """PermissionError if the MySQL account can write files from a SELECT.
+
+    READ ONLY transactions stop writes to tables, but not INTO OUTFILE or
+    LOAD_FILE(), which only need the global FILE privilege.
+    """
+    for grant in backend.execute("SHOW GRANTS").iloc[:, 0]:
+        match = _GRANT.match(grant)
+        if match is None or match.group(2) != "*.*":
+            continue
+        privileges = {p.strip().upper() for p in match.group(1).split(",")}
+        if privileges & {"FILE", "ALL", "ALL PRIVILEGES"}:
+            raise PermissionError(
+                "the query service's MySQL account (%s) holds the FILE privilege; set "
+                "CHECKPOST_SERVICE_DB_USER / CHECKPOST_SERVICE_DB_PASSWORD to a SELECT-only account"
+                % SERVICE_DB_CONFIG["user"]
+            )
+
+
+# WORKER PROCESSES
+_worker = {}
+
+
+def _init_worker(backend_name, cache_dir):
+    _worker["backend"] = open_backend(backend_name)
+    _worker["cache"] = DiskCache(cache_dir)
+
+
+def _run_query(sql, params, key):
+    """(Arrow IPC bytes, cache hit) for one query, filling the shared cache."""
+    cache = _worker["cache"]
+    data = cache.get(key)  # another worker or service may have just filled it
+    if data is not None:
+        return data, True
+    # ttl=0: the shared cache replaces the backend's own, but timings are kept
+    data = to_ipc(_worker["backend"].run_query(sql, params, ttl=0))
+    cache.put(key, data)
+    return data, False
+
+
+def _stream_query(sql, params, batch_rows, path):
+    """Append the result to the Arrow IPC stream file ``path`` one batch at a time."""
+    import pyarrow as pa
+
+    with pa.OSFile(path, "wb") as sink:
+        writer = None
+        for batch in _worker["backend"].stream(sql, params, batch_rows):
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, batch.schema)
+            writer.write_batch(batch)
+        if writer is None:  # no rows: an empty stream still needs a schema
+            writer = pa.ipc.new_stream(sink, pa.schema([]))
+        writer.close()
+
+
+# SERVICE
+def check_query(payload):
+    """(sql, params) from a request body; ValueError if it is plainly not a query.
+
+    Only a cheap first filter: the read-only backends are what stop writes.
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("sql"), str):
+        raise ValueError('expected {"sql": ..., "params": [...]}')
+    sql = normalize_sql(payload["sql"])
+    if not sql or sql.split(None, 1)[0].upper() not in READ_ONLY:
+        raise ValueError("only %s statements are accepted" % " / ".join(READ_ONLY))
+    if ";" in _LITERAL.sub("", sql):
+        raise ValueError("one statement per request")
+    return sql, backends.decode_params(payload.get("params"))
+
+
+class QueryService:
+    """Worker pool, shared cache and counters behind the HTTP front end."""
+
+    def __init__(self, backend=SERVICE_BACKEND, workers=SERVICE_WORKERS, cache_dir=CACHE_DIR,
+                 timeout=QUERY_TIMEOUT):
+        self.backend_name = backend
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.timeout = timeout or None
+        # Only asked for the data version; queries run in the workers.
+        self.source = open_backend(backend)
+        if self.source.dialect == "mysql":
+            check_account(self.source)
+        self.cache = DiskCache(cache_dir)
+        self.pool = self._start_pool()
+        self._pool_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._inflight = {}  # (sql, params) -> Future
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"queries": 0, "cache_hits": 0, "shared": 0, "errors": 0, "timeouts": 0, "streams": 0}
+        self.started = time.time()
+
+    def _start_pool(self):
+        # spawn, not fork: workers must not inherit this process's database connections
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(self.backend_name, self.cache_dir),
+        )
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def _submit(self, fn, *args):
+        pool = self.pool
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:  # a worker died (e.g. out of memory): start over
+            with self._pool_lock:
+                if self.pool is pool:
+                    self.pool = self._start_pool()
+            return self.pool.submit(fn, *args)
+
+    def version(self):
+        return self.source.data_version()
+
+    def query(self, sql, params=None):
+        """(Arrow IPC bytes, "hit" | "miss" | "shared"); TimeoutError after ``timeout`` seconds."""
+        start = time.perf_counter()
+        key = self.cache.key(sql, params, self.version())
+        data = self.cache.get(key)
+        if data is not None:
+            status = "hit"
+        else:
+            inflight = (sql, params_key(params))
+            with self._lock:
+                future = self._inflight.get(inflight)
+                shared = future is not None
+                if future is None:
+                    future = self._inflight[inflight] = self._submit(_run_query, sql, params, key)
+            if not shared:
+                # outside the lock: a finished future runs the callback right here
+                future.add_done_callback(lambda f: self._forget(inflight, f))
+            try:
+                data, hit = future.result(self.timeout)
+            except FutureTimeout:
+                self._count(queries=1, timeouts=1)
+                raise TimeoutError(f"query did not finish within {self.timeout:g}s") from None
+            except Exception:
+                self._count(queries=1, errors=1)
+                raise
+            status = "shared" if shared else "hit" if hit else "miss"
+        self._count(queries=1, cache_hits=int(status == "hit"), shared=int(status == "shared"))
+        with self._lock:
+            self._latencies.append((time.perf_counter() - start) * 1000)
+        return data, status
+
+    def _forget(self, inflight, future):
+        with self._lock:
+            if self._inflight.get(inflight) is future:
+                del self._inflight[inflight]
+
+    def stream(self, sql, params=None, batch_rows=STREAM_BATCH_ROWS):
+        """Yield the result as Arrow IPC stream bytes, bypassing the cache.
+
+        A worker spools the batches to a file in the cache directory, which
+        is read back here as it grows, so neither process holds the whole
+        result. TimeoutError if the file stops growing for ``timeout``
+        seconds; the worker's exception if the query fails.
+        """
+        self._count(streams=1)
+        fd, path = tempfile.mkstemp(dir=self.cache_dir, suffix=".stream")
+        os.close(fd)
+        try:
+            future = self._submit(_stream_query, sql, params, batch_rows, path)
+            with open(path, "rb") as f:
+                progress = time.monotonic()
+                while True:
+                    data = f.read(STREAM_CHUNK_BYTES)
+                    if data:
+                        progress = time.monotonic()
+                        yield data
+                    elif future.done():
+                        future.result()
+                        while data := f.read(STREAM_CHUNK_BYTES):  # written since the last read
+                            yield data
+                        return
+                    elif self.timeout and time.monotonic() - progress > self.timeout:
+                        self._count(timeouts=1)
+                        raise TimeoutError(f"stream made no progress for {self.timeout:g}s")
+                    else:
+                        time.sleep(STREAM_POLL_SECONDS)
+        finally:
+            os.unlink(path)  # a worker still writing keeps its handle until it is done
+
+    def status(self):
+        with self._lock:
+            latencies = np.asarray(self._latencies)
+            counters = dict(self.counters)
+            inflight = len(self._inflight)
+        percentiles = {
+            f"p{p}_ms": round(float(np.percentile(latencies, p)), 2) if len(latencies) else None
+            for p in (50, 95, 99)
+        }
+        return {
+            **counters,
+            **percentiles,
+            "inflight": inflight,
+            "workers": self.workers,
+            "backend": self.backend_name,
+            "data_version": self.source.stats()["data_version"],
+            "shared_cache": self.cache.stats(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+        }
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+# HTTP
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # many dashboard threads connect at once
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: RemoteBackend reuses one connection per thread
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def _send(self, code, data, content_type, headers=None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _reply(self, code, body):
+            self._send(code, json.dumps(body, default=str).encode(), "application/json")
+
+        def do_GET(self):
+            if self.path == "/version":
+                self._reply(200, {"version": service.version(), "dialect": service.source.dialect})
+            elif self.path == "/status":
+                self._reply(200, service.status())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if self.path == "/invalidate":
+                service.cache.clear()
+                self._reply(200, {"cleared": True})
+                return
+            if self.path not in ("/query", "/stream"):
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                payload = json.loads(body or b"null")
+                sql, params = check_query(payload)
+            except ValueError as exc:  # includes JSONDecodeError
+                self._reply(400, {"error": str(exc)})
+                return
+            try:
+                if self.path == "/stream":
+                    batch_rows = int(payload.get("batch_rows") or STREAM_BATCH_ROWS)
+                    chunks = service.stream(sql, params, batch_rows)
+                    first = next(chunks, b"")  # errors before any output still get a status
+                else:
+                    data, status = service.query(sql, params)
+            except TimeoutError as exc:
+                self._reply(504, {"error": str(exc)})
+                return
+            except PermissionError as exc:
+                self._reply(403, {"error": str(exc)})
+                return
+            except Exception as exc:
+                self._reply(500, {"error": f"{type(exc).__name__}: {exc}"})
+                return
+            if self.path == "/stream":
+                self._send_chunks(first, chunks)
+            else:
+                self._send(200, data, ARROW_STREAM, {"X-Cache": status})
+
+        def _send_chunks(self, first, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", ARROW_STREAM)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for data in itertools.chain([first], chunks):
+                    if data:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.write(b"0\r\n\r\n")
+            except Exception:
+                # The status is already sent: drop the connection so the
+                # client sees a truncated stream rather than a short result.
+                self.close_connection = True
+            finally:
+                chunks.close()
+
+        def log_message(self, format, *args):  # keep the console for status lines
+            pass
+
+    return Handler
+
+
+def serve(host=HOST, port=PORT, service=None, progress=True):
+    """Run the service until interrupted."""
+    service = service or QueryService()
+    server = Server((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, name="query-http", daemon=True).start()
+    if progress:
+        print(f"Serving {service.backend_name} queries on http://{host}:{port} with {service.workers} workers")
+    try:
+        while True:
+            time.sleep(10)
+            if progress:
+                s = service.status()
+                print(f"  {s['queries']:,} queries  (p50 {s['p50_ms']} ms, p95 {s['p95_ms']} ms, "
+                      f"{s['cache_hits']:,} cache hits, {s['inflight']} running)")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.close()
+    return service.status()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve dashboard queries from a pool of worker processes.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--backend", default=SERVICE_BACKEND, choices=["mysql", "duckdb"])
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args(argv)
+    service = QueryService(args.backend, args.workers, args.cache_dir)
+    print(f"Stopped: {serve(args.host, args.port, service)}")
+
+
+if __name__ == "__main__":
+    main()
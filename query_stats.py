@@ -0,0 +1,127 @@
+# QUERY TIMING
+# Per-query timings recorded by CachedBackend.run_query(): connect, execute
+# and fetch (rows -> DataFrame) time, row count and result size, keyed by a
+# query name. Each name keeps its last WINDOW executions in memory for the
+# rolling percentiles and means shown in the dashboard's Performance
+# section; execution and cache-hit counts cover the whole process lifetime.
+#
+#   CHECKPOST_QUERY_LOG=query_log.jsonl   append one JSON line per query
+#   CHECKPOST_SLOW_QUERY_MS=500           EXPLAIN queries slower than this
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+WINDOW = 500
+SLOW_QUERY_MS = float(os.environ.get("CHECKPOST_SLOW_QUERY_MS", "500"))
+QUERY_LOG = os.environ.get("CHECKPOST_QUERY_LOG") or None
+PHASES = ("connect_ms", "execute_ms", "fetch_ms")
+PERCENTILES = (50, 95, 99)
+
+
+class Timer:
+    """Splits one query's wall time into named phases (see PHASES)."""
+
+    def __init__(self):
+        self.phases = {}
+        self._mark = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._mark) * 1000
+        self._mark = now
+
+
+class QueryStats:
+    """Rolling per-query timings, an optional JSON-lines log and slow-query plans."""
+
+    def __init__(self, window=WINDOW, slow_ms=SLOW_QUERY_MS, log_path=QUERY_LOG):
+        self.window = window
+        self.slow_ms = slow_ms
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._executed = {}
+        self._hits = {}
+        self._plans = {}
+        self._log = None  # opened on the first record, line-buffered
+        self._log_lock = threading.Lock()
+
+    def record(self, name, backend, hit, total_ms, phases=None, rows=0, nbytes=0):
+        """Record one run_query() call; cache hits are counted, not timed."""
+        entry = {
+            "ts": round(time.time(), 3),
+            "backend": backend,
+            "query": name,
+            "cache_hit": hit,
+            "total_ms": round(total_ms, 3),
+            **{p: round((phases or {}).get(p, 0.0), 3) for p in PHASES},
+            "rows": rows,
+            "bytes": nbytes,
+        }
+        with self._lock:
+            if hit:
+                self._hits[name] = self._hits.get(name, 0) + 1
+            else:
+                self._executed[name] = self._executed.get(name, 0) + 1
+                samples = self._samples.get(name)
+                if samples is None:
+                    samples = self._samples[name] = deque(maxlen=self.window)
+                samples.append((total_ms, *(entry[p] for p in PHASES), rows, nbytes))
+        if self.log_path:
+            line = json.dumps(entry, default=str) + "\n"
+            with self._log_lock:
+                if self._log is None:
+                    self._log = open(self.log_path, "a", buffering=1)
+                self._log.write(line)
+
+    def is_slow(self, total_ms):
+        return self.slow_ms is not None and total_ms >= self.slow_ms
+
+    def needs_plan(self, sql):
+        with self._lock:
+            return sql not in self._plans
+
+    def record_plan(self, name, sql, total_ms, plan):
+        with self._lock:
+            self._plans[sql] = {"query": name, "total_ms": round(total_ms, 1), "sql": sql, "plan": plan}
+
+    def slow_queries(self):
+        """Captured EXPLAIN output, slowest first."""
+        with self._lock:
+            return sorted(self._plans.values(), key=lambda p: -p["total_ms"])
+
+    def summary(self):
+        """One row per query name: call counts, and total-time percentiles and
+        phase means over the last ``window`` executions."""
+        with self._lock:
+            samples = {name: np.array(s) for name, s in self._samples.items()}
+            executed = dict(self._executed)
+            hits = dict(self._hits)
+        rows = []
+        for name in sorted(set(samples) | set(hits)):
+            row = {"query": name, "executed": executed.get(name, 0), "cache_hits": hits.get(name, 0)}
+            data = samples.get(name)
+            if data is not None:
+                for p, value in zip(PERCENTILES, np.percentile(data[:, 0], PERCENTILES)):
+                    row[f"p{p}_ms"] = round(value, 1)
+                for i, phase in enumerate(PHASES, start=1):
+                    row[f"avg_{phase}"] = round(data[:, i].mean(), 1)
+                row["avg_rows"] = round(data[:, 4].mean(), 1)
+                row["avg_bytes"] = int(data[:, 5].mean())
+            rows.append(row)
+        df = pd.DataFrame(rows)
+        if "p95_ms" in df:
+            df = df.sort_values("p95_ms", ascending=False, na_position="last")
+        return df.set_index("query") if len(df) else df
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._executed.clear()
+            self._hits.clear()
+            self._plans.clear()
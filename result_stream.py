@@ -0,0 +1,94 @@
+# RESULT STREAMING
+# Large results leave the database in bounded pieces instead of one
+# DataFrame: CachedBackend.stream() yields Arrow record batches, and
+# plate_search pages through matches with a keyset cursor. Both feed the
+# writers here, which build CSV / Parquet downloads one batch at a time.
+# Only the finished file is held whole: st.download_button keeps a
+# download's bytes in Streamlit's in-memory media store, whatever it is
+# given, so the bound is one copy of the output file, not of the query
+# result as DataFrames.
+#
+# The dashboard shows results PAGE_ROWS at a time and offers the full result
+# as a download that is only generated when the button is clicked.
+import io
+
+import pandas as pd
+
+PAGE_ROWS = 500
+
+# label -> (file extension, MIME type)
+FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def iter_keyset(fetch_page, after=0):
+    """Yield pages from ``fetch_page(after) -> (frame, next_after)`` until
+    next_after is None (the plate_search.search_plates contract)."""
+    while after is not None:
+        page, after = fetch_page(after)
+        if len(page):
+            yield page
+
+
+def page_count(rows, page_rows=PAGE_ROWS):
+    return max(1, -(-rows // page_rows))
+
+
+def page_slice(df, page, page_rows=PAGE_ROWS):
+    """Rows of 0-based page ``page`` of an in-memory result."""
+    return df.iloc[page * page_rows:(page + 1) * page_rows]
+
+
+def _record_batch(part):
+    import pyarrow as pa
+
+    if isinstance(part, pd.DataFrame):
+        return pa.RecordBatch.from_pandas(part, preserve_index=False)
+    return part
+
+
+def write_batches(parts, sink, fmt="CSV"):
+    """Write DataFrames or RecordBatches to ``sink`` one at a time.
+
+    The schema is taken from the first part; later parts are cast to it.
+    Returns the row count.
+    """
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    writer, schema, rows = None, None, 0
+    try:
+        for part in parts:
+            batch = _record_batch(part)
+            if writer is None:
+                schema = batch.schema
+                if fmt == "Parquet":
+                    writer = pq.ParquetWriter(sink, schema)
+                else:
+                    writer = pa_csv.CSVWriter(sink, schema)
+            elif batch.schema != schema:
+                batch = batch.cast(schema)
+            if fmt == "Parquet":
+                writer.write_batch(batch)
+            else:
+                writer.write(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export(make_parts, fmt="CSV"):
+    """Run ``make_parts()`` and return its parts written as one ``fmt`` file.
+
+    Pass this (partially applied) as st.download_button's ``data`` so the
+    file is only built when the button is clicked. The result is bytes:
+    Streamlit reads any file or stream it is given into memory before
+    serving it, so a temporary file would only add a copy.
+    """
+    buffer = io.BytesIO()
+    write_batches(make_parts(), buffer, fmt)
+    return buffer.getvalue()
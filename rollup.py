@@ -0,0 +1,157 @@
+# TIME ROLLUP
+# traffic_stops_rollup holds stop, arrest and search counts per time bucket,
+# so the time-based panels never compute YEAR() / MONTH() / HOUR() per raw
+# row:
+#
+#   grain 'day'    one bucket per calendar day
+#   grain 'month'  one bucket per calendar month (bucket = the 1st)
+#
+# Every bucket is split by hour of day and country, which is all the
+# time-based insights group by. A date range is answered by range_source():
+# whole months come from the month grain, and only the partial months at
+# either end come from the day grain. The rows read depend on the calendar
+# span, not on the size of traffic_stops.
+#
+# Maintained at ingest alongside the cube (incremental.SUMMARIES). Stops
+# without a date, time or country keep buckets of their own under stand-in
+# keys, since the primary key can't hold NULL. rollup_column() turns them
+# back into NULL, so the panels count the same stops as queries on
+# traffic_stops.
+from datetime import date, timedelta
+
+from cube import MEASURES
+
+ROLLUP_TABLE = "traffic_stops_rollup"
+
+# grain -> bucket expression over traffic_stops
+GRAINS = {
+    "day": "CAST(stop_date AS DATE)",
+    "month": "CAST(stop_date - INTERVAL (DAYOFMONTH(stop_date) - 1) DAY AS DATE)",
+}
+ROLLUP_MEASURES = {name: MEASURES[name] for name in ("stops", "arrests", "searches")}
+
+NO_DATE = date(1000, 1, 1)
+# column -> the stand-in stored for NULL
+STAND_INS = {"bucket": "DATE '%s'" % NO_DATE, "stop_hour": "-1", "country_name": "''"}
+
+_ROLLUP_COLUMNS = ", ".join(["grain", "bucket", "stop_hour", "country_name"] + list(ROLLUP_MEASURES))
+
+ROLLUP_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    grain ENUM('day', 'month') NOT NULL,
+    bucket DATE NOT NULL,
+    stop_hour TINYINT NOT NULL,
+    country_name VARCHAR(100) NOT NULL,
+    stops INT NOT NULL,
+    arrests INT NOT NULL,
+    searches INT NOT NULL,
+    PRIMARY KEY (grain, bucket, stop_hour, country_name)
+)
+"""
+
+
+def rollup_ddl(table=ROLLUP_TABLE):
+    return ROLLUP_DDL.format(table=table)
+
+
+def rollup_column(name):
+    """SQL for rollup column ``name`` with its NULL stand-in mapped back to NULL."""
+    return "NULLIF(%s, %s)" % (name, STAND_INS[name]) if name in STAND_INS else name
+
+
+def rollup_select_sql(grain, where=""):
+    """Aggregate traffic_stops into ``grain`` buckets (``where`` is ANDed in)."""
+    dims = {
+        "bucket": GRAINS[grain],
+        "stop_hour": "HOUR(stop_time)",
+        "country_name": "country_name",
+    }
+    dims = {name: "COALESCE(%s, %s)" % (expr, STAND_INS[name]) for name, expr in dims.items()}
+    select = ", ".join(
+        ["'%s' AS grain" % grain]
+        + ["%s AS %s" % (expr, name) for name, expr in dims.items()]
+        + ["COALESCE(%s, 0) AS %s" % (expr, name) for name, expr in ROLLUP_MEASURES.items()]
+    )
+    return "SELECT %s FROM traffic_stops%s GROUP BY %s" % (
+        select, " WHERE " + where if where else "", ", ".join(dims.values())
+    )
+
+
+def rollup_build_sql(where=""):
+    """Every grain in one statement, for building the table from scratch."""
+    return "\nUNION ALL\n".join(rollup_select_sql(grain, where) for grain in GRAINS)
+
+
+def rebuild_rollup(conn, last_id):
+    """Rebuild the rollup from rows with id <= last_id and swap it in atomically.
+
+    Returns the number of rollup rows.
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s_new, %s_old" % (ROLLUP_TABLE, ROLLUP_TABLE))
+    cursor.execute(rollup_ddl(ROLLUP_TABLE + "_new"))
+    rows = 0
+    for grain in GRAINS:
+        cursor.execute("INSERT INTO %s_new (%s)\n%s" % (
+            ROLLUP_TABLE, _ROLLUP_COLUMNS, rollup_select_sql(grain, "id <= %s")
+        ), (last_id,))
+        rows += cursor.rowcount
+    conn.commit()
+    cursor.execute("RENAME TABLE {t} TO {t}_old, {t}_new TO {t}".format(t=ROLLUP_TABLE))
+    cursor.execute("DROP TABLE %s_old" % ROLLUP_TABLE)
+    cursor.close()
+    return rows
+
+
+def apply_rollup_delta(cursor, low_id, high_id):
+    """Fold rows with low_id < id <= high_id into every grain.
+
+    New buckets are inserted and existing ones incremented through the
+    primary key, inside the caller's transaction.
+    """
+    update = ", ".join("{0} = {0} + VALUES({0})".format(m) for m in ROLLUP_MEASURES)
+    for grain in GRAINS:
+        cursor.execute("INSERT INTO %s (%s)\n%s\nON DUPLICATE KEY UPDATE %s" % (
+            ROLLUP_TABLE, _ROLLUP_COLUMNS, rollup_select_sql(grain, "id > %s AND id <= %s"), update
+        ), (low_id, high_id))
+
+
+# RANGE QUERIES
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def range_source(start=None, end=None):
+    """(FROM-clause SQL, params) covering stops dated start..end inclusive.
+
+    Whole months are read from the month grain, and the partial months at
+    either end from the day grain. Without a range, the whole month grain
+    is read, including stops without a date; a range leaves them out.
+    """
+    if start is None and end is None:
+        return "(SELECT * FROM %s WHERE grain = 'month') r" % ROLLUP_TABLE, None
+    start = max(start or date.min, NO_DATE + timedelta(days=1))
+    stop = (end or date.max - timedelta(days=1)) + timedelta(days=1)  # exclusive
+    first_full = start if start.day == 1 else _next_month(start)
+    last_full = _month_start(stop)
+    if first_full >= last_full:
+        return (
+            "(SELECT * FROM %s WHERE grain = 'day' AND bucket >= %%s AND bucket < %%s) r" % ROLLUP_TABLE,
+            (start, stop),
+        )
+    return (
+        "(SELECT * FROM %s WHERE (grain = 'month' AND bucket >= %%s AND bucket < %%s)"
+        " OR (grain = 'day' AND ((bucket >= %%s AND bucket < %%s) OR (bucket >= %%s AND bucket < %%s)))) r"
+        % ROLLUP_TABLE,
+        (first_full, last_full, start, first_full, last_full, stop),
+    )
+
+
+if __name__ == "__main__":
+    from incremental import rebuild_summaries
+
+    print(f"{ROLLUP_TABLE} rebuilt with {rebuild_summaries()['time_rollup']:,} rows")
@@ -0,0 +1,144 @@
+# SHARED RESULT CACHE
+# Query results as Arrow IPC files in one directory, so every process that
+# points at it (the query service's workers, several service instances on
+# one host) shares a cache that outlives any of them. Files are keyed on the
+# normalized SQL, its parameters and the data version, so a new version
+# simply stops matching the old files; they age out after
+# CHECKPOST_CACHE_TTL seconds or when the directory grows past its size cap
+# (oldest first).
+#
+#   CHECKPOST_SHARED_CACHE=.checkpost_cache   cache directory
+#   CHECKPOST_SHARED_CACHE_MB=1024            size cap
+#
+# Writes go to a temporary file that is renamed into place, so readers never
+# see a partial result and concurrent writers of the same key are harmless.
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from db import CACHE_TTL, normalize_sql, params_key
+
+CACHE_DIR = os.environ.get("CHECKPOST_SHARED_CACHE", ".checkpost_cache")
+CACHE_MB = float(os.environ.get("CHECKPOST_SHARED_CACHE_MB", "1024"))
+PRUNE_EVERY = 100  # puts between size checks
+SUFFIX = ".arrow"
+
+
+def to_ipc(df):
+    """A DataFrame as Arrow IPC stream bytes."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_ipc(data):
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+class DiskCache:
+    """Arrow result files shared between processes through one directory."""
+
+    def __init__(self, path=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query, params=None, version=None):
+        text = json.dumps([normalize_sql(query), repr(params_key(params)), repr(version)])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def get(self, key):
+        """The stored bytes for ``key``, or None when missing or expired."""
+        try:
+            with open(self._file(key), "rb") as f:
+                fresh = time.time() - os.fstat(f.fileno()).st_mtime < self.ttl
+                data = f.read() if fresh else None
+        except FileNotFoundError:
+            data = None
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if self.ttl <= 0:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # pruned by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def prune(self):
+        """Delete expired files, then the oldest until under max_bytes. Returns files deleted."""
+        now = time.time()
+        entries = sorted(self._entries())
+        total = sum(size for _mtime, size, _path in entries)
+        deleted = 0
+        for mtime, size, path in entries:
+            if now - mtime < self.ttl and total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return deleted
+
+    def clear(self):
+        for _mtime, _size, path in self._entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "files": len(entries),
+                "bytes": sum(size for _mtime, size, _path in entries),
+            }
@@ -0,0 +1,154 @@
+# SKETCHES
+# Small, mergeable summaries of vehicle plates for the approximate dashboard
+# mode (see approximate.py):
+#
+#   HyperLogLog    distinct plates; relative standard error 1.04 / sqrt(2^precision)
+#   CountMinTopN   per-plate counts that never under-count and over-count by
+#                  at most e / width * total (probability 1 - e^-depth), plus
+#                  the heaviest plates seen so far as top-N candidates
+#
+# Both are filled a whole batch at a time with numpy, merge element-wise
+# (max for HyperLogLog, sum for count-min), and serialize to bytes for the
+# sketch table.
+import io
+import math
+
+import numpy as np
+import pandas as pd
+
+HLL_PRECISION = 14        # 16,384 registers, about 0.8% standard error
+CMS_WIDTH = 1 << 16
+CMS_DEPTH = 4
+CMS_CANDIDATES = 200      # plates tracked as top-N candidates
+
+# pandas' hash_array takes a 16-byte key; two keys give independent hashes.
+_HASH_KEYS = ("checkpost-hll-00", "checkpost-cms-01", "checkpost-cms-02")
+
+
+def _hash(values, key=0):
+    return pd.util.hash_array(np.asarray(values, dtype=object), hash_key=_HASH_KEYS[key], categorize=False)
+
+
+def _bit_length(values):
+    """Bit length of each uint64 (0 for 0), without going through floats."""
+    values = values.copy()
+    bits = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = values >= np.uint64(1 << shift)
+        bits[big] += shift
+        values[big] >>= np.uint64(shift)
+    return bits + (values > 0)
+
+
+class HyperLogLog:
+    kind = "hll"
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    def add(self, values):
+        h = _hash(values)
+        p = self.precision
+        index = (h >> np.uint64(64 - p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - p)) - 1)
+        rank = (64 - p) - _bit_length(rest) + 1  # position of the first 1 bit
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:  # small range: linear counting
+            return m * math.log(m / zeros)
+        return raw
+
+    def error(self, z=1.96):
+        """Half-width of the ``z`` confidence interval around estimate()."""
+        return z * 1.04 / math.sqrt(len(self.registers)) * self.estimate()
+
+    def _arrays(self):
+        return {"registers": self.registers}
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        registers = arrays["registers"]
+        return cls(int(math.log2(len(registers))), registers)
+
+
+class CountMinTopN:
+    kind = "cms"
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, candidates=CMS_CANDIDATES, table=None, heavy=None, total=0):
+        self.width = width
+        self.depth = depth
+        self.candidates = candidates
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else table
+        self.heavy = np.asarray([] if heavy is None else heavy, dtype=object)
+        self.total = total
+
+    def _columns(self, plates):
+        # Kirsch-Mitzenmacher: row i hashes to h1 + i * h2
+        h1, h2 = _hash(plates, 1), _hash(plates, 2) | np.uint64(1)
+        return [((h1 + np.uint64(i) * h2) % np.uint64(self.width)).astype(np.int64) for i in range(self.depth)]
+
+    def add(self, values):
+        counts = pd.Series(np.asarray(values, dtype=object)).value_counts(sort=False)
+        plates = counts.index.to_numpy(dtype=object)
+        for row, columns in enumerate(self._columns(plates)):
+            np.add.at(self.table[row], columns, counts.to_numpy(dtype=np.int64))
+        self.total += int(counts.sum())
+        self._keep_heaviest(plates)
+
+    def merge(self, other):
+        self.table += other.table
+        self.total += other.total
+        self._keep_heaviest(other.heavy)
+        return self
+
+    def estimate(self, plates):
+        if not len(plates):
+            return np.zeros(0, dtype=np.int64)
+        return np.min([self.table[row, columns] for row, columns in enumerate(self._columns(plates))], axis=0)
+
+    def error(self):
+        """Most any estimate() can over-count by (with probability 1 - e^-depth)."""
+        return math.ceil(math.e / self.width * self.total)
+
+    def top(self, n):
+        """[(plate, estimated count)] for the ``n`` heaviest candidates."""
+        counts = self.estimate(self.heavy)
+        order = np.lexsort((self.heavy.astype(str), -counts))[:n]
+        return [(self.heavy[i], int(counts[i])) for i in order]
+
+    def _keep_heaviest(self, plates):
+        pool = pd.unique(np.concatenate([self.heavy, np.asarray(plates, dtype=object)]))
+        counts = self.estimate(pool)
+        self.heavy = pool[np.argsort(-counts, kind="stable")[:self.candidates]]
+
+    def _arrays(self):
+        return {"table": self.table, "heavy": self.heavy.astype(str), "total": np.int64(self.total)}
+
+    @classmethod
+    def _from_arrays(cls, arrays):
+        table = arrays["table"]
+        return cls(table.shape[1], table.shape[0], table=table,
+                   heavy=arrays["heavy"].astype(object), total=int(arrays["total"]))
+
+
+KINDS = {cls.kind: cls for cls in (HyperLogLog, CountMinTopN)}
+
+
+def dumps(sketch):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, kind=np.str_(sketch.kind), **sketch._arrays())
+    return buffer.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as arrays:
+        return KINDS[str(arrays["kind"])]._from_arrays({k: arrays[k] for k in arrays.files})
@@ -0,0 +1,155 @@
+# SYNTHETIC TRAFFIC STOPS
+# Generates raw exports shaped like traffic_stops.xlsx (the 16 columns
+# 1.Data_cleaning.ipynb reads), so the pipeline and dashboard can be
+# benchmarked without the private dataset.
+#
+#   python synth_data.py --rows 10k --out synthetic_10k.csv
+#   python synth_data.py --rows 50m --out synthetic_50m.csv --seed 7
+#
+# Values follow the categories seen in the real export. Like the real file,
+# rows are in time order. A small share of rows are left empty or duplicated
+# so the cleaning steps have something to do.
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cleaning import time_strings
+
+SCALES = {"10k": 10_000, "1m": 1_000_000, "50m": 50_000_000}
+CHUNK_SIZE = 250_000
+START_DATE = "2020-01-01"
+END_DATE = "2024-12-31"
+
+# column -> (values, weights)
+CATEGORIES = {
+    "country_name": (["Canada", "India", "USA"], [0.32, 0.36, 0.32]),
+    "driver_gender": (["M", "F"], [0.62, 0.38]),
+    "driver_race": (["Asian", "Black", "Hispanic", "Other", "White"], [0.22, 0.2, 0.18, 0.15, 0.25]),
+    "violation": (["Speeding", "Seatbelt", "DUI", "Signal", "Other"], [0.36, 0.2, 0.12, 0.16, 0.16]),
+    "stop_outcome": (["Warning", "Ticket", "Arrest"], [0.4, 0.42, 0.18]),
+    "stop_duration": (["0-15 Min", "16-30 Min", "30+ Min"], [0.55, 0.3, 0.15]),
+    "search_type": (["Vehicle Search", "Frisk"], [0.6, 0.4]),
+}
+RAW_VIOLATIONS = {
+    "Speeding": "Speeding", "Seatbelt": "Seatbelt", "DUI": "Drunk Driving",
+    "Signal": "Signal Violation", "Other": "Other",
+}
+STATE_CODES = ["TN", "KA", "KL", "MH", "DL", "UP", "RJ", "WB", "GJ", "AP"]
+
+SEARCH_RATE = 0.33
+MISSING_RATE = 0.01     # violation / driver_age left empty
+DUPLICATE_RATE = 0.005  # rows repeated verbatim
+FLEET_RATIO = 4         # stops per distinct vehicle, on average
+REPEAT_SHARE = 0.1
+
+
+def parse_rows(text):
+    """'10k', '1m', '50m' or a plain integer."""
+    text = str(text).lower().replace("_", "")
+    if text in SCALES:
+        return SCALES[text]
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def _choice(rng, column, n):
+    values, weights = CATEGORIES[column]
+    return np.asarray(values, dtype=object)[rng.choice(len(values), n, p=weights)]
+
+
+def make_fleet(size, seed=0):
+    """``size`` distinct-looking plates such as TN45AB1234."""
+    rng = np.random.default_rng(seed)
+    state = np.asarray(STATE_CODES)[rng.integers(len(STATE_CODES), size=size)]
+    district = rng.integers(10, 100, size=size).astype(str)
+    series = rng.integers(65, 91, size=(size, 2)).astype(np.uint8).view("S1").astype(str)
+    number = np.char.zfill(rng.integers(0, 10_000, size=size).astype(str), 4)
+    return np.char.add(np.char.add(np.char.add(state, district), np.char.add(series[:, 0], series[:, 1])), number)
+
+
+def _pick_plates(rng, n, fleet):
+    # One stop in ten comes from the 1% of "frequent" vehicles, so the
+    # top-vehicle insights have something to rank.
+    frequent = rng.random(n) < REPEAT_SHARE
+    pick = rng.integers(len(fleet), size=n)
+    pick[frequent] = rng.integers(max(len(fleet) // 100, 1), size=int(frequent.sum()))
+    return fleet[pick]
+
+
+def generate_chunk(rng, offset, n, total, fleet, start=START_DATE, end=END_DATE):
+    """Rows offset .. offset+n of a ``total``-row export spread over start..end."""
+    days = pd.date_range(start, end, freq="D").strftime("%Y-%m-%d").to_numpy(dtype=object)
+    seconds = (np.arange(offset, offset + n) * (len(days) * 86400 / total)).astype(np.int64)
+
+    violation = _choice(rng, "violation", n)
+    searched = rng.random(n) < SEARCH_RATE
+    outcome = _choice(rng, "stop_outcome", n)
+    age = rng.integers(16, 80, size=n)
+    chunk = pd.DataFrame({
+        "stop_date": days[seconds // 86400],
+        "stop_time": time_strings()[seconds % 86400],
+        "country_name": _choice(rng, "country_name", n),
+        "driver_gender": _choice(rng, "driver_gender", n),
+        "driver_age_raw": age,
+        "driver_age": age.astype(float),
+        "driver_race": _choice(rng, "driver_race", n),
+        "violation_raw": pd.Series(violation).map(RAW_VIOLATIONS).to_numpy(),
+        "violation": violation,
+        "search_conducted": searched,
+        "search_type": np.where(searched, _choice(rng, "search_type", n), None),
+        "stop_outcome": outcome,
+        "is_arrested": outcome == "Arrest",
+        "stop_duration": _choice(rng, "stop_duration", n),
+        "drugs_related_stop": (violation == "DUI") & (rng.random(n) < 0.5),
+        "vehicle_number": _pick_plates(rng, n, fleet),
+    })
+    chunk.loc[rng.random(n) < MISSING_RATE, "violation"] = None
+    chunk.loc[rng.random(n) < MISSING_RATE, "driver_age"] = np.nan
+    dupes = np.flatnonzero(rng.random(n) < DUPLICATE_RATE)
+    if len(dupes):
+        chunk.iloc[np.minimum(dupes + 1, n - 1)] = chunk.iloc[dupes].to_numpy()
+    return chunk
+
+
+def generate(rows, seed=0, chunk_size=CHUNK_SIZE):
+    """Yield raw-export DataFrame chunks totalling ``rows`` rows."""
+    rng = np.random.default_rng(seed)
+    fleet = make_fleet(max(rows // FLEET_RATIO, 1), seed)
+    for offset in range(0, rows, chunk_size):
+        yield generate_chunk(rng, offset, min(chunk_size, rows - offset), rows, fleet)
+
+
+def write_csv(rows, path, seed=0, chunk_size=CHUNK_SIZE, progress=False):
+    """Write a synthetic export to ``path``; returns seconds taken."""
+    start = time.perf_counter()
+    if os.path.exists(path):
+        os.remove(path)
+    written = 0
+    for i, chunk in enumerate(generate(rows, seed, chunk_size)):
+        chunk.to_csv(path, mode="a", header=(i == 0), index=False)
+        written += len(chunk)
+        if progress:
+            print(f"  {written:,} / {rows:,} rows")
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic traffic stops export.")
+    parser.add_argument("--rows", default="10k", help="10k, 1m, 50m or a row count")
+    parser.add_argument("--out", help="default: synthetic_<rows>.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    rows = parse_rows(args.rows)
+    out = args.out or f"synthetic_{args.rows}.csv"
+    seconds = write_csv(rows, out, args.seed, args.chunk_size, progress=True)
+    print(f"Wrote {rows:,} rows to {out} in {seconds:.1f}s ({rows / seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# TEST FIXTURES
+# The modules live at the repository root (run pytest from there or from
+# tests/). Data comes from synth_data.py, cleaned with the pipeline's own
+# steps, with a few missing dates, times, countries and plates added.
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synth_data  # noqa: E402
+from clean_pipeline import BloomDeduper, clean_chunk  # noqa: E402
+from cleaning import RAW_DTYPES, apply_schema, to_arrow  # noqa: E402
+
+ROWS = 3000
+
+
+@pytest.fixture(scope="session")
+def stops():
+    """Cleaned stop rows, in id order."""
+    raw = apply_schema(pd.concat(synth_data.generate(ROWS, seed=7), ignore_index=True))
+    rng = np.random.default_rng(7)
+    for column in ("stop_date", "stop_time", "country_name", "vehicle_number"):
+        raw.loc[rng.random(len(raw)) < 0.02, column] = None
+    df = clean_chunk(raw, list(RAW_DTYPES), 40.0, BloomDeduper(ROWS))
+    return df.reset_index(drop=True)
+
+
+@pytest.fixture()
+def duckdb_stops(stops):
+    """A DuckDB connection holding ``stops`` as traffic_stops, with ids from 1."""
+    duckdb = pytest.importorskip("duckdb")
+    con = duckdb.connect()
+    # As in backends.DuckDBBackend.
+    con.execute("CREATE MACRO regexp_substr(s, p) AS NULLIF(regexp_extract(s, p), '')")
+    con.register("source", to_arrow(stops))
+    con.execute("CREATE TABLE traffic_stops AS SELECT row_number() OVER () AS id, * FROM source")
+    con.unregister("source")
+    yield con
+    con.close()
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from clean_pipeline import BloomDeduper, clean_chunk
+from cleaning import RAW_DTYPES, apply_schema
+from ingest_service import RotatingDeduper
+
+
+def digests(n, seed):
+    return np.random.default_rng(seed).integers(0, 2**63, size=n, dtype=np.uint64)
+
+
+def test_false_positive_rate_at_capacity():
+    deduper = BloomDeduper(expected_rows=20000, fp_rate=0.01)
+    deduper.add(digests(20000, 1))
+    observed = deduper.contains(digests(200000, 2)).mean()
+    assert 0.005 < observed < 0.02
+    # The reported rate is what the filter actually does at this fill.
+    assert abs(deduper.false_positive_rate() - observed) < 0.005
+
+
+def test_false_positive_rate_climbs_when_overfilled():
+    deduper = BloomDeduper(expected_rows=2000, fp_rate=0.01)
+    deduper.add(digests(10000, 1))
+    assert deduper.false_positive_rate() > 0.3
+    assert deduper.contains(digests(20000, 2)).mean() > 0.3
+
+
+def test_contains_does_not_mark():
+    deduper = BloomDeduper(expected_rows=1000)
+    batch = digests(100, 3)
+    assert not deduper.contains(batch).any()
+    assert not deduper.contains(batch).any()
+    assert not deduper.seen_before(batch).any()
+    assert deduper.contains(batch).all()
+    assert deduper.rows == 100
+
+
+def test_rotating_deduper_stays_bounded():
+    deduper = RotatingDeduper(window_rows=5000, fp_rate=0.01)
+    for seed in range(10):  # 10x the window
+        deduper.add(digests(5000, seed))
+    assert deduper.rotations == 9
+    assert deduper.false_positive_rate() < 0.025
+    assert deduper.contains(digests(100000, 99)).mean() < 0.025
+    # Repeats within the last window are always caught.
+    assert deduper.contains(digests(5000, 9)).all()
+
+
+def test_clean_chunk_drops_repeats_across_chunks():
+    raw = apply_schema(pd.DataFrame({
+        "stop_date": ["2020-01-01", "2020-01-01", "2020-01-02"],
+        "stop_time": ["10:00:00", "10:00:00", "11:00:00"],
+        "vehicle_number": ["KA01", "KA01", "KA02"],
+        "driver_age": [30.0, 30.0, 40.0],
+    }))
+    deduper = BloomDeduper(expected_rows=100)
+    first = clean_chunk(raw, list(RAW_DTYPES), 35.0, deduper)
+    second = clean_chunk(raw, list(RAW_DTYPES), 35.0, deduper)
+    assert len(first) == 2
+    assert len(second) == 0
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from approximate import build_sketches, sketch_source_sql
+from sketches import CountMinTopN, HyperLogLog, dumps, loads
+
+
+def plates(n, distinct, seed=0):
+    rng = np.random.default_rng(seed)
+    # Skewed, so a few plates are clearly heavier than the rest.
+    ids = np.minimum(rng.zipf(1.3, size=n), distinct) - 1
+    return np.asarray(["KA%06d" % i for i in ids], dtype=object)
+
+
+def test_hll_merge_equals_one_pass():
+    values = plates(20000, 5000)
+    whole = HyperLogLog()
+    whole.add(values)
+    left, right = HyperLogLog(), HyperLogLog()
+    left.add(values[:7000])
+    right.add(values[7000:])
+    assert np.array_equal(left.merge(right).registers, whole.registers)
+
+
+def test_hll_estimate_within_error():
+    values = np.asarray(["TN%07d" % i for i in range(50000)], dtype=object)
+    sketch = HyperLogLog()
+    sketch.add(values)
+    assert abs(sketch.estimate() - 50000) <= sketch.error()
+
+
+def test_cms_merge_equals_one_pass():
+    values = plates(20000, 3000)
+    whole = CountMinTopN()
+    whole.add(values)
+    left, right = CountMinTopN(), CountMinTopN()
+    left.add(values[:12000])
+    right.add(values[12000:])
+    merged = left.merge(right)
+    assert np.array_equal(merged.table, whole.table)
+    assert merged.total == whole.total == len(values)
+    assert [plate for plate, _ in merged.top(10)] == [plate for plate, _ in whole.top(10)]
+
+
+def test_cms_never_undercounts():
+    values = plates(20000, 3000)
+    sketch = CountMinTopN(width=256)
+    sketch.add(values)
+    unique, counts = np.unique(values.astype(str), return_counts=True)
+    estimates = sketch.estimate(unique.astype(object))
+    assert (estimates >= counts).all()
+    assert (estimates - counts).max() <= sketch.error()
+
+
+@pytest.mark.parametrize("make", [HyperLogLog, CountMinTopN])
+def test_serialization_round_trip(make):
+    sketch = make()
+    sketch.add(plates(5000, 800))
+    copy = loads(dumps(sketch))
+    assert type(copy) is type(sketch)
+    if isinstance(sketch, HyperLogLog):
+        assert np.array_equal(copy.registers, sketch.registers)
+        assert copy.estimate() == sketch.estimate()
+    else:
+        assert np.array_equal(copy.table, sketch.table)
+        assert copy.total == sketch.total
+        assert copy.top(20) == sketch.top(20)
+
+
+def test_build_sketches_merges_like_apply_sketch_delta(duckdb_stops):
+    # apply_sketch_delta merges the new rows' sketches into the stored ones.
+    def source(where=""):
+        return [duckdb_stops.execute(sketch_source_sql(where)).df()]
+
+    whole = build_sketches(source())
+    stored = build_sketches(source("id <= 2000"))
+    for key, sketch in build_sketches(source("id > 2000")).items():
+        stored[key] = stored[key].merge(loads(dumps(sketch))) if key in stored else sketch
+    assert stored.keys() == whole.keys()
+    for key, sketch in whole.items():
+        merged = stored[key]
+        if isinstance(sketch, HyperLogLog):
+            assert np.array_equal(merged.registers, sketch.registers), key
+        else:
+            assert np.array_equal(merged.table, sketch.table), key
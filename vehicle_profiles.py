@@ -0,0 +1,163 @@
+# VEHICLE PROFILES
+# One row per plate in vehicle_profiles: stop, DUI, search and arrest counts
+# and the first and last stop date, plus each plate's stops per country in
+# vehicle_countries. Both are summaries maintained by incremental.py.
+#
+# The counts are indexed, so the unfiltered top-N plate insights become a
+# walk down one index (query_builder.profile_spec) instead of a GROUP BY
+# vehicle_number over traffic_stops, and the Vehicle Search panel shows a
+# plate's history with a primary key lookup (lookup_profile).
+PROFILE_TABLE = "vehicle_profiles"
+COUNTRY_TABLE = "vehicle_countries"
+
+# profile column -> aggregate over one plate's stops
+MEASURES = {
+    "stops": "COUNT(*)",
+    "dui_stops": "SUM(CASE WHEN violation = 'DUI' THEN 1 ELSE 0 END)",
+    "searches": "SUM(CASE WHEN search_conducted = TRUE THEN 1 ELSE 0 END)",
+    "arrests": "SUM(CASE WHEN stop_outcome = 'Arrest' THEN 1 ELSE 0 END)",
+    "first_seen": "MIN(stop_date)",
+    "last_seen": "MAX(stop_date)",
+}
+# profile column -> how a delta row (VALUES(column)) merges into a stored one
+MERGE = {
+    "first_seen": "LEAST(COALESCE(first_seen, VALUES(first_seen)), COALESCE(VALUES(first_seen), first_seen))",
+    "last_seen": "GREATEST(COALESCE(last_seen, VALUES(last_seen)), COALESCE(VALUES(last_seen), last_seen))",
+}
+COUNT_COLUMNS = [name for name in MEASURES if name not in MERGE]
+PROFILE_COLUMNS = ["vehicle_number"] + list(MEASURES)
+COUNTRY_COLUMNS = ["vehicle_number", "country_name", "stops"]
+
+# Conditions of the "stops" specs a profile count answers (see profile_count).
+COUNTS = {
+    (): "stops",
+    (("violation", "DUI"),): "dui_stops",
+    (("search_conducted", True),): "searches",
+}
+
+PROFILE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    vehicle_number VARCHAR(20) NOT NULL PRIMARY KEY,
+    stops INT NOT NULL,
+    dui_stops INT NOT NULL,
+    searches INT NOT NULL,
+    arrests INT NOT NULL,
+    first_seen DATE,
+    last_seen DATE,
+    KEY idx_profiles_stops (stops),
+    KEY idx_profiles_dui (dui_stops),
+    KEY idx_profiles_searches (searches)
+)
+"""
+
+COUNTRY_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    vehicle_number VARCHAR(20) NOT NULL,
+    country_name VARCHAR(100) NOT NULL,
+    stops INT NOT NULL,
+    PRIMARY KEY (vehicle_number, country_name)
+)
+"""
+
+
+def profile_ddl(table=PROFILE_TABLE):
+    return PROFILE_DDL.format(table=table)
+
+
+def country_ddl(table=COUNTRY_TABLE):
+    return COUNTRY_DDL.format(table=table)
+
+
+def profile_select_sql(where=""):
+    """Per-plate aggregation over traffic_stops (``where`` is ANDed in)."""
+    return (
+        "SELECT vehicle_number, %s\nFROM traffic_stops\nWHERE vehicle_number IS NOT NULL%s\n"
+        "GROUP BY vehicle_number" % (
+            ", ".join("%s AS %s" % (expr, name) for name, expr in MEASURES.items()),
+            " AND " + where if where else "",
+        )
+    )
+
+
+def country_select_sql(where=""):
+    return (
+        "SELECT vehicle_number, COALESCE(country_name, 'Unknown') AS country_name, COUNT(*) AS stops\n"
+        "FROM traffic_stops\nWHERE vehicle_number IS NOT NULL%s\n"
+        "GROUP BY vehicle_number, COALESCE(country_name, 'Unknown')" % (" AND " + where if where else "")
+    )
+
+
+# MAINTENANCE
+def _rebuild(conn, table, ddl, columns, select_sql, last_id):
+    # Same swap as the cube: readers see the old table until the RENAME.
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS %s_new, %s_old" % (table, table))
+    cursor.execute(ddl(table + "_new"))
+    cursor.execute("INSERT INTO %s_new (%s)\n%s" % (table, ", ".join(columns), select_sql("id <= %s")), (last_id,))
+    rows = cursor.rowcount
+    conn.commit()
+    cursor.execute("RENAME TABLE {t} TO {t}_old, {t}_new TO {t}".format(t=table))
+    cursor.execute("DROP TABLE %s_old" % table)
+    cursor.close()
+    return rows
+
+
+def rebuild_profiles(conn, last_id):
+    """Re-profile every plate from rows with id <= last_id. Returns the plate count."""
+    return _rebuild(conn, PROFILE_TABLE, profile_ddl, PROFILE_COLUMNS, profile_select_sql, last_id)
+
+
+def apply_profile_delta(cursor, low_id, high_id):
+    """Aggregate the new rows per plate and add them to the stored profiles."""
+    updates = ["{0} = {0} + VALUES({0})".format(name) for name in COUNT_COLUMNS]
+    updates += ["%s = %s" % (name, expr) for name, expr in MERGE.items()]
+    cursor.execute("INSERT INTO %s (%s)\n%s\nON DUPLICATE KEY UPDATE %s" % (
+        PROFILE_TABLE, ", ".join(PROFILE_COLUMNS), profile_select_sql("id > %s AND id <= %s"), ", ".join(updates)
+    ), (low_id, high_id))
+
+
+def rebuild_countries(conn, last_id):
+    """Recount every plate's stops per country. Returns the row count."""
+    return _rebuild(conn, COUNTRY_TABLE, country_ddl, COUNTRY_COLUMNS, country_select_sql, last_id)
+
+
+def apply_country_delta(cursor, low_id, high_id):
+    cursor.execute("INSERT INTO %s (%s)\n%s\nON DUPLICATE KEY UPDATE stops = stops + VALUES(stops)" % (
+        COUNTRY_TABLE, ", ".join(COUNTRY_COLUMNS), country_select_sql("id > %s AND id <= %s")
+    ), (low_id, high_id))
+
+
+# ANSWERS
+def profile_count(spec):
+    """The profile column holding a top-N plates spec's count, or None.
+
+    Matches "stops" specs that count stops per vehicle_number under one of
+    COUNTS' conditions.
+    """
+    if spec.source != "stops" or [name for _alias, name in spec.dimensions] != ["vehicle_number"]:
+        return None
+    if [name for _alias, name in spec.measures] != ["stops"]:
+        return None
+    return COUNTS.get(tuple(tuple(condition) for condition in spec.where))
+
+
+def _match(backend):
+    # DuckDB compares case-sensitively, unlike MySQL's default collation.
+    return "vehicle_number = %s" if backend.dialect == "mysql" else "UPPER(vehicle_number) = %s"
+
+
+def profile_sql(backend):
+    """SELECT of one plate's profile row (the upper-cased plate is the parameter)."""
+    return "SELECT %s FROM %s WHERE %s" % (", ".join(PROFILE_COLUMNS), PROFILE_TABLE, _match(backend))
+
+
+def lookup_profile(backend, plate):
+    """(profile row as a dict or None, DataFrame of stops per country) for ``plate``."""
+    profile = backend.run_query(profile_sql(backend), (plate,), name="Vehicle profile")
+    countries = backend.run_query(
+        "SELECT country_name, stops FROM %s WHERE %s ORDER BY stops DESC, country_name" % (
+            COUNTRY_TABLE, _match(backend)
+        ),
+        (plate,), name="Vehicle profile: countries",
+    )
+    return (profile.iloc[0].to_dict() if len(profile) else None), countries